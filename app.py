@@ -6,7 +6,6 @@ import gradio as gr
 import os
 import uuid
 import time
-import threading
 from datetime import datetime
 import tempfile
 import random
@@ -17,21 +16,29 @@ from pathlib import Path
 import zipfile
 import shutil
 
+import clip_library
+from clip_selector import split_by_orientation, term_matrix
+from job_queue import JobQueue, QueueFull
+
 # Simple mock data storage
 jobs_data = {}
-video_generation_threads = {}
 
-# Load Canto clips database
-try:
-    CANTO_CLIPS_DF = pd.read_csv('canto_clip_tags_with_urls.csv')
+# Load Canto clips database (clip_library reloads it when the CSV changes)
+def load_canto_clips():
+    try:
+        return clip_library.load('canto_clip_tags_with_urls.csv', ok_only=False)
+    except Exception as e:
+        print(f"⚠️ Could not load Canto clips: {e}")
+        return pd.DataFrame()
+
+CANTO_CLIPS_DF = load_canto_clips()
+if not CANTO_CLIPS_DF.empty:
     print(f"✅ Loaded {len(CANTO_CLIPS_DF)} Canto clips")
-except Exception as e:
-    print(f"⚠️ Could not load Canto clips: {e}")
-    CANTO_CLIPS_DF = pd.DataFrame()
 
 def select_canto_clips_by_aspect(prompt, theme_key, aspect_ratio="16:9", n_clips=3):
     """Select best Canto clips based on prompt, theme, and aspect ratio"""
-    if CANTO_CLIPS_DF.empty:
+    clips_df = load_canto_clips()
+    if clips_df.empty:
         return []
 
     # Theme keywords mapping
@@ -50,33 +57,30 @@ def select_canto_clips_by_aspect(prompt, theme_key, aspect_ratio="16:9", n_clips
     keywords.extend([w for w in prompt_words if len(w) > 3])
 
     # Filter clips by aspect ratio preference
-    filtered_df = CANTO_CLIPS_DF.copy()
+    filtered_df = clips_df
 
     if aspect_ratio == "9:16":
-        # For vertical videos, prefer clips with vertical indicators
-        vertical_indicators = ['9x16', '9:16', 'vertical', 'portrait']
-        mask = filtered_df['filename'].str.lower().str.contains('|'.join(vertical_indicators), na=False)
-        if mask.any():
-            filtered_df = filtered_df[mask]
-            print(f"🎥 Filtered to {len(filtered_df)} vertical clips for 9:16")
-
-    # Score clips based on tags
-    scores = []
-    for _, row in filtered_df.iterrows():
-        score = 0
-        tags = str(row.get('top_tags', '')).lower()
-        
-        for keyword in keywords:
-            if keyword in tags:
-                score += 1
-
-        if any(word in tags for word in ['waterslide', 'splash', 'jumping', 'excited']):
-            score += 2
-
-        if 'christmas' not in prompt.lower() and any(word in str(row.get('filename', '')).lower() for word in ['christmas', 'parade']):
-            score -= 1
-
-        scores.append(score)
+        # Prefer clips the library build measured as portrait
+        portrait, _ = split_by_orientation(filtered_df, "portrait")
+        if len(portrait):
+            filtered_df = portrait
+            print(f"🎥 Filtered to {len(filtered_df)} portrait clips for 9:16")
+        else:
+            # No recorded dimensions: fall back to vertical indicators in the filename
+            vertical_indicators = ['9x16', '9:16', 'vertical', 'portrait']
+            mask = filtered_df['filename'].str.lower().str.contains('|'.join(vertical_indicators), na=False)
+            if mask.any():
+                filtered_df = filtered_df[mask]
+                print(f"🎥 Filtered to {len(filtered_df)} vertical clips for 9:16")
+
+    # Score clips based on tags (term-membership matrices, see clip_selector.term_matrix)
+    action_words = ['waterslide', 'splash', 'jumping', 'excited']
+    tags = filtered_df['top_tags'] if 'top_tags' in filtered_df.columns else pd.Series('', index=filtered_df.index)
+    tag_m = term_matrix(tags, keywords + action_words)
+    scores = tag_m[:len(keywords)].sum(axis=0) + 2 * tag_m[len(keywords):].max(axis=0)
+
+    if 'christmas' not in prompt.lower() and 'filename' in filtered_df.columns:
+        scores -= term_matrix(filtered_df['filename'], ['christmas', 'parade']).max(axis=0)
 
     df_scored = filtered_df.copy()
     df_scored['score'] = scores
@@ -85,21 +89,15 @@ def select_canto_clips_by_aspect(prompt, theme_key, aspect_ratio="16:9", n_clips
     selected = df_scored.head(n_clips * 2)
     return selected.to_dict('records')
 
-def download_clip(url, local_path):
-    """Download video clip from URL"""
+def download_clip(url, asset_id=None):
+    """Resolve video clip URL through the shared asset store, returns local path or None"""
     try:
-        import requests
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
-
-        with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
-        return os.path.exists(local_path) and os.path.getsize(local_path) > 0
+        import asset_store
+        local_path = asset_store.fetch(url, asset_id, timeout=30)
+        return str(local_path) if os.path.getsize(local_path) > 0 else None
     except Exception as e:
         print(f"Download failed: {e}")
-        return False
+        return None
 
 def create_intro_frame_with_aspect(prompt, theme_key, width, height, aspect_ratio):
     """Create intro frame with specific aspect ratio"""
@@ -182,12 +180,11 @@ def create_video_with_aspect_ratio(job_id, prompt, theme_key, aspect_ratio="16:9
             if not clip_url:
                 continue
 
-            temp_clip = os.path.join("temp", f"clip_{aspect_ratio.replace(':', 'x')}_{i}_{job_id}.mp4")
-
             print(f"📥 Downloading {aspect_ratio} clip {i+1}: {clip.get('filename', 'unknown')}")
-            if download_clip(clip_url, temp_clip):
-                clip_paths.append(temp_clip)
-                print(f"✅ Downloaded: {temp_clip}")
+            local_clip = download_clip(clip_url, clip.get('asset_id'))
+            if local_clip:
+                clip_paths.append(local_clip)
+                print(f"✅ Downloaded: {local_clip}")
             else:
                 print(f"❌ Failed to download {aspect_ratio} clip {i+1}")
 
@@ -242,13 +239,6 @@ def create_video_with_aspect_ratio(job_id, prompt, theme_key, aspect_ratio="16:9
                 print(f"⚠️ Error processing {aspect_ratio} clip {clip_path}: {e}")
                 continue
 
-        # Clean up temp files
-        for clip_path in clip_paths:
-            try:
-                os.remove(clip_path)
-            except:
-                pass
-
         if len(all_frames) < 60:  # Less than 2 seconds
             print(f"⚠️ Not enough frames for {aspect_ratio} video")
             return None
@@ -451,6 +441,9 @@ def generate_real_video(job_id, prompt, theme_key=None):
         job['progress'] = f'Error: {str(e)}'
         print(f"Video generation error: {e}")
 
+# Fixed worker count + bounded FIFO (VIDEOSCORE_JOB_WORKERS / VIDEOSCORE_JOB_QUEUE)
+job_queue = JobQueue(generate_real_video, name="video")
+
 def get_theme_content(theme_key):
     """Return prompt and storyboard for selected theme"""
     theme = THEME_PROMPTS.get(theme_key, THEME_PROMPTS["jumanji"])
@@ -473,24 +466,25 @@ def generate_video(prompt, theme_key=None):
     jobs_data[job_id] = {
         'prompt': prompt.strip(),
         'theme': theme_key,
-        'status': 'starting',
+        'status': 'queued',
         'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'progress': 'Dual-format video generation starting...'
+        'progress': 'Waiting for a free worker...'
     }
 
-    thread = threading.Thread(target=generate_real_video, args=(job_id, prompt, theme_key))
-    thread.daemon = True
-    thread.start()
-
-    video_generation_threads[job_id] = thread
+    # Bounded worker pool, FIFO; when the queue is full the user retries later
+    try:
+        position = job_queue.submit(job_id, prompt, theme_key)
+    except QueueFull as e:
+        del jobs_data[job_id]
+        return f"⏳ The generator is busy right now. Please try again in about {e.retry_after} seconds."
 
-    return f"""🎬 Dual-Format MP4 Video generation started!
+    return f"""🎬 Dual-Format MP4 Video generation queued (position {position})!
 
 **Job ID:** `{job_id}`
 **Prompt:** {prompt}
 **Theme:** {THEME_PROMPTS.get(theme_key, {}).get('title', 'Custom')}
 **Started:** {jobs_data[job_id]['created']}
-**Status:** Processing...
+**Status:** Queued...
 
 **Output Formats:**
 📺 16:9 (1920x1080) - Perfect for YouTube, Facebook, desktop
@@ -517,6 +511,10 @@ def check_status(job_id):
 
     status = job['status']
     progress = job['progress']
+    if status == 'queued':
+        position = job_queue.position(job_id)
+        if position is not None:
+            progress = f"Waiting in queue (position {position}, about {job_queue.eta_seconds(position)}s)"
     current_time = datetime.now().strftime('%H:%M:%S')
 
     status_text = f"""🎬 **Dual-Format Video Generation Status** - Updated: {current_time}
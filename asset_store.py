@@ -0,0 +1,421 @@
+# asset_store.py
+# Shared, persistent store for downloaded Canto assets.
+#
+# - writes go to <name>.mp4.part and are renamed into place only when complete
+# - every entry has a <name>.json sidecar with url / size / sha256
+# - an interrupted download resumes from the .part file (HTTP Range + If-Range)
+# - the sha256 is checked against the bytes on disk once per entry (entries
+#   from a resumed download or from before the check are re-hashed on first
+#   open; "verified" in the sidecar records it) and a mismatch is re-downloaded
+# - least-recently-used entries are evicted once the store exceeds its disk budget
+#
+# Every entry point resolves URLs through fetch(), so each asset crosses the
+# network once per node.
+#
+# Optional mezzanine proxies (<name>.proxy.mp4, short-GOP <=1080p) live next to
+# the originals; cut/analysis use them when present (see build_proxies.py).
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from downloader import download_resumable
+
+ASSET_STORE_DIR = Path(os.environ.get("VIDEOSCORE_ASSET_DIR", "cache/assets"))
+
+# Entries touched more recently than this are never evicted (they may be in use by a running job).
+EVICT_MIN_AGE_SECONDS = 3600
+
+LOCK_STALE_SECONDS = 15 * 60
+
+# Concurrent prefetch: total download threads and max simultaneous connections per host.
+PREFETCH_WORKERS = int(os.environ.get("VIDEOSCORE_PREFETCH_WORKERS", "8") or 8)
+PREFETCH_PER_HOST = int(os.environ.get("VIDEOSCORE_PREFETCH_PER_HOST", "4") or 4)
+
+
+# Proxies: VIDEOSCORE_USE_PROXY=0 ignores them; GOP 1 means all-intra.
+PROXY_MAX_SIDE = 1920
+PROXY_GOP = int(os.environ.get("VIDEOSCORE_PROXY_GOP", "8") or 8)
+
+
+def store_budget_bytes():
+    v = os.environ.get("VIDEOSCORE_ASSET_STORE_GB", "").strip()
+    try:
+        gb = float(v) if v else 20.0
+    except ValueError:
+        gb = 20.0
+    return int(max(0.0, gb) * 1024 ** 3)
+
+
+def _entry_name(url, asset_id=None):
+    aid = "" if asset_id is None else str(asset_id).strip()
+    if aid and aid.lower() not in {"nan", "none"} and re.fullmatch(r"[A-Za-z0-9_.-]{1,100}", aid):
+        return aid
+    # No usable asset id (Canto listings don't always carry one): key by URL.
+    return "u_" + hashlib.sha1(str(url).encode("utf-8")).hexdigest()[:20]
+
+
+def asset_path(url, asset_id=None) -> Path:
+    return ASSET_STORE_DIR / f"{_entry_name(url, asset_id)}.mp4"
+
+
+def _sidecar(path: Path) -> Path:
+    return path.with_suffix(".json")
+
+
+def read_sidecar(path: Path):
+    try:
+        with open(_sidecar(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_valid(path: Path, verify_hash=False):
+    """An entry is valid when its sidecar exists and the recorded size (and optionally hash) match."""
+    meta = read_sidecar(path)
+    if not meta:
+        return False
+    try:
+        if path.stat().st_size != int(meta.get("size", -1)):
+            return False
+    except OSError:
+        return False
+    if verify_hash:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest() == meta.get("sha256")
+    return True
+
+
+def _write_sidecar(path: Path, meta):
+    tmp_meta = _sidecar(path).with_suffix(".json.tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, _sidecar(path))
+
+
+def is_ready(path: Path):
+    """Valid and already hash-verified: safe to use without taking the entry lock."""
+    return is_valid(path) and bool((read_sidecar(path) or {}).get("verified"))
+
+
+def _verify_once(path: Path):
+    """
+    Valid entry whose sha256 has been checked against the file at least once.
+    Re-hashes an unverified entry (call under the entry lock); a mismatch removes it.
+    """
+    if not is_valid(path):
+        return False
+    meta = read_sidecar(path)
+    if meta.get("verified"):
+        return True
+    if not is_valid(path, verify_hash=True):
+        print(f"⚠️ Asset failed its sha256 check, downloading again: {path.name}")
+        path.unlink(missing_ok=True)
+        _sidecar(path).unlink(missing_ok=True)
+        return False
+    meta.update(verified=True, verified_at=time.time())
+    _write_sidecar(path, meta)
+    return True
+
+
+def _touch(path: Path):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _entry_lock(path: Path, timeout=LOCK_STALE_SECONDS):
+    """Thread + cross-process lock for one entry (O_EXCL lock file)."""
+    with _thread_locks_guard:
+        tlock = _thread_locks.setdefault(str(path), threading.Lock())
+
+    with tlock:
+        lock_path = path.with_suffix(".lock")
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode("ascii"))
+                os.close(fd)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - lock_path.stat().st_mtime > LOCK_STALE_SECONDS:
+                        # Left behind by a crashed process.
+                        lock_path.unlink(missing_ok=True)
+                        continue
+                except OSError:
+                    continue
+                if time.time() > deadline:
+                    raise TimeoutError(f"Timed out waiting for asset lock: {lock_path}")
+                time.sleep(0.2)
+        try:
+            yield
+        finally:
+            lock_path.unlink(missing_ok=True)
+
+
+def fetch(url, asset_id=None, timeout=60, session=None) -> Path:
+    """Return a local, verified path for url, downloading (or resuming) it if needed."""
+    path = asset_path(url, asset_id)
+    if is_ready(path):
+        _touch(path)
+        return path
+
+    if not isinstance(url, str) or not url.startswith("http"):
+        raise ValueError(f"Invalid download url: {url!r}")
+
+    with _entry_lock(path):
+        # Another thread/process may have finished it while we waited (or it only needs its hash check).
+        if _verify_once(path):
+            _touch(path)
+            return path
+
+        part_path = path.with_suffix(".mp4.part")
+        size, digest, resumed = download_resumable(url, part_path, timeout=timeout, session=session)
+        os.replace(part_path, path)
+
+        _write_sidecar(path, {
+            "url": url,
+            "asset_id": None if asset_id is None else str(asset_id),
+            "size": size,
+            "sha256": digest,
+            "stored_at": time.time(),
+            # one uninterrupted stream was hashed as it was written; a resumed one is re-read on first open
+            "verified": not resumed,
+        })
+
+    evict()
+    return path
+
+
+# ---------------------------
+# Mezzanine proxies
+# ---------------------------
+def use_proxies():
+    return os.environ.get("VIDEOSCORE_USE_PROXY", "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def proxy_path(source: Path) -> Path:
+    source = Path(source)
+    return source.with_name(f"{source.stem}.proxy.mp4")
+
+
+def proxy_info(source: Path):
+    """Sidecar of a valid proxy for source, or None (missing, partial, or built from other bytes)."""
+    proxy = proxy_path(source)
+    meta = read_sidecar(proxy)
+    src_meta = read_sidecar(Path(source))
+    if not meta or not src_meta or meta.get("source_sha256") != src_meta.get("sha256"):
+        return None
+    try:
+        if proxy.stat().st_size != int(meta.get("size", -1)):
+            return None
+    except OSError:
+        return None
+    return meta
+
+
+def ensure_proxy(source: Path, gop=None) -> Path:
+    """Build (once) the proxy for a stored asset. Returns the proxy path."""
+    from ffmpeg_utils import get_resolution, make_proxy
+
+    source = Path(source)
+    proxy = proxy_path(source)
+    if proxy_info(source):
+        return proxy
+
+    src_meta = read_sidecar(source)
+    if not src_meta:
+        raise ValueError(f"Not a stored asset (no sidecar): {source}")
+
+    gop = PROXY_GOP if gop is None else int(gop)
+    with _entry_lock(proxy):
+        if proxy_info(source):
+            return proxy
+        tmp = proxy.with_name(f"{proxy.stem}.{os.getpid()}-{threading.get_ident()}.tmp.mp4")
+        try:
+            make_proxy(source, tmp, max_side=PROXY_MAX_SIDE, gop=gop)
+            os.replace(tmp, proxy)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+        w, h = get_resolution(proxy)
+        sw, sh = get_resolution(source)
+        meta = {
+            "source_sha256": src_meta.get("sha256"),
+            "size": proxy.stat().st_size,
+            "width": w,
+            "height": h,
+            "source_width": sw,
+            "source_height": sh,
+            "gop": gop,
+            "stored_at": time.time(),
+        }
+        _write_sidecar(proxy, meta)
+    return proxy
+
+
+def analysis_source(source: Path) -> Path:
+    """Proxy if one exists: motion/start analysis only needs low-res frames."""
+    source = Path(source)
+    if use_proxies() and proxy_info(source):
+        return proxy_path(source)
+    return source
+
+
+def cut_source(source: Path, target_w: int, target_h: int) -> Path:
+    """
+    Proxy if it still has enough pixels for a cover-scaled target_w x target_h crop
+    (e.g. a 1080p landscape proxy can't feed a 1080x1920 crop without upscaling).
+    """
+    source = Path(source)
+    meta = proxy_info(source) if use_proxies() else None
+    if not meta:
+        return source
+    w, h = int(meta.get("width") or 0), int(meta.get("height") or 0)
+    sw, sh = int(meta.get("source_width") or 0), int(meta.get("source_height") or 0)
+    if w <= 0 or h <= 0:
+        return source
+    if (w, h) == (sw, sh) or max(target_w / w, target_h / h) <= 1.0:
+        return proxy_path(source)
+    return source
+
+
+def evict(budget_bytes=None):
+    """
+    Remove least-recently-used entries until the store fits its disk budget.
+    An entry is a source plus its proxy: both count towards the budget and go together.
+    """
+    budget_bytes = store_budget_bytes() if budget_bytes is None else int(budget_bytes)
+    if not ASSET_STORE_DIR.exists():
+        return 0
+
+    entries = {}  # source path -> [newest mtime, bytes, files]
+    total = 0
+    for p in ASSET_STORE_DIR.glob("*.mp4"):
+        if p.name.endswith(".tmp.mp4"):
+            continue  # proxy being built
+        source = p.with_name(p.name[:-len(".proxy.mp4")] + ".mp4") if p.name.endswith(".proxy.mp4") else p
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        e = entries.setdefault(source, [0.0, 0, []])
+        e[0] = max(e[0], st.st_mtime)
+        e[1] += st.st_size
+        e[2].append(p)
+        total += st.st_size
+
+    removed = 0
+    now = time.time()
+    for source, (mtime, size, files) in sorted(entries.items(), key=lambda kv: kv[1][0]):
+        if total <= budget_bytes:
+            break
+        if now - mtime < EVICT_MIN_AGE_SECONDS or any(f.with_suffix(".lock").exists() for f in (source, proxy_path(source))):
+            continue
+        try:
+            # proxy first: a source without its proxy is still a valid entry, not the other way round
+            for f in sorted(files, key=lambda f: f != proxy_path(source)):
+                f.unlink(missing_ok=True)
+                _sidecar(f).unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+# ---------------------------
+# Prefetch (shared keep-alive session, per-host concurrency limit)
+# ---------------------------
+_session = None
+_prefetch_executor = None
+_host_semaphores = {}
+_inflight = {}
+_prefetch_guard = threading.Lock()
+
+
+def http_session():
+    global _session
+    with _prefetch_guard:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=PREFETCH_WORKERS, pool_maxsize=PREFETCH_WORKERS)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _session = s
+        return _session
+
+
+def _host_semaphore(url):
+    host = urlparse(str(url)).netloc
+    with _prefetch_guard:
+        return _host_semaphores.setdefault(host, threading.BoundedSemaphore(max(1, PREFETCH_PER_HOST)))
+
+
+def _executor():
+    global _prefetch_executor
+    with _prefetch_guard:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=max(1, PREFETCH_WORKERS), thread_name_prefix="prefetch")
+        return _prefetch_executor
+
+
+def _fetch_limited(url, asset_id):
+    path = asset_path(url, asset_id)
+    if is_ready(path):
+        _touch(path)
+        return path
+    with _host_semaphore(url):
+        return fetch(url, asset_id, session=http_session())
+
+
+def prefetch(items):
+    """
+    Start downloading every (url, asset_id) at once.
+    Returns one Future[Path] per item, in the same order.
+    A download already in flight is shared rather than queued twice.
+    """
+    ex = _executor()
+    futures = []
+    for url, asset_id in items:
+        key = str(asset_path(url, asset_id))
+        with _prefetch_guard:
+            fut = _inflight.get(key)
+            is_new = fut is None or fut.done()
+            if is_new:
+                fut = ex.submit(_fetch_limited, url, asset_id)
+                _inflight[key] = fut
+        if is_new:
+            # Outside the guard: the callback runs inline if the fetch already finished.
+            fut.add_done_callback(lambda f, k=key: _forget(k, f))
+        futures.append(fut)
+    return futures
+
+
+def _forget(key, fut):
+    with _prefetch_guard:
+        if _inflight.get(key) is fut:
+            del _inflight[key]
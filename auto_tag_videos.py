@@ -1,8 +1,11 @@
 # auto_tag_videos.py
 
+import argparse
 import json
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import requests
 from pathlib import Path
 from tqdm import tqdm
 import cv2
@@ -11,20 +14,22 @@ from PIL import Image
 import torch
 import open_clip
 
+import asset_store
+import canto_sync
+import clip_analyzer
+import clip_embeddings
 from tag_config import TAG_CATEGORIES
 
 INPUT_SCORES = "canto_scores_with_urls.csv"
 OUTPUT_TAGS = "canto_clip_tags.csv"
-TEMP_VIDEO = "temp_tag.mp4"
 
-
-def download_file(url, out_path):
-    resp = requests.get(url, stream=True, timeout=60)
-    resp.raise_for_status()
-    with open(out_path, "wb") as f:
-        for chunk in resp.iter_content(chunk_size=1024 * 1024):
-            if chunk:
-                f.write(chunk)
+# Pipeline knobs (CLI flags override):
+#   BATCH_FRAMES  frames per CLIP forward pass, gathered from many clips
+#   FLUSH_EVERY   finished clips buffered before tags + embeddings hit disk
+#   WINDOW        clips downloading/extracting ahead of the model
+BATCH_FRAMES = int(os.environ.get("VIDEOSCORE_TAG_BATCH", "64"))
+FLUSH_EVERY = 200
+WINDOW = 64
 
 
 def extract_frames(video_path, num_frames=5):
@@ -61,29 +66,11 @@ def build_tag_list():
     return tags
 
 
-def main():
-    df = pd.read_csv(INPUT_SCORES)
-
-    # ใช้เฉพาะที่ status ok และ decision usable (แนะนำ)
-    df = df[(df["status"] == "ok") & (df["decision"] == "usable")].copy()
-    df["asset_id"] = df["asset_id"].astype(str)
-
-    # resume
-    out_path = Path(OUTPUT_TAGS)
-    done_ids = set()
-    if out_path.exists():
-        old = pd.read_csv(out_path)
-        if "asset_id" in old.columns:
-            done_ids = set(old["asset_id"].astype(str))
-        print(f"มีผล tag เดิมแล้ว {len(done_ids)} รายการ → จะข้ามที่ทำไปแล้ว")
-
-    df_todo = df[~df["asset_id"].isin(done_ids)].copy()
-    print("จะทำ tagging รอบนี้:", len(df_todo))
-
-    # Load CLIP
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+def load_clip_model(device):
+    """(model, preprocess, tag text features, tag_pairs) for ViT-B-32 on device."""
     model, _, preprocess = open_clip.create_model_and_transforms("ViT-B-32", pretrained="openai")
     model = model.to(device)
+    model.eval()
     tokenizer = open_clip.get_tokenizer("ViT-B-32")
 
     tag_pairs = build_tag_list()
@@ -94,91 +81,250 @@ def main():
         text_tokens = tokenizer(tag_texts).to(device)
         text_features = model.encode_text(text_tokens)
         text_features /= text_features.norm(dim=-1, keepdim=True)
+    return model, preprocess, text_features, tag_pairs
 
-    first_write = not out_path.exists()
 
-    def append_row(row_dict):
-        nonlocal first_write
-        pd.DataFrame([row_dict]).to_csv(
-            OUTPUT_TAGS,
-            mode="a",
-            header=first_write,
-            index=False,
-            encoding="utf-8-sig",
-        )
-        first_write = False
-
-    for _, row in tqdm(df_todo.iterrows(), total=len(df_todo), desc="Auto tagging"):
-        asset_id = row["asset_id"]
-        filename = row.get("filename")
-        download_url = row.get("download_url")
-
-        if not isinstance(download_url, str) or not download_url.startswith("http"):
-            append_row({
-                "asset_id": asset_id,
-                "filename": filename,
-                "status": "no_download_url",
-                "top_tags": "",
-                "tag_scores_json": "{}",
-            })
-            continue
+def forget(asset_ids, out_path, vectors):
+    """Drop tags + embeddings of asset_ids (changed/deleted in Canto) so this run redoes them."""
+    asset_ids = {str(a) for a in asset_ids}
+    if out_path.exists() and asset_ids:
+        old = pd.read_csv(out_path)
+        stale = old["asset_id"].map(str).isin(asset_ids)  # missing ids read back as "nan"
+        if stale.any():
+            tmp = out_path.with_name(f"{out_path.name}.{os.getpid()}.tmp")
+            old[~stale].to_csv(tmp, index=False, encoding="utf-8-sig")
+            os.replace(tmp, out_path)
+    dropped = [a for a in asset_ids if vectors.pop(a, None) is not None]
+    if dropped:
+        clip_embeddings.write_embeddings(vectors)
+    print(f"ลบ tag/embedding เก่าของ asset ที่เปลี่ยน/ถูกลบใน Canto ({len(asset_ids)} รายการ)")
+
+
+def status_row(asset_id, filename, status, error=None):
+    return {
+        "asset_id": asset_id,
+        "filename": filename,
+        "status": status,
+        "top_tags": "",
+        "tag_scores_json": json.dumps({"error": error}, ensure_ascii=False) if error else "{}",
+    }
+
+
+def load_clip_inputs(row, local_video, preprocess):
+    """
+    Frame-extractor stage: 5 frames of one downloaded clip, already preprocessed.
+    Returns (row, (n, 3, 224, 224) tensor) or (row, error status_row).
+    """
+    try:
+        path = local_video.result()
+    except Exception as e:
+        return row, status_row(row["asset_id"], row.get("filename"), "error_download", str(e))
+
+    frames = extract_frames(str(path), num_frames=5)
+    if not frames:
+        return row, status_row(row["asset_id"], row.get("filename"), "error_frames", "no_frames")
+    return row, torch.stack([preprocess(img) for img in frames])
+
+
+def score_row(row, image_features, text_features, tag_pairs):
+    """Tag row of one clip from its (n, d) normalized frame features."""
+    # average similarity across frames
+    sims = (image_features @ text_features.T).mean(dim=0).cpu().numpy()
+
+    # map scores back to phrases
+    scored = []
+    for (cat, phrase), score in zip(tag_pairs, sims):
+        scored.append({"category": cat, "tag": phrase, "score": float(score)})
+
+    scored_sorted = sorted(scored, key=lambda x: x["score"], reverse=True)
+
+    top = scored_sorted[:8]  # top 8 tags
+    top_tags = ", ".join([t["tag"] for t in top])
+
+    return {
+        "asset_id": row["asset_id"],
+        "filename": row.get("filename"),
+        "status": "ok",
+        "top_tags": top_tags,
+        "tag_scores_json": json.dumps(scored_sorted[:50], ensure_ascii=False),  # เก็บ top 50 ไว้พอ
+    }
+
+
+def iter_tags(rows, model, preprocess, text_features, tag_pairs, device,
+              batch_frames=BATCH_FRAMES, extract_workers=4, window=WINDOW):
+    """
+    Tag rows (asset_id, filename, download_url) through the streaming pipeline:
+    asset_store downloads → frame extractors → one CLIP forward pass over frames
+    gathered from many clips. Yields (row, tag row, embedding | None) in completion order.
+    """
+    # ---------------------------
+    # Model stage: one forward pass over frames gathered from many clips.
+    # ---------------------------
+    batch = []  # (row, frames tensor)
+
+    def run_batch():
+        if not batch:
+            return []
+        with torch.no_grad():
+            image_features = model.encode_image(torch.cat([t for _, t in batch]).to(device))
+            image_features /= image_features.norm(dim=-1, keepdim=True)
+        done = []
+        for (row, _), feats in zip(batch, image_features.split([len(t) for _, t in batch])):
+            vector = clip_embeddings.normalized_mean(feats.float().cpu().numpy())
+            done.append((row, score_row(row, feats, text_features, tag_pairs), vector))
+        batch.clear()
+        return done
 
-        # download
+    window = max(1, window)
+    extracted = queue.Queue()  # (row, frames tensor | error row), in completion order
+
+    def extract(row, download):
         try:
-            download_file(download_url, TEMP_VIDEO)
+            extracted.put(load_clip_inputs(row, download, preprocess))
         except Exception as e:
-            append_row({
-                "asset_id": asset_id,
-                "filename": filename,
-                "status": "error_download",
-                "top_tags": "",
-                "tag_scores_json": json.dumps({"error": str(e)}, ensure_ascii=False),
-            })
-            continue
+            extracted.put((row, status_row(row["asset_id"], row.get("filename"), "error_frames", str(e))))
+
+    with ThreadPoolExecutor(max_workers=max(1, extract_workers)) as extract_pool:
+        next_row = 0
+        in_flight = 0
+        while next_row < len(rows) or in_flight:
+            # keep the window full: downloads and frame extraction run ahead of the model
+            while next_row < len(rows) and in_flight < window:
+                row = rows[next_row]
+                next_row += 1
+                url = row.get("download_url")
+                if not isinstance(url, str) or not url.startswith("http"):
+                    yield row, status_row(row["asset_id"], row.get("filename"), "no_download_url"), None
+                    continue
+                # Download stage runs on asset_store's pool (per-host limits, shared session);
+                # a clip goes to the extractors the moment its own download lands.
+                download = asset_store.prefetch([(url, row["asset_id"])])[0]
+                download.add_done_callback(lambda f, row=row: extract_pool.submit(extract, row, f))
+                in_flight += 1
+            if not in_flight:
+                continue
+
+            row, result = extracted.get()
+            in_flight -= 1
+            if isinstance(result, dict):
+                yield row, result, None
+                continue
+
+            batch.append((row, result))
+            if sum(len(t) for _, t in batch) >= batch_frames:
+                yield from run_batch()
+
+        yield from run_batch()
 
-        # extract frames
-        frames = extract_frames(TEMP_VIDEO, num_frames=5)
-        if not frames:
-            append_row({
-                "asset_id": asset_id,
-                "filename": filename,
-                "status": "error_frames",
-                "top_tags": "",
-                "tag_scores_json": json.dumps({"error": "no_frames"}, ensure_ascii=False),
-            })
-            Path(TEMP_VIDEO).unlink(missing_ok=True)
-            continue
 
-        # encode frames
-        with torch.no_grad():
-            image_inputs = torch.stack([preprocess(img) for img in frames]).to(device)
-            image_features = model.encode_image(image_inputs)
-            image_features /= image_features.norm(dim=-1, keepdim=True)
-
-            # average similarity across frames
-            sims = (image_features @ text_features.T).mean(dim=0).cpu().numpy()
+def main():
+    parser = argparse.ArgumentParser(description="CLIP auto-tagging (+ stored image embeddings)")
+    parser.add_argument(
+        "--backfill-embeddings", action="store_true",
+        help="also re-encode clips tagged before embeddings were stored (tags are not rewritten)",
+    )
+    parser.add_argument("--batch-frames", type=int, default=BATCH_FRAMES, help="frames per CLIP forward pass")
+    parser.add_argument("--extract-workers", type=int, default=max(1, min(8, os.cpu_count() or 1)))
+    parser.add_argument("--flush-every", type=int, default=FLUSH_EVERY, help="clips buffered per CSV/embedding write")
+    parser.add_argument("--window", type=int, default=WINDOW, help="clips downloading/extracting ahead of the model")
+    parser.add_argument(
+        "--changeset", nargs="?", const=canto_sync.CHANGESET_CSV, default=None,
+        help="re-tag assets changed/deleted in Canto syncs not yet applied by this stage",
+    )
+    args = parser.parse_args()
 
-        # map scores back to phrases
-        scored = []
-        for (cat, phrase), score in zip(tag_pairs, sims):
-            scored.append({"category": cat, "tag": phrase, "score": float(score)})
+    df = pd.read_csv(INPUT_SCORES)
 
-        scored_sorted = sorted(scored, key=lambda x: x["score"], reverse=True)
+    # ใช้เฉพาะที่ status ok และ decision usable (แนะนำ)
+    df = df[(df["status"] == "ok") & (df["decision"] == "usable")].copy()
+    df["asset_id"] = df["asset_id"].astype(str)
 
-        top = scored_sorted[:8]  # top 8 tags
-        top_tags = ", ".join([t["tag"] for t in top])
+    # resume
+    out_path = Path(OUTPUT_TAGS)
+    vectors = clip_embeddings.read_embeddings()
+    mark = canto_sync.changeset_mark(args.changeset) if args.changeset else 0.0
+    stale = canto_sync.resolve_stale(canto_sync.stale_ids(args.changeset, "auto_tag_videos"), df) if args.changeset else set()
+    if args.changeset:
+        forget(stale, out_path, vectors)
+    done_ids = set()
+    if out_path.exists():
+        old = pd.read_csv(out_path)
+        if "asset_id" in old.columns:
+            done_ids = set(old["asset_id"].astype(str))
+        print(f"มีผล tag เดิมแล้ว {len(done_ids)} รายการ → จะข้ามที่ทำไปแล้ว")
 
-        append_row({
-            "asset_id": asset_id,
-            "filename": filename,
-            "status": "ok",
-            "top_tags": top_tags,
-            "tag_scores_json": json.dumps(scored_sorted[:50], ensure_ascii=False),  # เก็บ top 50 ไว้พอ
-        })
+    # embeddings (เก็บไว้ให้ clip_selector ค้นแบบ semantic)
+    embed_only = set()
+    if args.backfill_embeddings and out_path.exists():
+        ok_ids = set(old.loc[old["status"] == "ok", "asset_id"].astype(str))
+        embed_only = ok_ids - set(vectors)
+        print(f"จะเติม embedding ให้คลิปที่ tag แล้ว {len(embed_only)} รายการ")
+
+    df_todo = df[~df["asset_id"].isin(done_ids) | df["asset_id"].isin(embed_only)].copy()
+
+    # คลิปที่ clip_analyzer tag ไว้แล้ว (URL เดียวกัน และมี embedding แล้ว) → ใช้ผลเดิม ไม่ต้อง decode ซ้ำ
+    analyzed = {a: r for a, r in clip_analyzer.stored_records("tags").items() if a not in stale}
+    reused = []
+    for _, row in df_todo.iterrows():
+        rec = clip_analyzer.reusable(analyzed, row)
+        if rec is not None and row["asset_id"] in vectors and row["asset_id"] not in embed_only:
+            reused.append({
+                "asset_id": row["asset_id"],
+                "filename": row.get("filename"),
+                "status": "ok",
+                "top_tags": rec.get("top_tags", ""),
+                "tag_scores_json": rec.get("tag_scores_json", "[]"),
+            })
+    if reused:
+        df_todo = df_todo[~df_todo["asset_id"].isin({r["asset_id"] for r in reused})]
+        print(f"ใช้ tag จาก clip_analyzer {len(reused)} รายการ")
+    print("จะทำ tagging รอบนี้:", len(df_todo))
 
-        # cleanup
-        Path(TEMP_VIDEO).unlink(missing_ok=True)
+    # Load CLIP
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess, text_features, tag_pairs = load_clip_model(device)
 
+    # ---------------------------
+    # Buffered writer: rows + vectors hit disk together every flush_every clips,
+    # so a resumed run never has tags without their embeddings.
+    # ---------------------------
+    first_write = not out_path.exists()
+    pending_rows = list(reused)
+    pending_clips = 0
+
+    def flush():
+        nonlocal first_write, pending_clips
+        if pending_rows:
+            pd.DataFrame(pending_rows).to_csv(
+                OUTPUT_TAGS,
+                mode="a",
+                header=first_write,
+                index=False,
+                encoding="utf-8-sig",
+            )
+            first_write = False
+            pending_rows.clear()
+        if pending_clips:
+            clip_embeddings.write_embeddings(vectors)
+        pending_clips = 0
+
+    rows = [r for _, r in df_todo.iterrows()]
+    tagged = iter_tags(
+        rows, model, preprocess, text_features, tag_pairs, device,
+        batch_frames=args.batch_frames, extract_workers=args.extract_workers, window=args.window,
+    )
+    for row, tag_row, vector in tqdm(tagged, total=len(rows), desc="Auto tagging"):
+        if vector is not None:
+            vectors[row["asset_id"]] = vector
+        if row["asset_id"] not in embed_only:  # tag แล้ว ขาดแค่ embedding → ไม่เขียน row ซ้ำ
+            pending_rows.append(tag_row)
+        pending_clips += 1
+        if pending_clips >= args.flush_every:
+            flush()
+    flush()
+    canto_sync.acknowledge("auto_tag_videos", mark)
+
+    print(f"✓ Embeddings: {clip_embeddings.EMBEDDINGS_PATH} ({len(vectors)} clips)")
     print("Done! Output:", OUTPUT_TAGS)
 
 
@@ -0,0 +1,463 @@
+# build_library.py
+# One incremental build of the clip library, replacing the hand-run CSV chain
+#   canto_fetch_metadata → filter_candidates → process_candidates → merge_scores_with_candidates
+#   → auto_tag_videos → merge_tags_with_urls → compute_mood
+#
+# Each stage declares the upstream columns it reads and the columns it writes.
+# Rows are keyed by the Canto asset key (canto_sync.asset_key). Next to every
+# output row a stage keeps a hash of the input columns it was built from; a
+# rebuild recomputes only rows whose input hash changed (or that are new),
+# reuses the rest, and drops rows whose key vanished upstream. After a small
+# Canto change only the touched assets are downloaded, scored and tagged again.
+#
+# All stage tables live in one store under cache/library_build/ (Parquet when
+# pyarrow is installed, pickle otherwise). Slow stages save after every batch,
+# so an interrupted build resumes where it stopped. At the end the tables the
+# app reads are exported: canto_clip_tags_with_urls.csv and canto_clip_mood.csv.
+#
+#   python build_library.py                    # list Canto, rebuild what changed
+#   python build_library.py --no-fetch         # reuse the stored listing
+#   python build_library.py --until scores     # stop after a stage
+#   python build_library.py --redo tags        # recompute every row of a stage
+#   python build_library.py --export-all       # also write every stage's old CSV
+
+import argparse
+import json
+import os
+import pickle
+import queue
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import asset_store
+import canto_fetch_metadata
+import canto_sync
+import clip_embeddings
+import clip_library
+import merge_tags_with_urls
+import process_candidates
+
+STORE_DIR = Path(os.environ.get("VIDEOSCORE_LIBRARY_BUILD_DIR", "cache/library_build"))
+MOOD_CSV = "canto_clip_mood.csv"
+FLUSH_EVERY = 200
+
+# Stages always exported at the end of a build -> stages whose change makes their CSV stale.
+EXPORTS = {"tags_with_urls": ("tags_with_urls",), "mood": ("tags_with_urls", "mood")}
+
+METADATA_COLUMNS = [
+    "asset_id", "filename", "size_bytes", "duration_sec", "width", "height",
+    "tags", "folder", "download_url", "preview_url", "play_url",
+]
+SCORE_COLUMNS = process_candidates.RESULT_COLUMNS
+TAG_COLUMNS = ["asset_id", "filename", "status", "top_tags", "tag_scores_json"]
+MOOD_COLUMNS = ["mood_brightness", "mood_contrast", "mood_temp", "mood_motion"]
+
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PARQUET = True
+except Exception:
+    _HAS_PARQUET = False
+
+
+# ---------------------------
+# Store: one table per stage (+ meta with the stage version)
+# ---------------------------
+def _table_paths(name):
+    data = STORE_DIR / f"{name}{'.parquet' if _HAS_PARQUET else '.pkl'}"
+    return data, STORE_DIR / f"{name}.meta.json"
+
+
+def read_table(name, version=None):
+    """Stored table of a stage (None if missing, unreadable or built by another stage version)."""
+    data_path, meta_path = _table_paths(name)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if version is not None and meta.get("version") != version:
+            return None
+        if data_path.suffix == ".parquet":
+            return pd.read_parquet(data_path)
+        with open(data_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def write_table(name, df, version=None):
+    data_path, meta_path = _table_paths(name)
+    STORE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = data_path.with_name(f"{data_path.name}.{os.getpid()}.tmp")
+    if data_path.suffix == ".parquet":
+        df.to_parquet(tmp, index=False)
+    else:
+        with open(tmp, "wb") as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, data_path)
+
+    tmp_meta = meta_path.with_name(f"{meta_path.name}.{os.getpid()}.tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "rows": len(df)}, f)
+    os.replace(tmp_meta, meta_path)
+
+
+# ---------------------------
+# Row hashing
+# ---------------------------
+def _canonical(v):
+    if v is None or v is pd.NA or (isinstance(v, (float, np.floating)) and np.isnan(v)):
+        return ""
+    if isinstance(v, (float, np.floating)) and float(v).is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def row_hashes(df, columns):
+    """
+    uint64 per row over columns. Every value goes through _canonical whatever the
+    column's dtype (1920 == 1920.0 == "1920", None == NaN == ""), so a column
+    changing dtype when rows are added doesn't look like new input.
+    """
+    canon = pd.DataFrame({col: df[col].map(_canonical) for col in columns}, index=df.index)
+    return pd.util.hash_pandas_object(canon, index=False).to_numpy()
+
+
+# ---------------------------
+# Stages
+# ---------------------------
+# inputs: ((upstream stage, [columns]), ...) joined on _key (first is primary, later
+# ones only add columns; colliding names get a _<stage> suffix).
+# run(todo) yields DataFrames of _key + outputs; keys it never yields are filtered out.
+# volatile: input columns passed to run but not hashed. csv: legacy file for --export-all.
+Stage = namedtuple("Stage", "name inputs outputs run version volatile csv", defaults=(1, (), None))
+
+
+def _batched(items, n):
+    for i in range(0, len(items), n):
+        yield items[i:i + n]
+
+
+def _per_clip(rows, submit, window):
+    """
+    Download each row's clip through asset_store and hand it to submit(row, path) -> Future
+    the moment it lands. Yields (row, result, error) in completion order, error being
+    (status, message) on failure; at most `window` clips are in flight.
+    """
+    results = queue.Queue()
+
+    def on_done(fut, row):
+        try:
+            results.put((row, fut.result(), None))
+        except Exception as e:
+            results.put((row, None, ("error_analyze", str(e))))
+
+    def on_downloaded(fut, row):
+        try:
+            path = fut.result()
+        except Exception as e:
+            results.put((row, None, ("error_download", str(e))))
+            return
+        try:
+            task = submit(row, path)
+        except Exception as e:
+            results.put((row, None, ("error_analyze", str(e))))
+            return
+        task.add_done_callback(lambda f: on_done(f, row))
+
+    next_row = 0
+    in_flight = 0
+    while next_row < len(rows) or in_flight:
+        while next_row < len(rows) and in_flight < window:
+            row = rows[next_row]
+            next_row += 1
+            download = asset_store.prefetch([(row["download_url"], row["asset_id"])])[0]
+            download.add_done_callback(lambda f, row=row: on_downloaded(f, row))
+            in_flight += 1
+        yield results.get()
+        in_flight -= 1
+
+
+def _has_url(row):
+    url = row.get("download_url")
+    return isinstance(url, str) and url.startswith("http")
+
+
+def _run_metadata(todo):
+    for part in _batched(todo.to_dict("records"), FLUSH_EVERY * 5):
+        rows = [{"_key": r["_key"], **canto_fetch_metadata.metadata_row(json.loads(r["asset_json"]))} for r in part]
+        yield pd.DataFrame(rows)
+
+
+def _run_candidates(todo):
+    # เอาเฉพาะคลิปที่มี download_url จริง ๆ (filter_candidates)
+    yield todo[todo["download_url"].notna()]
+
+
+def _run_scores(todo, workers):
+    rows = todo.to_dict("records")
+    out = [
+        {"_key": r["_key"], **process_candidates.result_row(r["asset_id"], r.get("filename"), "no_download_url")}
+        for r in rows if not _has_url(r)
+    ]
+    rows = [r for r in rows if _has_url(r)]
+    if not rows:
+        if out:
+            yield pd.DataFrame(out)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=process_candidates._init_worker) as pool:
+        def submit(row, path):
+            return pool.submit(process_candidates.score_clip, row["asset_id"], row.get("filename"), str(path))
+
+        for row, result, error in tqdm(_per_clip(rows, submit, workers * 4), total=len(rows), desc="scores"):
+            if error:
+                result = process_candidates.result_row(row["asset_id"], row.get("filename"), *error)
+            out.append({"_key": row["_key"], **result})
+            if len(out) >= FLUSH_EVERY:
+                yield pd.DataFrame(out)
+                out = []
+    if out:
+        yield pd.DataFrame(out)
+
+
+def _run_scores_with_urls(todo):
+    # merge_scores_with_candidates: scores + download_url ของ candidate
+    yield todo
+
+
+def _run_tags(todo, workers):
+    # ใช้เฉพาะที่ status ok และ decision usable (auto_tag_videos)
+    todo = todo[(todo["status"] == "ok") & (todo["decision"] == "usable")]
+    if not len(todo):
+        return
+
+    import torch
+
+    import auto_tag_videos
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess, text_features, tag_pairs = auto_tag_videos.load_clip_model(device)
+    vectors = clip_embeddings.read_embeddings()
+    rows = todo.to_dict("records")
+    tagged = auto_tag_videos.iter_tags(
+        rows, model, preprocess, text_features, tag_pairs, device,
+        batch_frames=auto_tag_videos.BATCH_FRAMES, extract_workers=workers, window=auto_tag_videos.WINDOW,
+    )
+    out = []
+    for row, tag_row, vector in tqdm(tagged, total=len(rows), desc="tags"):
+        if vector is not None:
+            vectors[str(row["asset_id"])] = vector
+        out.append({"_key": row["_key"], **tag_row})
+        if len(out) >= FLUSH_EVERY:
+            clip_embeddings.write_embeddings(vectors)  # embeddings first: stored tags always have theirs
+            yield pd.DataFrame(out)
+            out = []
+    if out:
+        clip_embeddings.write_embeddings(vectors)
+        yield pd.DataFrame(out)
+
+
+def _run_tags_with_urls(todo):
+    # merge_tags_with_urls: filename จาก candidates ถ้าเดิมว่าง, width/height/rotation จากไฟล์ในเครื่องก่อน
+    df = todo.copy()
+    df["filename"] = df["filename"].fillna(df.pop("filename_candidates"))
+    dims = {"width": df.pop("width"), "height": df.pop("height")}
+    yield merge_tags_with_urls.add_geometry(df, dims)
+
+
+def _run_mood(todo, workers):
+    from clip_analyzer import analyze_clip
+
+    rows = [r for r in todo.to_dict("records") if _has_url(r)]
+    if not rows:
+        return
+    out = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit(row, path):
+            return pool.submit(analyze_clip, path, ["mood"], row["asset_id"])
+
+        for row, result, error in tqdm(_per_clip(rows, submit, workers * 4), total=len(rows), desc="mood"):
+            columns = result[0] if result else {}
+            out.append({"_key": row["_key"], **{c: columns.get(c) for c in MOOD_COLUMNS}})
+            if len(out) >= FLUSH_EVERY:
+                yield pd.DataFrame(out)
+                out = []
+    if out:
+        yield pd.DataFrame(out)
+
+
+# Stages that decode the clip also depend on its Canto fingerprint: a re-upload under
+# the same URL (new size / modified time) must be scored and tagged again.
+CONTENT = ("canto", ["fingerprint"])
+
+
+def build_stages(workers):
+    return [
+        Stage(
+            "metadata", (("canto", ["fingerprint", "asset_json"]),), METADATA_COLUMNS, _run_metadata,
+            volatile=("asset_json",), csv=canto_fetch_metadata.OUTPUT_METADATA_CSV,
+        ),
+        Stage("candidates", (("metadata", METADATA_COLUMNS),), METADATA_COLUMNS, _run_candidates, csv="canto_candidates.csv"),
+        Stage(
+            "scores", (("candidates", ["asset_id", "filename", "download_url"]), CONTENT), SCORE_COLUMNS,
+            lambda todo: _run_scores(todo, workers), csv=process_candidates.OUTPUT_RESULTS_CSV,
+        ),
+        Stage(
+            "scores_with_urls", (("scores", SCORE_COLUMNS), ("candidates", ["download_url"])),
+            SCORE_COLUMNS + ["download_url"], _run_scores_with_urls, csv="canto_scores_with_urls.csv",
+        ),
+        Stage(
+            "tags", (("scores_with_urls", ["asset_id", "filename", "download_url", "status", "decision"]), CONTENT),
+            TAG_COLUMNS, lambda todo: _run_tags(todo, workers), csv="canto_clip_tags.csv",
+        ),
+        Stage(
+            "tags_with_urls", (("tags", TAG_COLUMNS), ("candidates", ["download_url", "filename", "width", "height"])),
+            TAG_COLUMNS + ["download_url", "width", "height", "rotation"], _run_tags_with_urls,
+            csv=clip_library.LIBRARY_CSV,
+        ),
+        Stage(
+            "mood", (("tags_with_urls", ["asset_id", "download_url"]), CONTENT), MOOD_COLUMNS,
+            lambda todo: _run_mood(todo, workers), csv=MOOD_CSV,
+        ),
+    ]
+
+
+# ---------------------------
+# Engine
+# ---------------------------
+def stage_input(stage, tables):
+    """_key + declared input columns of the kept upstream rows, joined on _key."""
+    df = None
+    for name, columns in stage.inputs:
+        t = tables[name]
+        t = t.loc[t["_keep"].astype(bool), ["_key", *columns]]
+        df = t if df is None else df.merge(t, on="_key", how="inner", suffixes=("", f"_{name}"))
+    return df.reset_index(drop=True)
+
+
+def run_stage(stage, tables, redo=False):
+    """Bring one stage's table up to date with its inputs. Returns (table, changed)."""
+    inp = stage_input(stage, tables)
+    hashes = row_hashes(inp, [c for c in inp.columns if c != "_key" and c not in stage.volatile])
+    order = pd.Series(np.arange(len(inp)), index=inp["_key"])
+
+    old = None if redo else read_table(stage.name, stage.version)
+    if old is None:
+        fresh = np.zeros(len(inp), dtype=bool)
+        old = pd.DataFrame(columns=["_key", "_hash", "_keep", *stage.outputs])
+    else:
+        old_hash = old.drop_duplicates("_key", keep="last").set_index("_key")["_hash"]
+        fresh = (inp["_key"].map(old_hash) == hashes).to_numpy()
+
+    kept = old[old["_key"].isin(set(inp.loc[fresh, "_key"]))]
+    todo = inp.loc[~fresh].reset_index(drop=True)
+    removed = int((~old["_key"].isin(set(inp["_key"]))).sum())
+    print(f"[{stage.name}] {int(fresh.sum())} up to date, {len(todo)} to build, {removed} removed")
+    if not len(todo) and not removed:
+        return old, False
+
+    todo_hash = pd.Series(hashes[~fresh], index=todo["_key"])
+    parts = [kept]
+
+    def save():
+        table = pd.concat([p for p in parts if len(p)], ignore_index=True) if any(len(p) for p in parts) else old.iloc[:0]
+        table = table.iloc[np.argsort(table["_key"].map(order).to_numpy(), kind="stable")].reset_index(drop=True)
+        table["_hash"] = table["_hash"].astype("uint64")
+        table["_keep"] = table["_keep"].astype(bool)
+        write_table(stage.name, table, stage.version)
+        return table
+
+    built = set()
+    for batch in stage.run(todo):
+        batch = batch.reindex(columns=["_key", *stage.outputs]).copy()
+        batch.insert(1, "_hash", batch["_key"].map(todo_hash).to_numpy())
+        batch.insert(2, "_keep", True)
+        parts.append(batch)
+        built.update(batch["_key"])
+        save()
+
+    # rows the stage filtered out: remember their hash so they aren't looked at again
+    skipped = todo.loc[~todo["_key"].isin(built), ["_key"]].copy()
+    skipped["_hash"] = skipped["_key"].map(todo_hash).to_numpy()
+    skipped["_keep"] = False
+    parts.append(skipped.reindex(columns=["_key", "_hash", "_keep", *stage.outputs]))
+    return save(), True
+
+
+def canto_table(assets):
+    """Listing → source table: one row per asset key with its fingerprint and raw JSON."""
+    rows = {}
+    for a in assets:
+        key = canto_sync.asset_key(a)
+        if key and key not in rows:
+            rows[key] = {
+                "_key": key,
+                "_hash": 0,
+                "_keep": True,
+                "fingerprint": canto_sync.fingerprint(a),
+                "asset_json": json.dumps(a, ensure_ascii=False, sort_keys=True),
+            }
+    return pd.DataFrame(list(rows.values()), columns=["_key", "_hash", "_keep", "fingerprint", "asset_json"])
+
+
+def export(stage, tables):
+    df = tables[stage.name]
+    df = df.loc[df["_keep"], stage.outputs]
+    if stage.name == "mood":
+        # compute_mood: แถวของ library + คอลัมน์ mood
+        lib = tables["tags_with_urls"]
+        lib = lib.loc[lib["_keep"]]
+        mood = tables["mood"].loc[tables["mood"]["_keep"], ["_key", *MOOD_COLUMNS]]
+        df = lib.merge(mood, on="_key", how="left")[[*lib.columns.drop(["_key", "_hash", "_keep"]), *MOOD_COLUMNS]]
+    df.to_csv(stage.csv, index=False, encoding="utf-8-sig")
+    print(f"✓ {stage.csv} ({len(df)} rows)")
+
+
+def main():
+    stage_names = [s.name for s in build_stages(1)]
+    parser = argparse.ArgumentParser(description="Incremental clip library build (Canto → tags + mood)")
+    parser.add_argument("--base-url", default=None, help="Canto API base (default canto_fetch_metadata.CANTO_BASE_URL)")
+    parser.add_argument("--no-fetch", action="store_true", help="reuse the stored Canto listing")
+    parser.add_argument("--until", choices=stage_names, default=None, help="stop after this stage")
+    parser.add_argument("--redo", choices=stage_names, action="append", default=[], help="recompute every row of a stage")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--export-all", action="store_true", help="also write each stage's legacy CSV")
+    args = parser.parse_args()
+
+    tables = {}
+    if args.no_fetch:
+        tables["canto"] = read_table("canto")
+        if tables["canto"] is None:
+            raise SystemExit(f"No stored Canto listing in {STORE_DIR}; run once without --no-fetch")
+        print(f"ใช้ listing เดิม {len(tables['canto'])} รายการ")
+    else:
+        assets = canto_fetch_metadata.fetch_assets_in_library(base_url=args.base_url)
+        tables["canto"] = canto_table(assets)
+        write_table("canto", tables["canto"])
+
+    stages = build_stages(max(1, args.workers))
+    changed = {}
+    for stage in stages:
+        try:
+            tables[stage.name], changed[stage.name] = run_stage(stage, tables, redo=stage.name in args.redo)
+        except ImportError as e:
+            print(f"⚠️ stage {stage.name} needs {e.name} (not installed); stopping here")
+            break
+        # the app reads tags_with_urls (+ mood on top of it); old CSVs only on request
+        final = stage.name in EXPORTS and (
+            any(changed.get(n) for n in EXPORTS[stage.name]) or not Path(stage.csv).exists()
+        )
+        if args.export_all or final:
+            export(stage, tables)
+        if stage.name == args.until:
+            break
+
+    print(f"Done! Store: {STORE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
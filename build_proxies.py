@@ -0,0 +1,65 @@
+# build_proxies.py
+# Ingest stage (optional): download every clip in the library and build its
+# mezzanine proxy (short-GOP <=1080p) in the asset store, once.
+# After this, cuts and find_smooth_start read the proxy instead of the camera original.
+#
+#   python build_proxies.py                      # whole library
+#   python build_proxies.py --limit 50 --gop 1   # all-intra, first 50 clips
+
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+from tqdm import tqdm
+
+import asset_store
+from ffmpeg_utils import set_ffmpeg_threads
+
+LIBRARY_CSV = "canto_clip_tags_with_urls.csv"
+
+
+def build_one(url, asset_id, gop):
+    source = asset_store.fetch(url, asset_id, session=asset_store.http_session())
+    return asset_store.ensure_proxy(source, gop=gop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build mezzanine proxies for library clips")
+    parser.add_argument("--csv", default=LIBRARY_CSV)
+    parser.add_argument("--workers", type=int, default=2, help="proxies encoded at the same time")
+    parser.add_argument("--gop", type=int, default=asset_store.PROXY_GOP, help="keyframe interval (1 = all-intra)")
+    parser.add_argument("--limit", type=int, default=0)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv)
+    df = df[df["download_url"].astype(str).str.startswith("http")]
+    if "asset_id" in df.columns:
+        df = df.drop_duplicates(subset=["asset_id"])
+    if args.limit > 0:
+        df = df.head(args.limit)
+
+    workers = max(1, args.workers)
+    # Split the cores between concurrent encodes.
+    set_ffmpeg_threads(max(1, (os.cpu_count() or 1) // workers))
+
+    print(f"Building proxies for {len(df)} clips ({workers} workers, GOP {args.gop})")
+    ok, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = {
+            ex.submit(build_one, r["download_url"], r.get("asset_id"), args.gop): r.get("asset_id")
+            for _, r in df.iterrows()
+        }
+        for f in tqdm(as_completed(futures), total=len(futures), desc="Proxies"):
+            try:
+                f.result()
+                ok += 1
+            except Exception as e:
+                failed += 1
+                print(f"⚠️ Proxy failed for {futures[f]}: {e}")
+
+    print(f"✓ Proxies ready: {ok}, failed: {failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,36 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 import pandas as pd
+from pathlib import Path
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+import asset_store
+import canto_sync
+import probe_cache
 
-CANTO_BASE_URL = "https://columbiapicturesaquaverse.canto.global/api/v1"  # แก้เป็นของจริง
-API_TOKEN = "4f0534d28a7347c7bd18120a9fd5cddd"  # แทนที่ด้วย token จริง
+# override ได้ผ่าน env (เช่นชี้ไป fake Canto server ตอนทดสอบ)
+CANTO_BASE_URL = os.environ.get(
+    "VIDEOSCORE_CANTO_BASE_URL", "https://columbiapicturesaquaverse.canto.global/api/v1"
+)  # แก้เป็นของจริง
+API_TOKEN = os.environ.get("VIDEOSCORE_CANTO_TOKEN", "4f0534d28a7347c7bd18120a9fd5cddd")  # แทนที่ด้วย token จริง
 
 # ตัวอย่าง: โฟลเดอร์/อัลบัมที่อยากดึง (ขึ้นอยู่กับโครง Canto ของคุณ)
 TARGET_ALBUM_ID = "ALBUM_ID_HERE"  # ให้ IT บอก หรือดูจาก Canto UI
 
 OUTPUT_METADATA_CSV = "canto_metadata.csv"
 
+# Listing: pages in flight at once, per-request timeout (s), retries on 429/5xx/connection errors.
+PAGE_WORKERS = int(os.environ.get("VIDEOSCORE_CANTO_PAGE_WORKERS", "8"))
+PAGE_TIMEOUT = (10, 60)
+PAGE_RETRIES = 5
+# Hard stop for the sequential walk (no `found`), in case the server ignores `start`.
+MAX_PAGES = int(os.environ.get("VIDEOSCORE_CANTO_MAX_PAGES", "10000"))
+
 
 def get_headers():
     return {
@@ -17,90 +38,124 @@ def get_headers():
         "Accept": "application/json",
     }
 
-def fetch_assets_in_library(limit=1000):
+def api_session(workers=None):
     """
-    ดึงรายการวิดีโอทั้งหมดจาก Canto:
-    - ใช้ endpoint: /api/v1/video
-    - ใช้ start+limit ตามเอกสาร
-    - limit สูงสุด 1000 ตาม docs
+    Keep-alive session for the Canto API: one pooled connection per page worker,
+    and urllib3 retries GETs on 429/5xx with exponential backoff (honouring Retry-After).
     """
+    workers = workers or PAGE_WORKERS
+    retry = Retry(
+        total=PAGE_RETRIES,
+        connect=PAGE_RETRIES,
+        read=PAGE_RETRIES,
+        status=PAGE_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, workers), max_retries=retry)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers.update(get_headers())
+    return s
+
+
+def _get_page(http, base_url, start, limit):
+    params = {
+        "start": start,   # <-- ใช้ start ตาม docs
+        "limit": limit,   # max 1000
+        # ถ้าอยาก filter เฉพาะ video ช่วงใดช่วงหนึ่ง เช่น duration/created/owner ฯลฯ
+        # ก็ใส่เพิ่มตรงนี้ตาม docs ได้ เช่น:
+        # "duration": "1..1200",
+        # "approval": "approved",
+    }
+    resp = http.get(f"{base_url}/video", headers=get_headers(), params=params, timeout=PAGE_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
 
-    all_assets = []
-    seen_keys = set()
 
-    start = 0
-    page = 1
-
-    while True:
-        params = {
-            "start": start,   # <-- ใช้ start ตาม docs
-            "limit": limit,   # max 1000
-            # ถ้าอยาก filter เฉพาะ video ช่วงใดช่วงหนึ่ง เช่น duration/created/owner ฯลฯ
-            # ก็ใส่เพิ่มตรงนี้ตาม docs ได้ เช่น:
-            # "duration": "1..1200",
-            # "approval": "approved",
-        }
-        url = f"{CANTO_BASE_URL}/video"
-        resp = requests.get(url, headers=get_headers(), params=params)
-        resp.raise_for_status()
-        data = resp.json()
-
-        results = data.get("results", [])
-        found = data.get("found", 0)
-        limit_resp = data.get("limit", limit)
-
-        print(f"page {page}: start={start}, ได้ {len(results)} รายการ, found={found}, limit={limit_resp}")
-
-        if not results:
-            print("ไม่มี results แล้ว หยุด loop")
-            break
-
-        new_in_this_page = 0
-
-        for asset in results:
-            # เนื่องจาก result ไม่มี id แบบชัด เราใช้ download URL มาเป็น key กันซ้ำ
-            url_info = asset.get("url") or {}
-            uniq_key = (
-                url_info.get("directUrlOriginal")
-                or url_info.get("download")
-                or url_info.get("play")
-            )
-
-            if not uniq_key:
-                continue
+def iter_asset_pages(limit=1000, base_url=None, session=None, workers=None):
+    """
+    Yield (start, results) per page of /video.
+    The first page tells us `found`, so every other offset is known up front:
+    those pages are requested concurrently (at most `workers` at a time) and
+    yielded as they arrive, not in offset order.
+    Without `found`, pages are walked one by one until one comes back empty,
+    one holds nothing but assets already seen (server ignores/clamps `start`)
+    or MAX_PAGES is reached.
+    """
+    base_url = (base_url or CANTO_BASE_URL).rstrip("/")
+    workers = max(1, workers or PAGE_WORKERS)
+    http = session or api_session(workers)
+
+    first = _get_page(http, base_url, 0, limit)
+    results = first.get("results", [])
+    found = int(first.get("found") or 0)
+    limit = int(first.get("limit") or limit)  # server may cap it
+    print(f"page 1: ได้ {len(results)} รายการ, found={found}, limit={limit}")
+    yield 0, results
+
+    if not results:
+        return
+
+    if not found:
+        seen = {_asset_uniq_key(a) for a in results}
+        for page in range(1, MAX_PAGES):
+            start = page * limit
+            results = _get_page(http, base_url, start, limit).get("results", [])
+            keys = {_asset_uniq_key(a) for a in results}
+            if not results or keys <= seen:
+                return
+            seen |= keys
+            yield start, results
+        print(f"⚠️ หยุดที่ {MAX_PAGES} หน้า (VIDEOSCORE_CANTO_MAX_PAGES) — Canto ไม่ส่ง found")
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="canto-page") as ex:
+        futures = {ex.submit(_get_page, http, base_url, start, limit): start for start in range(limit, found, limit)}
+        for f in as_completed(futures):
+            yield futures[f], f.result().get("results", [])
+
+
+def _asset_uniq_key(asset):
+    # เนื่องจาก result ไม่มี id แบบชัด เราใช้ download URL มาเป็น key กันซ้ำ
+    url_info = asset.get("url") or {}
+    return url_info.get("directUrlOriginal") or url_info.get("download") or url_info.get("play")
 
-            if uniq_key in seen_keys:
-                continue
 
+def dedupe_pages(pages):
+    """Assets of {start: results} in offset order, first occurrence of each download URL only."""
+    all_assets = []
+    seen_keys = set()
+    for start in sorted(pages):
+        for asset in pages[start]:
+            uniq_key = _asset_uniq_key(asset)
+            if not uniq_key or uniq_key in seen_keys:
+                continue
             seen_keys.add(uniq_key)
             all_assets.append(asset)
-            new_in_this_page += 1
-
-        print(f"page {page}: เพิ่มใหม่ {new_in_this_page} รายการ, รวมตอนนี้ {len(all_assets)}")
-
-        # ถ้าไม่มีตัวใหม่เลยในหน้านี้ → น่าจะสุดแล้ว
-        if new_in_this_page == 0:
-            print("หน้านี้ไม่มี asset ใหม่เลย น่าจะสุดแล้ว หยุด loop")
-            break
-
-        # ถ้ามี found และเก็บครบแล้ว → หยุด
-        if found and len(all_assets) >= found:
-            print(f"เก็บครบตาม found แล้ว ({len(all_assets)}/{found}) หยุด")
-            break
-
-        # เลื่อน start ไปหน้าถัดไป
-        start += limit
-        page += 1
-
-    print(f"รวมได้ assets ไม่ซ้ำทั้งหมด {len(all_assets)} รายการ")
     return all_assets
 
 
+def fetch_assets_in_library(limit=1000, base_url=None, session=None, workers=None):
+    """
+    ดึงรายการวิดีโอทั้งหมดจาก Canto:
+    - ใช้ endpoint: /api/v1/video
+    - ใช้ start+limit ตามเอกสาร
+    - limit สูงสุด 1000 ตาม docs
+    - หน้าที่เหลือยิงพร้อมกัน (iter_asset_pages) แล้วเรียงตาม start ก่อนตัดตัวซ้ำ
+    base_url/session: ชี้ไปที่ server อื่นได้ (default CANTO_BASE_URL)
+    """
+    pages = dict(iter_asset_pages(limit=limit, base_url=base_url, session=session, workers=workers))
+    all_assets = dedupe_pages(pages)
+    print(f"รวมได้ assets ไม่ซ้ำทั้งหมด {len(all_assets)} รายการ ({len(pages)} หน้า)")
+    return all_assets
 
 
-
-
-def extract_metadata(asset: dict) -> dict:
+def extract_metadata(asset: dict, local_path=None) -> dict:
     asset_id = asset.get("id")  # ตอนนี้ยังไม่เห็น แต่เผื่อไว้
     filename = asset.get("name") or asset.get("filename")
 
@@ -110,6 +165,15 @@ def extract_metadata(asset: dict) -> dict:
     width = None
     height = None
 
+    # ถ้าไฟล์อยู่ใน asset store แล้ว → เติมจาก probe cache (ไม่ต้องโหลดใหม่)
+    if local_path is not None:
+        info = probe_cache.get_info(local_path)
+        if info:
+            size = Path(local_path).stat().st_size
+            duration = round(info["duration"], 3)
+            width = info["width"]
+            height = info["height"]
+
     tags_value = asset.get("tags") or asset.get("tag") or []
     if isinstance(tags_value, list):
         tags = ",".join(tags_value)
@@ -142,10 +206,96 @@ def extract_metadata(asset: dict) -> dict:
 
 import json
 
+def metadata_row(asset):
+    """extract_metadata (+ width/height/duration if the file is already in the asset store)."""
+    url_info = asset.get("url") or {}
+    url = url_info.get("directUrlOriginal") or url_info.get("download")
+    local = asset_store.asset_path(url, asset.get("id")) if url else None
+    if local is not None and not asset_store.is_valid(local):
+        local = None
+    return extract_metadata(asset, local_path=local)
+
+
+def metadata_rows(assets):
+    rows = [metadata_row(a) for a in tqdm(assets, desc="Processing assets")]
+    probed = sum(r["duration_sec"] is not None for r in rows)
+    print(f"เติม width/height/duration จากไฟล์ใน asset store ได้ {probed} รายการ")
+    return rows
+
+
+def sync_incremental(assets):
+    """
+    Patch canto_metadata.csv with the difference to the last sync:
+    unchanged rows are kept as they are, new/changed rows are rebuilt, deleted rows dropped.
+    Writes canto_changeset.csv and then records the new fingerprints.
+    """
+    changes = canto_sync.diff(assets)
+    print(
+        f"เทียบกับรอบก่อน: ใหม่ {len(changes['new'])}, เปลี่ยน {len(changes['changed'])}, "
+        f"ลบ {len(changes['deleted'])}, เหมือนเดิม {len(changes['unchanged'])}"
+    )
+
+    out_path = Path(OUTPUT_METADATA_CSV)
+    if out_path.exists():
+        kept = pd.read_csv(out_path)
+        # ลบแถวของ asset ที่เปลี่ยน/ถูกลบ (จับทั้ง asset_id และ download_url เพราะบาง asset ไม่มี id)
+        # "new" ด้วย: ถ้า sync DB ว่าง (เพิ่งลบ/ยังไม่เคยเก็บ) asset เดิมทั้งหมดจะนับเป็น new → ห้ามซ้ำกับแถวเดิม
+        rebuilt = changes["new"] + changes["changed"]
+        stale = {canto_sync.asset_key(a) for a in rebuilt} | {k for k, _ in changes["deleted"]}
+        stale |= {str(a.get("id")) for a in rebuilt if a.get("id")}
+        stale |= {canto_sync.asset_url(a) for a in rebuilt if canto_sync.asset_url(a)}
+        stale |= {aid for _, aid in changes["deleted"] if aid}
+        mask = kept["asset_id"].astype(str).isin(stale) | kept["download_url"].astype(str).isin(stale)
+        kept = kept[~mask]
+        fresh = changes["new"] + changes["changed"]
+    else:
+        # ยังไม่มี metadata เดิม → สร้างทั้งหมด
+        kept = None
+        fresh = changes["new"] + changes["changed"] + changes["unchanged"]
+
+    df = pd.DataFrame(metadata_rows(fresh))
+    if kept is not None:
+        df = pd.concat([kept, df], ignore_index=True)
+    df.to_csv(OUTPUT_METADATA_CSV, index=False, encoding="utf-8-sig")
+    print(f"บันทึก metadata ลงไฟล์: {OUTPUT_METADATA_CSV} ({len(df)} รายการ)")
+
+    n = canto_sync.write_changeset(changes)
+    canto_sync.commit(changes)
+    print(f"✓ Changeset: {canto_sync.CHANGESET_CSV} (+{n} รายการ, เก็บสะสมจนทุกขั้นตอนรัน --changeset แล้ว)")
+    return changes
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Fetch Canto video metadata")
+    parser.add_argument("--incremental", action="store_true", help="only rebuild new/changed assets, write a changeset")
+    parser.add_argument("--base-url", default=None, help=f"Canto API base (default {CANTO_BASE_URL})")
+    args = parser.parse_args()
+
     print("ดึง asset metadata จาก Canto ...")
-    assets = fetch_assets_in_library()
+    if args.incremental:
+        assets = fetch_assets_in_library(base_url=args.base_url)
+        print(f"พบ asset ทั้งหมด {len(assets)} รายการ")
+        sync_incremental(assets)
+        return
+
+    # full: แปลงเป็นแถว metadata ทันทีที่แต่ละหน้ามาถึง (ระหว่างรอหน้าอื่น)
+    pages, page_rows = {}, {}
+    for start, results in tqdm(iter_asset_pages(base_url=args.base_url), desc="Pages"):
+        pages[start] = results
+        page_rows[start] = [metadata_row(a) for a in results]
+
+    # เรียงตาม start แล้วตัดตัวซ้ำ (download URL เดียวกัน) เหมือน fetch_assets_in_library
+    assets, rows, seen_keys = [], [], set()
+    for start in sorted(pages):
+        for asset, row in zip(pages[start], page_rows[start]):
+            uniq_key = _asset_uniq_key(asset)
+            if not uniq_key or uniq_key in seen_keys:
+                continue
+            seen_keys.add(uniq_key)
+            assets.append(asset)
+            rows.append(row)
     print(f"พบ asset ทั้งหมด {len(assets)} รายการ")
+    print(f"เติม width/height/duration จากไฟล์ใน asset store ได้ {sum(r['duration_sec'] is not None for r in rows)} รายการ")
 
     # 🔍 ดูตัวอย่าง asset ตัวแรก
     if assets:
@@ -153,14 +303,16 @@ def main():
         print(json.dumps(assets[0], ensure_ascii=False, indent=2)[:2000])
         print("======================================")
 
-    rows = []
-    for a in tqdm(assets, desc="Processing assets"):
-        rows.append(extract_metadata(a))
-
     df = pd.DataFrame(rows)
     df.to_csv(OUTPUT_METADATA_CSV, index=False, encoding="utf-8-sig")
     print(f"บันทึก metadata ลงไฟล์: {OUTPUT_METADATA_CSV}")
 
+    # full run ก็เป็น baseline ของ --incremental รอบถัดไป (และส่ง changed/deleted ต่อให้ขั้นตอนปลายน้ำ)
+    changes = canto_sync.diff(assets)
+    n = canto_sync.write_changeset(changes)
+    canto_sync.commit(changes)
+    print(f"✓ Changeset: {canto_sync.CHANGESET_CSV} (+{n} รายการ)")
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+# canto_sync.py
+# Change detection for the Canto listing.
+#
+# Each sync stores one fingerprint per asset (download URL, size, modified
+# time) in SQLite and writes the difference to the previous sync as a
+# changeset CSV: one row per new / changed / deleted asset. Unchanged assets
+# keep their existing metadata row, and the downstream stages drop only stale
+# results (stale_ids), so their resume logic re-processes just the delta.
+#
+# Rows accumulate across syncs (each stamped with its sync time) until every
+# downstream stage in CONSUMERS has acknowledged them, so two syncs before a
+# pipeline run don't lose the first delta. Each stage reads only the rows
+# newer than its own acknowledgement and acknowledges after a complete run.
+
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import pandas as pd
+
+SYNC_DB_PATH = Path(os.environ.get("VIDEOSCORE_CANTO_SYNC_DB", "cache/canto_sync.sqlite"))
+CHANGESET_CSV = "canto_changeset.csv"
+
+CHANGE_KINDS = ("new", "changed", "deleted")
+CHANGESET_COLUMNS = ["asset_id", "key", "change", "download_url", "filename", "synced_at"]
+
+# Stages that apply the changeset (--changeset); a row is dropped once all of them acknowledged it.
+CONSUMERS = ("process_candidates", "auto_tag_videos", "clip_analyzer")
+
+
+def asset_url(asset: dict):
+    url_info = asset.get("url") or {}
+    return url_info.get("directUrlOriginal") or url_info.get("download") or url_info.get("play")
+
+
+def asset_key(asset: dict):
+    """Stable identity of a listing entry: Canto id when present, else its download URL."""
+    return str(asset.get("id") or asset_url(asset) or "") or None
+
+
+def fingerprint(asset: dict):
+    modified = asset.get("lastUploaded") or asset.get("dateModified") or asset.get("time")
+    return json.dumps([asset_url(asset), asset.get("size"), modified])
+
+
+def _db(path=None):
+    path = Path(path or SYNC_DB_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS fingerprints ("
+        " key TEXT PRIMARY KEY, asset_id TEXT, fingerprint TEXT NOT NULL, synced_at REAL NOT NULL)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS acks (consumer TEXT PRIMARY KEY, synced_at REAL NOT NULL)")
+    return conn
+
+
+def acknowledged(consumer=None, db_path=None):
+    """Sync time up to which consumer has applied the changeset (None: the oldest over CONSUMERS); 0 if never."""
+    conn = _db(db_path)
+    try:
+        acks = dict(conn.execute("SELECT consumer, synced_at FROM acks"))
+    finally:
+        conn.close()
+    if consumer is not None:
+        return acks.get(consumer, 0.0)
+    return min(acks.get(c, 0.0) for c in CONSUMERS)
+
+
+def acknowledge(consumer, mark, db_path=None):
+    """Record that consumer has applied every changeset row up to mark (see changeset_mark)."""
+    if not mark:
+        return
+    conn = _db(db_path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO acks VALUES (?, ?) ON CONFLICT(consumer) DO UPDATE SET synced_at = MAX(synced_at, excluded.synced_at)",
+                (consumer, mark),
+            )
+    finally:
+        conn.close()
+
+
+def diff(assets, db_path=None):
+    """
+    Compare a full listing with the stored fingerprints.
+    Returns {"new": [asset], "changed": [asset], "deleted": [(key, asset_id)], "unchanged": [asset]}.
+    """
+    conn = _db(db_path)
+    try:
+        stored = {k: (aid, fp) for k, aid, fp in conn.execute("SELECT key, asset_id, fingerprint FROM fingerprints")}
+    finally:
+        conn.close()
+
+    out = {"new": [], "changed": [], "deleted": [], "unchanged": []}
+    seen = set()
+    for a in assets:
+        key = asset_key(a)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        old = stored.get(key)
+        if old is None:
+            out["new"].append(a)
+        elif old[1] != fingerprint(a):
+            out["changed"].append(a)
+        else:
+            out["unchanged"].append(a)
+    out["deleted"] = [(k, aid) for k, (aid, _) in stored.items() if k not in seen]
+    return out
+
+
+def commit(changes, db_path=None):
+    """Make this listing the baseline for the next diff."""
+    now = time.time()
+    conn = _db(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)",
+                [
+                    (asset_key(a), str(a.get("id") or ""), fingerprint(a), now)
+                    for a in changes["new"] + changes["changed"]
+                ],
+            )
+            conn.executemany("DELETE FROM fingerprints WHERE key = ?", [(k,) for k, _ in changes["deleted"]])
+    finally:
+        conn.close()
+
+
+def _read_changeset(path):
+    if not Path(path).exists():
+        return pd.DataFrame(columns=CHANGESET_COLUMNS)
+    df = pd.read_csv(path, dtype=str)
+    if "synced_at" not in df.columns:
+        # written before rows were stamped: treat it as one sync at the file's mtime
+        df["synced_at"] = Path(path).stat().st_mtime
+    df["synced_at"] = df["synced_at"].astype(float)
+    return df
+
+
+def write_changeset(changes, path=CHANGESET_CSV, db_path=None):
+    """Append this sync's rows to the changeset, dropping rows every consumer has acknowledged. Returns rows added."""
+    now = time.time()
+    rows = []
+    for kind in ("new", "changed"):
+        for a in changes[kind]:
+            rows.append({
+                "asset_id": a.get("id"),
+                "key": asset_key(a),
+                "change": kind,
+                "download_url": asset_url(a),
+                "filename": a.get("name") or a.get("filename"),
+            })
+    for key, asset_id in changes["deleted"]:
+        rows.append({"asset_id": asset_id or None, "key": key, "change": "deleted", "download_url": None, "filename": None})
+    for r in rows:
+        r["synced_at"] = now
+
+    pending = _read_changeset(path)
+    pending = pending[pending["synced_at"] > acknowledged(db_path=db_path)]
+    frames = [f for f in (pending, pd.DataFrame(rows, columns=CHANGESET_COLUMNS)) if len(f)]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=CHANGESET_COLUMNS)
+    tmp = Path(f"{path}.{os.getpid()}.tmp")
+    df[CHANGESET_COLUMNS].to_csv(tmp, index=False, encoding="utf-8-sig")
+    os.replace(tmp, path)
+    return len(rows)
+
+
+def changeset_mark(path=CHANGESET_CSV):
+    """Newest sync time in the changeset: read it before the changeset, acknowledge it after the run."""
+    df = _read_changeset(path)
+    return float(df["synced_at"].max()) if len(df) else 0.0
+
+
+def load_changeset(path=CHANGESET_CSV, consumer=None, db_path=None):
+    """{change kind: set of asset_ids} of the rows consumer hasn't acknowledged yet (all rows if None)."""
+    out = {k: set() for k in CHANGE_KINDS}
+    df = _read_changeset(path)
+    if consumer is not None:
+        df = df[df["synced_at"] > acknowledged(consumer, db_path)]
+    for kind in CHANGE_KINDS:
+        sub = df[df["change"] == kind]
+        out[kind] = set(sub["asset_id"].dropna()) | set(sub["key"].dropna())
+    return out
+
+
+def stale_ids(path=CHANGESET_CSV, consumer=None):
+    """asset_ids (or download URL keys, for assets without an id) whose downstream results must be dropped: changed + deleted."""
+    cs = load_changeset(path, consumer)
+    return cs["changed"] | cs["deleted"]
+
+
+def resolve_stale(stale, df):
+    """
+    stale_ids plus the asset_id of every row of df (asset_id, download_url) whose
+    download URL is stale: assets without a Canto id are keyed by URL in the
+    changeset, while downstream results only carry asset_id.
+    """
+    stale = {str(s) for s in stale}
+    if "download_url" in df.columns:
+        stale |= {str(a) for a in df.loc[df["download_url"].astype(str).isin(stale), "asset_id"]}
+    return stale
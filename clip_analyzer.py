@@ -0,0 +1,401 @@
+# clip_analyzer.py
+# One download + one decode per clip for every per-clip metric.
+#
+# Each plugin declares which frame indices it needs (the same evenly spaced
+# samples its standalone script reads) and turns those frames into columns:
+#
+#   quality  sharp_mean, sharp_median, brightness_mean, motion_mean, decision  (video_quality)
+#   mood     mood_brightness, mood_contrast, mood_temp, mood_motion             (compute_mood)
+#   flow     flow_motion: Farneback magnitude on sampled frame pairs            (smart_analyze)
+#   faces    face_count in the first frame (needs mediapipe)                    (smart_analyze)
+#   tags     top_tags, tag_scores_json + CLIP embedding (needs torch/open_clip) (auto_tag_videos)
+#
+# The analyzer reads the union of those indices in one forward pass over the
+# file and hands every plugin its own frames. Results are merged into one
+# record per asset_id in a SQLite store (re-running with a new plugin only
+# decodes for the missing one) and exported to one CSV. Only plugins that
+# produced their columns are marked done; a failed one runs again next time.
+#
+# process_candidates, auto_tag_videos and compute_mood take a clip's columns
+# from this store (stored_records) when it was analyzed from the same
+# download URL, instead of downloading and decoding it again.
+#
+#   python clip_analyzer.py                               # quality,mood,flow
+#   python clip_analyzer.py --plugins quality,mood,tags --export canto_clip_analysis.csv
+
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import asset_store
+import canto_sync
+import clip_embeddings
+from compute_mood import mood_metrics
+from smart_analyze import count_faces, flow_magnitude
+from video_quality import NUM_FRAMES_SAMPLE, decide_usable, quality_metrics
+
+INPUT_CSV = "canto_candidates.csv"
+OUTPUT_CSV = "canto_clip_analysis.csv"
+STORE_PATH = Path(os.environ.get("VIDEOSCORE_ANALYSIS_STORE", "cache/clip_analysis.sqlite"))
+
+DEFAULT_PLUGINS = ("quality", "mood", "flow")
+FLUSH_EVERY = 100
+
+# Farther apart than this, seek instead of decoding the frames in between.
+SEEK_GAP = 48
+
+
+def evenly(frame_count, n):
+    """np.linspace sample indices used by the standalone scripts (may repeat for short clips)."""
+    return [int(i) for i in np.linspace(0, frame_count - 1, n).astype(int)]
+
+
+# ---------------------------
+# Plugins
+# ---------------------------
+# frames(frame_count) -> indices; run(frames, ctx) -> dict of columns; needs: optional modules.
+Plugin = namedtuple("Plugin", "name frames run needs", defaults=((),))
+
+
+def _quality_run(frames, ctx):
+    metrics = quality_metrics([cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames])
+    if metrics is None:
+        return {}
+    return {**metrics, "decision": decide_usable(metrics)}
+
+
+def _mood_run(frames, ctx):
+    return mood_metrics(frames) or {}
+
+
+def _flow_frames(frame_count):
+    # pairs of consecutive frames at the quality sample points
+    starts = evenly(frame_count - 1, NUM_FRAMES_SAMPLE) if frame_count > 1 else []
+    return [i for s in starts for i in (s, s + 1)]
+
+
+def _flow_run(frames, ctx):
+    grays = [cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames]
+    mags = [flow_magnitude(grays[i], grays[i + 1]) for i in range(0, len(grays) - 1, 2)]
+    return {"flow_motion": float(np.mean(mags)) if mags else 0.0}
+
+
+_faces_lock = threading.Lock()  # mediapipe graphs aren't safe to share between threads
+
+
+def _faces_run(frames, ctx):
+    with _faces_lock:
+        return {"face_count": count_faces(frames[0])}
+
+
+_tagger = {}
+_tagger_lock = threading.Lock()
+
+
+def _tags_run(frames, ctx):
+    import torch
+    from PIL import Image
+
+    import auto_tag_videos
+
+    with _tagger_lock:
+        if not _tagger:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            model, preprocess, text_features, tag_pairs = auto_tag_videos.load_clip_model(device)
+            _tagger.update(device=device, model=model, preprocess=preprocess, text=text_features, pairs=tag_pairs)
+
+    t = _tagger
+    images = [Image.fromarray(cv2.cvtColor(f, cv2.COLOR_BGR2RGB)) for f in frames]
+    with torch.no_grad():
+        feats = t["model"].encode_image(torch.stack([t["preprocess"](im) for im in images]).to(t["device"]))
+        feats /= feats.norm(dim=-1, keepdim=True)
+
+    row = auto_tag_videos.score_row({"asset_id": ctx["asset_id"]}, feats, t["text"], t["pairs"])
+    ctx["embedding"] = clip_embeddings.normalized_mean(feats.float().cpu().numpy())
+    return {"top_tags": row["top_tags"], "tag_scores_json": row["tag_scores_json"]}
+
+
+PLUGINS = {
+    p.name: p for p in (
+        Plugin("quality", lambda n: evenly(n, min(NUM_FRAMES_SAMPLE, n)), _quality_run),
+        Plugin("mood", lambda n: evenly(n, 10), _mood_run),
+        Plugin("flow", _flow_frames, _flow_run),
+        Plugin("faces", lambda n: [0], _faces_run, ("mediapipe",)),
+        Plugin("tags", lambda n: evenly(n, min(5, n)), _tags_run, ("torch", "open_clip")),
+    )
+}
+
+
+def usable_plugins(names):
+    """names minus plugins whose optional modules aren't installed (warned once)."""
+    import importlib.util
+
+    out = []
+    for name in names:
+        missing = [m for m in PLUGINS[name].needs if importlib.util.find_spec(m) is None]
+        if missing:
+            print(f"⚠️ plugin {name} skipped: {', '.join(missing)} not installed")
+        else:
+            out.append(name)
+    return out
+
+
+# ---------------------------
+# Single pass
+# ---------------------------
+def read_frames(video_path, indices):
+    """{index: BGR frame} for the given indices, read in one forward pass (seeking over long gaps)."""
+    wanted = sorted(set(int(i) for i in indices if i >= 0))
+    cap = cv2.VideoCapture(str(video_path))
+    frames = {}
+    pos = 0
+    try:
+        for idx in wanted:
+            if idx - pos > SEEK_GAP or idx < pos:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+                pos = idx
+            while pos < idx and cap.grab():
+                pos += 1
+            if pos < idx:
+                break  # EOF before idx: don't hand the last decoded frame to a later index
+            ok, frame = cap.read()
+            pos += 1
+            if not ok or frame is None:
+                break
+            frames[idx] = frame
+    finally:
+        cap.release()
+    return frames
+
+
+def analyze_clip(video_path, plugins=DEFAULT_PLUGINS, asset_id=None):
+    """
+    Run plugins over one clip with a single decode.
+    Returns (columns, ctx, succeeded): merged plugin columns plus "status"
+    ("ok", "partial" when some plugins failed or got no frames, else
+    "error_analyze"); ctx may carry side outputs (the CLIP "embedding" of the
+    tags plugin); succeeded is the set of plugins whose columns are in columns.
+    """
+    ctx = {"asset_id": asset_id, "path": str(video_path)}
+    cap = cv2.VideoCapture(str(video_path))
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+    cap.release()
+    if frame_count <= 0:
+        return {"status": "error_analyze", "error": "cannot_read_video"}, ctx, set()
+
+    wanted = {name: PLUGINS[name].frames(frame_count) for name in plugins}
+    samples = read_frames(video_path, [i for idx in wanted.values() for i in idx])
+    if not samples:
+        return {"status": "error_analyze", "error": "no_frames"}, ctx, set()
+
+    out = {"frame_count": frame_count}
+    succeeded, errors = set(), []
+    for name in plugins:
+        frames = [samples[i] for i in wanted[name] if i in samples]
+        if not frames:
+            errors.append(f"{name}: no_frames")
+            continue
+        try:
+            columns = PLUGINS[name].run(frames, ctx)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+            continue
+        if not columns:
+            errors.append(f"{name}: no_result")
+            continue
+        out.update(columns)
+        succeeded.add(name)
+    out["status"] = "ok" if not errors else "partial" if succeeded else "error_analyze"
+    out["error"] = "; ".join(errors)
+    return out, ctx, succeeded
+
+
+# ---------------------------
+# Record store
+# ---------------------------
+def open_store(path=None):
+    path = Path(path or STORE_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS clips ("
+        " asset_id TEXT PRIMARY KEY, plugins TEXT NOT NULL, record TEXT NOT NULL, updated REAL NOT NULL)"
+    )
+    return conn
+
+
+def stored_plugins(conn):
+    """{asset_id: set of plugins already in its record}."""
+    return {aid: set(p.split(",")) - {""} for aid, p in conn.execute("SELECT asset_id, plugins FROM clips")}
+
+
+def merge_records(conn, results):
+    """
+    Merge [(asset_id, succeeded plugins, columns)] into the stored records (new columns win).
+    Only plugins that succeeded are marked done; failed/skipped ones run again next time.
+    """
+    now = time.time()
+    with conn:
+        for asset_id, succeeded, columns in results:
+            row = conn.execute("SELECT plugins, record FROM clips WHERE asset_id = ?", (asset_id,)).fetchone()
+            done, record = (set(row[0].split(",")) - {""}, json.loads(row[1])) if row else (set(), {})
+            record.update(columns)
+            done |= set(succeeded)
+            conn.execute(
+                "INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?)",
+                (asset_id, ",".join(sorted(done)), json.dumps(record, ensure_ascii=False), now),
+            )
+
+
+def stored_records(plugin, path=None):
+    """
+    {asset_id: record} of clips whose stored record has this plugin's columns
+    (empty without a store). Lets the standalone scripts skip the download and decode.
+    """
+    path = Path(path or STORE_PATH)
+    if not path.exists():
+        return {}
+    try:
+        conn = sqlite3.connect(str(path), timeout=60)
+        try:
+            rows = conn.execute("SELECT asset_id, plugins, record FROM clips").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not read clip analysis store: {e}")
+        return {}
+    return {aid: json.loads(rec) for aid, plugins, rec in rows if plugin in plugins.split(",")}
+
+
+def reusable(records, row):
+    """Stored record for this row if it was analyzed from the same download URL (else None)."""
+    rec = records.get(str(row.get("asset_id")))
+    if rec is None or rec.get("download_url") != row.get("download_url"):
+        return None
+    return rec
+
+
+def export_csv(conn, out_path=OUTPUT_CSV):
+    records = [json.loads(r) for (r,) in conn.execute("SELECT record FROM clips ORDER BY asset_id")]
+    pd.DataFrame(records).to_csv(out_path, index=False, encoding="utf-8-sig")
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-decode clip analysis (quality/mood/flow/faces/tags)")
+    parser.add_argument("--csv", default=INPUT_CSV, help="clip list with asset_id, filename, download_url")
+    parser.add_argument("--plugins", default=",".join(DEFAULT_PLUGINS), help=f"comma list of {', '.join(PLUGINS)}")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--export", default=OUTPUT_CSV, help="merged CSV written at the end")
+    parser.add_argument("--flush-every", type=int, default=FLUSH_EVERY)
+    parser.add_argument("--redo", action="store_true", help="re-run plugins already stored")
+    parser.add_argument(
+        "--changeset", nargs="?", const=canto_sync.CHANGESET_CSV, default=None,
+        help="re-analyze assets changed/deleted in Canto syncs not yet applied by this stage",
+    )
+    args = parser.parse_args()
+
+    plugins = [p.strip() for p in args.plugins.split(",") if p.strip()]
+    unknown = [p for p in plugins if p not in PLUGINS]
+    if unknown:
+        raise SystemExit(f"Unknown plugins: {unknown} (available: {', '.join(PLUGINS)})")
+    plugins = usable_plugins(plugins)
+
+    df = pd.read_csv(args.csv)
+    df["asset_id"] = df["asset_id"].astype(str)
+    df = df.drop_duplicates(subset=["asset_id"])
+
+    conn = open_store()
+    mark = 0.0
+    if args.changeset:
+        mark = canto_sync.changeset_mark(args.changeset)
+        stale = canto_sync.resolve_stale(canto_sync.stale_ids(args.changeset, "clip_analyzer"), df)
+        with conn:
+            conn.executemany("DELETE FROM clips WHERE asset_id = ?", [(a,) for a in stale])
+    done = {} if args.redo else stored_plugins(conn)
+    # per clip: only the plugins its record doesn't have yet
+    todo = []
+    for r in df.to_dict("records"):
+        missing = [p for p in plugins if p not in done.get(r["asset_id"], set())]
+        if missing:
+            todo.append((r, missing))
+    print(f"Clip analysis: {len(df) - len(todo)} up to date, {len(todo)} to analyze ({', '.join(plugins)})")
+
+    vectors = clip_embeddings.read_embeddings() if "tags" in plugins else {}
+    results = queue.Queue()
+    buffer = []
+
+    def flush():
+        if buffer:
+            merge_records(conn, buffer)
+            buffer.clear()
+            if vectors:
+                clip_embeddings.write_embeddings(vectors)
+
+    def work(row, missing, download):
+        base = {"filename": row.get("filename"), "download_url": row.get("download_url")}
+        try:
+            path = download.result()
+        except Exception as e:
+            return row, set(), {**base, "status": "error_download", "error": str(e)}, {}
+        try:
+            columns, ctx, succeeded = analyze_clip(path, missing, asset_id=row["asset_id"])
+        except Exception as e:
+            columns, ctx, succeeded = {"status": "error_analyze", "error": str(e)}, {}, set()
+        return row, succeeded, {**base, **columns}, ctx
+
+    window = max(1, args.workers) * 4
+    with tqdm(total=len(todo), desc="Analyzing clips") as bar, \
+            ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+
+        def submit(row, missing):
+            url = row.get("download_url")
+            if not isinstance(url, str) or not url.startswith("http"):
+                results.put((row, set(), {"filename": row.get("filename"), "status": "no_download_url", "error": ""}, {}))
+                return
+            download = asset_store.prefetch([(url, row["asset_id"])])[0]
+            # analysis starts when this clip's own download lands
+            download.add_done_callback(
+                lambda f, row=row, missing=missing: pool.submit(lambda: results.put(work(row, missing, f)))
+            )
+
+        next_i = 0
+        in_flight = 0
+        while next_i < len(todo) or in_flight:
+            while next_i < len(todo) and in_flight < window:
+                submit(*todo[next_i])
+                next_i += 1
+                in_flight += 1
+
+            row, succeeded, columns, ctx = results.get()
+            in_flight -= 1
+            bar.update(1)
+            if ctx.get("embedding") is not None:
+                vectors[row["asset_id"]] = ctx["embedding"]
+            buffer.append((row["asset_id"], succeeded, {"asset_id": row["asset_id"], **columns}))
+            if len(buffer) >= args.flush_every:
+                flush()
+
+        flush()
+
+    canto_sync.acknowledge("clip_analyzer", mark)
+    n = export_csv(conn, args.export)
+    conn.close()
+    print(f"✓ Clip analysis: {args.export} ({n} clips)")
+
+
+if __name__ == "__main__":
+    main()
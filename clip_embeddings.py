@@ -0,0 +1,201 @@
+# clip_embeddings.py
+# Stored CLIP image embeddings + prompt encoding for semantic clip retrieval.
+#
+# auto_tag_videos keeps the normalized mean ViT-B-32 image feature of every
+# clip it tags in one float16 matrix (.npz next to the tag CSV, ~1 KB/clip).
+# At request time the prompt goes through the same model's text tower and the
+# nearest clips come out of one matrix multiply, or a faiss HNSW index when
+# the library is large and faiss is installed.
+#
+# torch/open_clip are only needed to encode prompts; without them (or without
+# the .npz) available() is False and clip_selector keeps keyword scoring.
+
+import io
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+EMBEDDINGS_PATH = Path(os.environ.get("VIDEOSCORE_CLIP_EMBEDDINGS", "canto_clip_embeddings.npz"))
+MODEL_NAME = "ViT-B-32"
+PRETRAINED = "openai"
+
+# Below this many clips the exact matmul is faster than building/querying an ANN index.
+ANN_MIN_ROWS = int(os.environ.get("VIDEOSCORE_ANN_MIN_ROWS", "100000"))
+
+_MODEL_KEY = "__model__"
+
+_cache = {"mtime": None, "ids": np.empty(0, dtype=str), "features": np.empty((0, 0), dtype=np.float32), "ann": None}
+_cache_lock = threading.Lock()
+
+_text_model = {}
+_text_failed = []
+_text_lock = threading.Lock()
+_TEXT_CACHE = OrderedDict()
+_TEXT_CACHE_SIZE = 256
+
+
+def semantic_enabled():
+    return os.environ.get("VIDEOSCORE_SEMANTIC", "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+# ---------------------------
+# Storage
+# ---------------------------
+def normalized_mean(image_features):
+    """One clip vector from its per-frame features: mean of the unit vectors, re-normalized."""
+    f = np.asarray(image_features, dtype=np.float32)
+    f = f / np.maximum(np.linalg.norm(f, axis=-1, keepdims=True), 1e-12)
+    v = f.mean(axis=0)
+    return v / max(float(np.linalg.norm(v)), 1e-12)
+
+
+def read_embeddings(path=None):
+    """{asset_id: float16 vector} from the .npz; empty if missing or from another model."""
+    path = Path(path or EMBEDDINGS_PATH)
+    if not path.exists():
+        return {}
+    with np.load(path, allow_pickle=False) as z:
+        model = str(z[_MODEL_KEY]) if _MODEL_KEY in z.files else f"{MODEL_NAME}/{PRETRAINED}"
+        if model != f"{MODEL_NAME}/{PRETRAINED}":
+            print(f"⚠️ Embeddings were made with {model}, expected {MODEL_NAME}/{PRETRAINED}; ignoring them")
+            return {}
+        return dict(zip(z["asset_ids"].tolist(), z["features"]))
+
+
+def write_embeddings(vectors, path=None):
+    """Atomically write {asset_id: vector} as one float16 matrix."""
+    path = Path(path or EMBEDDINGS_PATH)
+    ids = list(vectors)
+    features = np.stack([np.asarray(vectors[k], dtype=np.float16) for k in ids]) if ids else np.empty((0, 0), np.float16)
+    buf = io.BytesIO()
+    np.savez(
+        buf,
+        asset_ids=np.asarray([str(k) for k in ids], dtype=str),
+        features=features,
+        **{_MODEL_KEY: np.asarray(f"{MODEL_NAME}/{PRETRAINED}")},
+    )
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(buf.getvalue())
+    os.replace(tmp, path)
+
+
+def load():
+    """
+    (asset_ids array, float32 (n, d) matrix), reloaded when the .npz changes on disk.
+    Upcast once here: numpy has no fast float16 matmul, and per-query conversion costs more than the product.
+    """
+    try:
+        mtime = EMBEDDINGS_PATH.stat().st_mtime
+    except OSError:
+        return _cache["ids"][:0], _cache["features"][:0]
+    with _cache_lock:
+        if _cache["mtime"] != mtime:
+            try:
+                vectors = read_embeddings()
+            except Exception as e:
+                print(f"⚠️ Could not read clip embeddings: {e}")
+                vectors = {}
+            _cache["ids"] = np.asarray(list(vectors), dtype=str)
+            _cache["features"] = (
+                np.stack(list(vectors.values())).astype(np.float32) if vectors else np.empty((0, 0), np.float32)
+            )
+            _cache["ann"] = None
+            _cache["mtime"] = mtime
+        return _cache["ids"], _cache["features"]
+
+
+# ---------------------------
+# Prompt encoding
+# ---------------------------
+def _load_text_model():
+    with _text_lock:
+        if not _text_model:
+            import open_clip
+            import torch
+
+            model, _, _ = open_clip.create_model_and_transforms(MODEL_NAME, pretrained=PRETRAINED)
+            model.eval()
+            _text_model.update(model=model, tokenizer=open_clip.get_tokenizer(MODEL_NAME), torch=torch)
+        return _text_model
+
+
+def available():
+    """True when there are stored embeddings and the text tower can be loaded."""
+    if _text_failed or not semantic_enabled() or not len(load()[0]):
+        return False
+    try:
+        _load_text_model()
+    except Exception as e:
+        # Don't retry (and re-print) on every request.
+        _text_failed.append(e)
+        print(f"⚠️ Semantic retrieval unavailable ({e}); using keyword scoring")
+        return False
+    return True
+
+
+def encode_text(text):
+    """Unit float32 text feature of text (cached per prompt)."""
+    key = str(text).strip().lower()
+    with _text_lock:
+        v = _TEXT_CACHE.get(key)
+        if v is not None:
+            _TEXT_CACHE.move_to_end(key)
+            return v
+
+    m = _load_text_model()
+    torch = m["torch"]
+    with torch.no_grad():
+        f = m["model"].encode_text(m["tokenizer"]([key]))
+        f /= f.norm(dim=-1, keepdim=True)
+    v = f[0].float().cpu().numpy()
+
+    with _text_lock:
+        _TEXT_CACHE[key] = v
+        while len(_TEXT_CACHE) > _TEXT_CACHE_SIZE:
+            _TEXT_CACHE.popitem(last=False)
+    return v
+
+
+# ---------------------------
+# Retrieval
+# ---------------------------
+def similarities(query):
+    """Cosine similarity of query to every stored clip (order of load()[0])."""
+    return load()[1] @ np.asarray(query, dtype=np.float32)
+
+
+def _ann_index(features):
+    with _cache_lock:
+        if _cache["ann"] is None:
+            import faiss
+
+            index = faiss.IndexHNSWFlat(features.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+            index.add(np.ascontiguousarray(features))
+            _cache["ann"] = index
+        return _cache["ann"]
+
+
+def nearest(query, k):
+    """(asset_ids, similarities) of the k clips closest to query, best first."""
+    ids, features = load()
+    k = min(int(k), len(ids))
+    if k <= 0:
+        return ids[:0], np.empty(0, dtype=np.float32)
+
+    if len(ids) >= ANN_MIN_ROWS:
+        try:
+            index = _ann_index(features)
+            sims, rows = index.search(np.asarray(query, dtype=np.float32)[None, :], k)
+            keep = rows[0] >= 0
+            return ids[rows[0][keep]], sims[0][keep]
+        except ImportError:
+            pass
+
+    sims = similarities(query)
+    rows = np.argpartition(-sims, k - 1)[:k]
+    rows = rows[np.argsort(-sims[rows], kind="stable")]
+    return ids[rows], sims[rows]
@@ -0,0 +1,120 @@
+# clip_library.py
+# The tag library, parsed once per process.
+#
+# The CSV is compiled to a typed columnar file (Parquet when pyarrow is
+# installed, pickle otherwise) under cache/library/, tagged with the CSV's
+# mtime/size. Each load() is one stat(): if the CSV changed, a fresh frame is
+# built and swapped in under a lock, so a running job keeps the frame it got.
+#
+# Frames handed out are shared between jobs: treat them as read-only (the
+# selectors already .copy() before adding score columns).
+
+import json
+import os
+import pickle
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+LIBRARY_CSV = "canto_clip_tags_with_urls.csv"
+LIBRARY_CACHE_DIR = Path(os.environ.get("VIDEOSCORE_LIBRARY_CACHE_DIR", "cache/library"))
+
+# Bump when _normalize changes, so stale compiled files are rebuilt.
+_FORMAT_VERSION = 1
+
+_loaded = {}  # resolved csv path -> {"sig": (mtime_ns, size), "all": df, "ok": df}
+_lock = threading.Lock()
+
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PARQUET = True
+except Exception:
+    _HAS_PARQUET = False
+
+
+def _signature(csv_path: Path):
+    st = csv_path.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    if "asset_id" in df.columns:
+        df["asset_id"] = df["asset_id"].astype(str)
+    for col in ("top_tags", "folder_path", "filename", "download_url"):
+        if col in df.columns:
+            df[col] = df[col].fillna("").astype(str)
+    for col in ("width", "height", "rotation", "mood_motion", "duration_sec"):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    if "status" in df.columns:
+        df["status"] = df["status"].astype("category")
+    return df.reset_index(drop=True)
+
+
+def _compiled_paths(csv_path: Path):
+    stem = LIBRARY_CACHE_DIR / csv_path.stem
+    data = stem.with_suffix(".parquet" if _HAS_PARQUET else ".pkl")
+    return data, stem.with_suffix(".meta.json")
+
+
+def _read_compiled(csv_path: Path, sig):
+    data_path, meta_path = _compiled_paths(csv_path)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("source") != str(csv_path) or tuple(meta.get("sig", ())) != sig or meta.get("version") != _FORMAT_VERSION:
+            return None
+        if data_path.suffix == ".parquet":
+            return pd.read_parquet(data_path)
+        with open(data_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def _write_compiled(csv_path: Path, sig, df: pd.DataFrame):
+    data_path, meta_path = _compiled_paths(csv_path)
+    try:
+        LIBRARY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = data_path.with_name(f"{data_path.name}.{os.getpid()}.tmp")
+        if data_path.suffix == ".parquet":
+            df.to_parquet(tmp, index=False)
+        else:
+            with open(tmp, "wb") as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, data_path)
+
+        tmp_meta = meta_path.with_name(f"{meta_path.name}.{os.getpid()}.tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"source": str(csv_path), "sig": list(sig), "version": _FORMAT_VERSION}, f)
+        os.replace(tmp_meta, meta_path)
+    except Exception as e:
+        # The compiled copy is only a speed-up; the frame in memory is still good.
+        print(f"⚠️ Could not write compiled library: {e}")
+
+
+def _build(csv_path: Path, sig):
+    df = _read_compiled(csv_path, sig)
+    if df is None:
+        df = _normalize(pd.read_csv(csv_path))
+        _write_compiled(csv_path, sig, df)
+    ok = df[df["status"] == "ok"] if "status" in df.columns else df
+    return {"sig": sig, "all": df, "ok": ok}
+
+
+def load(csv_path=LIBRARY_CSV, ok_only=True) -> pd.DataFrame:
+    """The library as a shared DataFrame (only status == "ok" rows by default)."""
+    csv_path = Path(csv_path).resolve()
+    sig = _signature(csv_path)
+
+    entry = _loaded.get(str(csv_path))
+    if entry is None or entry["sig"] != sig:
+        with _lock:
+            entry = _loaded.get(str(csv_path))
+            if entry is None or entry["sig"] != sig:
+                entry = _build(csv_path, sig)
+                _loaded[str(csv_path)] = entry
+                print(f"📚 Clip library loaded: {csv_path.name} ({len(entry['all'])} rows)")
+
+    return entry["ok"] if ok_only else entry["all"]
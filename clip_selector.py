@@ -1,8 +1,13 @@
 # clip_selector.py (Zone-aware version)
 
 import random
+
+import numpy as np
 import pandas as pd
 
+import clip_embeddings
+import tag_index
+
 # Zone/folder mapping for Canto
 ZONE_KEYWORDS = {
     "jumanji": ["jumanji", "zone d"],
@@ -13,6 +18,32 @@ ZONE_KEYWORDS = {
     "food": ["food", "beverage", "restaurant"],
 }
 
+# Tag penalties (score_by_prompt)
+LOGO_TERMS = ["logo", "watermark", "text", "title", "caption", "poster"]
+STATIC_TERMS = ["static", "still", "freeze"]
+
+# -----------------------------------------
+# Term-membership matrices (vectorized scoring, backed by tag_index postings)
+# -----------------------------------------
+def term_matrix(texts: pd.Series, terms, split_phrases=True, rows=None) -> np.ndarray:
+    """
+    (len(terms), len(texts)) int64 matrix: 1 where the term is a substring of the
+    lower-cased text (same test as `term in text.lower()`). Rows may repeat.
+    rows: only these row positions (columns of the result).
+    split_phrases=False for columns that aren't comma-separated tag lists (folder, filename).
+    """
+    idx = tag_index.index_for(texts, split_phrases=split_phrases)
+    n = idx.size if rows is None else len(rows)
+    if not terms:
+        return np.zeros((0, n), dtype=np.int64)
+    masks = [idx.mask(t) for t in terms]
+    if rows is not None:
+        masks = [m[rows] for m in masks]
+    return np.vstack(masks).astype(np.int64)
+
+def _any_row(m: np.ndarray) -> np.ndarray:
+    return m.max(axis=0) if len(m) else np.zeros(m.shape[1], dtype=np.int64)
+
 # -----------------------------------------
 # Score by zone matching
 # -----------------------------------------
@@ -47,50 +78,211 @@ def score_by_prompt(top_tags: str, prompt_info: dict):
         score += 1
 
     # Penalize logo/text heavy clips (watermarks, title cards, posters)
-    if any(bad in tags for bad in ["logo", "watermark", "text", "title", "caption", "poster"]):
+    if any(bad in tags for bad in LOGO_TERMS):
         score -= 8
 
     # Penalize extremely static scenes (we still want smooth, but not frozen)
-    if any(bad in tags for bad in ["static", "still", "freeze"]):
+    if any(bad in tags for bad in STATIC_TERMS):
         score -= 3
 
     return score
 
+# -----------------------------------------
+# Vectorized versions (same numbers as score_by_prompt / score_by_zone per row)
+# -----------------------------------------
+def penalty_scores(top_tags: pd.Series, rows=None) -> np.ndarray:
+    """The logo/text (-8) and static (-3) part of score_by_prompt."""
+    m = term_matrix(top_tags, LOGO_TERMS + STATIC_TERMS, rows=rows)
+    return -8 * _any_row(m[:len(LOGO_TERMS)]) - 3 * _any_row(m[len(LOGO_TERMS):])
+
+def prompt_scores(top_tags: pd.Series, prompt_info: dict, rows=None) -> np.ndarray:
+    themes = list(prompt_info["themes"])
+    m = term_matrix(top_tags, themes + [prompt_info["vibe"]], rows=rows)
+    weights = np.array([4] * len(themes) + [1], dtype=np.int64)
+    return weights @ m + penalty_scores(top_tags, rows=rows)
+
+def zone_scores(folder_paths: pd.Series, themes: list, rows=None) -> np.ndarray:
+    n = len(folder_paths) if rows is None else len(rows)
+    zone_themes = [t for t in themes if t in ZONE_KEYWORDS]
+    if not zone_themes:
+        return np.zeros(n, dtype=np.int64)
+    keywords = [kw for t in zone_themes for kw in ZONE_KEYWORDS[t]]
+    m = term_matrix(folder_paths, keywords, split_phrases=False, rows=rows)
+    score = np.zeros(n, dtype=np.int64)
+    pos = 0
+    for theme in zone_themes:
+        n = len(ZONE_KEYWORDS[theme])
+        score += 5 * _any_row(m[pos:pos + n])
+        pos += n
+    return score
+
 # -----------------------------------------
 # Rank โดยไม่ใช้ mood
 # -----------------------------------------
 def rank_clips(df: pd.DataFrame, prompt_info: dict):
 
-    df["prompt_score"] = df["top_tags"].apply(
-        lambda t: score_by_prompt(t, prompt_info)
-    )
+    df["prompt_score"] = prompt_scores(df["top_tags"], prompt_info)
     
     # Add zone bonus score
     if "folder_path" in df.columns:
-        df["zone_score"] = df["folder_path"].apply(
-            lambda f: score_by_zone(f, prompt_info["themes"])
-        )
+        df["zone_score"] = zone_scores(df["folder_path"], prompt_info["themes"])
     else:
         df["zone_score"] = 0
 
     # ไม่ใช้ mood → ใช้เฉพาะ prompt score + zone score
-    if "mood_motion" in df.columns:
-        mm = df["mood_motion"].fillna(df["mood_motion"].median())
-        mm_min, mm_max = float(mm.min()), float(mm.max())
-        if mm_max > mm_min:
-            mm_norm = (mm - mm_min) / (mm_max - mm_min)
-        else:
-            mm_norm = mm * 0 + 0.5
-
-        vibe = prompt_info.get("vibe") or "upbeat"
-        target = 0.40 if vibe == "relax" else 0.55
-        df["motion_score"] = 1.0 - (mm_norm - target).abs()
+    motion = motion_scores(df, prompt_info)
+    if motion is not None:
+        df["motion_score"] = motion
         df["overall"] = df["prompt_score"] * 2 + df["zone_score"] * 3 + df["motion_score"] * 1.5
     else:
         df["overall"] = df["prompt_score"] * 2 + df["zone_score"] * 3
 
     return df.sort_values("overall", ascending=False)
 
+def motion_scores(df: pd.DataFrame, prompt_info: dict):
+    """0..1 closeness of the clip's normalized mood_motion to the vibe's target (None without the column)."""
+    if "mood_motion" not in df.columns:
+        return None
+    mm = df["mood_motion"].fillna(df["mood_motion"].median())
+    mm_min, mm_max = float(mm.min()), float(mm.max())
+    if mm_max > mm_min:
+        mm_norm = (mm - mm_min) / (mm_max - mm_min)
+    else:
+        mm_norm = mm * 0 + 0.5
+
+    vibe = prompt_info.get("vibe") or "upbeat"
+    target = 0.40 if vibe == "relax" else 0.55
+    return 1.0 - (mm_norm - target).abs()
+
+
+# -----------------------------------------
+# Candidate-only ranking (inverted index)
+# -----------------------------------------
+# A clip that no theme/vibe tag and no zone keyword hits has prompt/zone score <= 0,
+# so its overall is at most this (motion_score * 1.5).
+_NON_CANDIDATE_MAX = 1.5
+
+def candidate_rows(df: pd.DataFrame, prompt_info: dict) -> np.ndarray:
+    """Row positions hit by a positive term of the prompt (theme/vibe tag or zone keyword)."""
+    themes = list(prompt_info["themes"])
+    hits = [tag_index.index_for(df["top_tags"]).rows_with_any(themes + [prompt_info["vibe"]])]
+    keywords = [kw for t in themes if t in ZONE_KEYWORDS for kw in ZONE_KEYWORDS[t]]
+    if keywords and "folder_path" in df.columns:
+        hits.append(tag_index.index_for(df["folder_path"], split_phrases=False).rows_with_any(keywords))
+    return np.unique(np.concatenate(hits))
+
+def _scores_at(df, prompt_info, rows, motion):
+    scores = {"prompt_score": prompt_scores(df["top_tags"], prompt_info, rows=rows)}
+    if "folder_path" in df.columns:
+        scores["zone_score"] = zone_scores(df["folder_path"], prompt_info["themes"], rows=rows)
+    else:
+        scores["zone_score"] = np.zeros(len(rows), dtype=np.int64)
+    overall = scores["prompt_score"] * 2 + scores["zone_score"] * 3
+    if motion is not None:
+        scores["motion_score"] = motion.to_numpy()[rows]
+        overall = overall + scores["motion_score"] * 1.5
+    scores["overall"] = overall
+    return scores
+
+def top_clips(df: pd.DataFrame, prompt_info: dict, n: int, allowed=None) -> pd.DataFrame:
+    """
+    The n best rows (same scores as rank_clips, ties in library order).
+    Only candidate rows are scored; if fewer than n of them beat the best
+    possible non-candidate score, every allowed row is scored instead.
+    allowed: optional bool mask over df rows.
+    """
+    motion = motion_scores(df, prompt_info)
+    bound = _NON_CANDIDATE_MAX if motion is not None else 0.0
+
+    rows = candidate_rows(df, prompt_info)
+    if allowed is not None:
+        rows = rows[allowed[rows]]
+    scores = _scores_at(df, prompt_info, rows, motion)
+    order = np.argsort(-scores["overall"], kind="stable")[:n]
+
+    if len(order) < n or (n > 0 and scores["overall"][order[-1]] <= bound):
+        rows = np.arange(len(df)) if allowed is None else np.flatnonzero(allowed)
+        scores = _scores_at(df, prompt_info, rows, motion)
+        order = np.argsort(-scores["overall"], kind="stable")[:n]
+
+    picked = df.iloc[rows[order]].copy()
+    for col, values in scores.items():
+        picked[col] = values[order]
+    return picked
+
+
+# -----------------------------------------
+# Semantic ranking (stored CLIP embeddings)
+# -----------------------------------------
+# Cosine similarities of relevant clips sit within ~0.1 of each other; x25 puts
+# that spread on the same scale as prompt_score * 2 in rank_clips.
+SEMANTIC_WEIGHT = 25.0
+
+def prompt_text(prompt_info: dict) -> str:
+    return prompt_info.get("text") or " ".join(list(prompt_info["themes"]) + [prompt_info["vibe"]])
+
+def semantic_top_clips(df: pd.DataFrame, prompt_info: dict, n: int, allowed=None) -> pd.DataFrame:
+    """
+    The n best rows by CLIP similarity to the prompt (+ zone/motion and the
+    logo/static penalties, weighted like rank_clips).
+    Clips without a stored embedding only fill up what's left, by keyword score.
+    """
+    ids = df["asset_id"].astype(str).to_numpy()
+    embedded = clip_embeddings.load()[0]
+    query = clip_embeddings.encode_text(prompt_text(prompt_info))
+
+    # asset_id -> first (allowed) row: the library may repeat an asset_id
+    first = pd.Series(np.arange(len(ids)), index=ids)
+    if allowed is not None:
+        first = first[allowed]
+    first = first[~first.index.duplicated()]
+
+    # Widen the neighbour search until enough of the hits are rows of df (and allowed).
+    k = max(n * 20, 500)
+    while True:
+        near_ids, sims = clip_embeddings.nearest(query, k)
+        hit = first.index.get_indexer(near_ids)
+        keep = hit >= 0
+        rows, sims = first.to_numpy()[hit[keep]], sims[keep]
+        if len(rows) >= n or k >= len(embedded):
+            break
+        k *= 4
+
+    motion = motion_scores(df, prompt_info)
+    if "folder_path" in df.columns:
+        zone = zone_scores(df["folder_path"], prompt_info["themes"], rows=rows)
+    else:
+        zone = np.zeros(len(rows), dtype=np.int64)
+    if "top_tags" in df.columns:
+        penalty = penalty_scores(df["top_tags"], rows=rows)
+    else:
+        penalty = np.zeros(len(rows), dtype=np.int64)
+    scores = {"semantic_score": sims.astype(np.float64), "zone_score": zone, "penalty_score": penalty}
+    # penalties count double, as they do inside prompt_score in rank_clips
+    overall = scores["semantic_score"] * SEMANTIC_WEIGHT + zone * 3 + penalty * 2
+    if motion is not None:
+        scores["motion_score"] = motion.to_numpy()[rows]
+        overall = overall + scores["motion_score"] * 1.5
+    scores["overall"] = overall
+    order = np.argsort(-overall, kind="stable")[:n]
+
+    picked = df.iloc[rows[order]].copy()
+    for col, values in scores.items():
+        picked[col] = values[order]
+
+    if len(picked) < n:
+        rest = ~np.isin(ids, embedded)
+        if allowed is not None:
+            rest &= allowed
+        if rest.any():
+            picked = pd.concat([picked, top_clips(df, prompt_info, n - len(picked), allowed=rest)])
+    return picked[~picked["asset_id"].astype(str).duplicated()]
+
+def _top(df, prompt_info, n, allowed=None):
+    if "asset_id" in df.columns and clip_embeddings.available():
+        return semantic_top_clips(df, prompt_info, n, allowed=allowed)
+    return top_clips(df, prompt_info, n, allowed=allowed)
+
 
 # -----------------------------------------
 # Simple Story Structure (ไม่ใช้ mood)
@@ -110,10 +302,51 @@ def build_story(df_ranked, n_shots=6):
     return story
 
 
+# -----------------------------------------
+# Orientation (width/height จาก library build, หมุนตาม rotation แล้ว)
+# -----------------------------------------
+ORIENTATIONS = ("portrait", "landscape", "square")
+
+def orientation_masks(df: pd.DataFrame, orientation: str):
+    """
+    (matching, unknown) bool arrays: rows whose recorded width/height match the
+    orientation, and rows with no recorded dimensions. Known mismatches are in neither.
+    """
+    if orientation not in ORIENTATIONS:
+        raise ValueError(f"orientation must be one of {ORIENTATIONS}, got {orientation!r}")
+    if "width" not in df.columns or "height" not in df.columns:
+        return np.zeros(len(df), dtype=bool), np.ones(len(df), dtype=bool)
+
+    w = pd.to_numeric(df["width"], errors="coerce").to_numpy()
+    h = pd.to_numeric(df["height"], errors="coerce").to_numpy()
+    known = (w > 0) & (h > 0)
+    if orientation == "portrait":
+        match = h > w
+    elif orientation == "landscape":
+        match = w > h
+    else:
+        match = w == h
+    return known & match, ~known
+
+def split_by_orientation(df: pd.DataFrame, orientation: str):
+    """(matching, unknown) frames, see orientation_masks."""
+    match, unknown = orientation_masks(df, orientation)
+    return df[match], df[unknown]
+
+
 # -----------------------------------------
 # MAIN SELECTOR (เรียกจาก generate_edit.py)
 # -----------------------------------------
-def select_clips(df: pd.DataFrame, prompt_info: dict, n_shots: int = 6):
-    df_ranked = rank_clips(df.copy(), prompt_info)
-    return df_ranked.head(n_shots)
+def select_clips(df: pd.DataFrame, prompt_info: dict, n_shots: int = 6, orientation: str = None):
+    # มี CLIP embeddings → ค้นด้วย semantic similarity, ไม่งั้นใช้ tag/zone (inverted index)
+    if not orientation:
+        return _top(df, prompt_info, n_shots)
 
+    # กรองก่อน rank → ไม่ต้องโหลดคลิปผิดแนวมาทิ้ง
+    matching, unknown = orientation_masks(df, orientation)
+    picked = _top(df, prompt_info, n_shots, allowed=matching)
+    if len(picked) < n_shots and unknown.any():
+        # คลิปที่ยังไม่รู้ขนาด ใช้เป็นตัวสำรองท้ายสุด (shot worker เช็คอีกทีหลังโหลด)
+        rest = _top(df, prompt_info, n_shots - len(picked), allowed=unknown)
+        picked = pd.concat([picked, rest])
+    return picked
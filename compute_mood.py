@@ -1,20 +1,13 @@
 import cv2
 import pandas as pd
 import numpy as np
-from pathlib import Path
 from tqdm import tqdm
-import requests
+
+import asset_store
 
 INPUT = "canto_clip_tags_with_urls.csv"
 OUT = "canto_clip_mood.csv"
-TEMP = "temp_mood.mp4"
-
-def download(url):
-    resp = requests.get(url, stream=True)
-    resp.raise_for_status()
-    with open(TEMP, "wb") as f:
-        for c in resp.iter_content(1024*1024):
-            f.write(c)
+MOOD_COLUMNS = ["mood_brightness", "mood_contrast", "mood_temp", "mood_motion"]
 
 def analyze(video_path):
     cap = cv2.VideoCapture(video_path)
@@ -28,7 +21,11 @@ def analyze(video_path):
         frames.append(frame)
     cap.release()
 
-    if not frames: return None
+    return mood_metrics(frames)
+
+def mood_metrics(frames):
+    """Brightness/contrast/colour temperature/motion of evenly spaced BGR frames (None if there are none)."""
+    if not len(frames): return None
 
     frames = np.array(frames)
 
@@ -52,16 +49,27 @@ def analyze(video_path):
         "mood_motion": float(motion)
     }
 
-df = pd.read_csv(INPUT)
-rows=[]
-for _, r in tqdm(df.iterrows(), total=len(df)):
-    url = r["download_url"]
-    download(url)
-    mood = analyze(TEMP)
-    if not mood:
-        mood={"mood_brightness":None,"mood_contrast":None,"mood_temp":None,"mood_motion":None}
-    rows.append({**r, **mood})
+def main():
+    import clip_analyzer  # imports mood_metrics from here
+
+    df = pd.read_csv(INPUT)
+    # คลิปที่ clip_analyzer คำนวณ mood ไว้แล้ว (URL เดียวกัน) → ไม่ต้องโหลด/decode ซ้ำ
+    analyzed = clip_analyzer.stored_records("mood")
+    rows=[]
+    for _, r in tqdm(df.iterrows(), total=len(df)):
+        rec = clip_analyzer.reusable(analyzed, r)
+        if rec is not None:
+            rows.append({**r, **{k: rec.get(k) for k in MOOD_COLUMNS}})
+            continue
+        url = r["download_url"]
+        video = asset_store.fetch(url, r.get("asset_id"))
+        mood = analyze(str(video))
+        if not mood:
+            mood={"mood_brightness":None,"mood_contrast":None,"mood_temp":None,"mood_motion":None}
+        rows.append({**r, **mood})
+
+    pd.DataFrame(rows).to_csv(OUT, index=False, encoding="utf-8-sig")
+    print("DONE:", OUT)
 
-pd.DataFrame(rows).to_csv(OUT, index=False, encoding="utf-8-sig")
-Path(TEMP).unlink(missing_ok=True)
-print("DONE:", OUT)
+if __name__ == "__main__":
+    main()
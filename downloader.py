@@ -1,5 +1,9 @@
 # downloader.py
 
+import hashlib
+import os
+import re
+import threading
 import requests
 from pathlib import Path
 
@@ -12,14 +16,102 @@ def download_file(url, out_path: Path, timeout=60):
     expected = resp.headers.get("Content-Length")
     expected = int(expected) if expected else None
 
+    # Write to a private temp name and rename at the end, so a concurrent reader
+    # never sees a half-written out_path.
+    part_path = out_path.with_name(f"{out_path.name}.{os.getpid()}-{threading.get_ident()}.part")
     total = 0
-    with open(out_path, "wb") as f:
+    try:
+        with open(part_path, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                if chunk:
+                    f.write(chunk)
+                    total += len(chunk)
+
+        if expected and total < expected:
+            raise RuntimeError(f"Downloaded incomplete file: got {total}, expected {expected}")
+
+        os.replace(part_path, out_path)
+    finally:
+        part_path.unlink(missing_ok=True)
+
+    return total
+
+
+def _validator_path(part_path: Path) -> Path:
+    return part_path.with_name(part_path.name + ".validator")
+
+
+def _content_range_start(resp):
+    """First byte offset of a 206 body ("bytes START-END/TOTAL"), or None if missing/unparseable."""
+    m = re.match(r"\s*bytes\s+(\d+)-\d+/", resp.headers.get("Content-Range", ""))
+    return int(m.group(1)) if m else None
+
+
+def download_resumable(url, part_path: Path, timeout=60, session=None):
+    """
+    Download url into part_path, resuming from whatever is already there
+    (HTTP Range + If-Range, so a file that changed on the server is fetched
+    again from byte 0 instead of being spliced onto the old bytes).
+    Returns (size, sha256 hex, resumed) of the complete file.
+    Raises if the server response doesn't add up to the advertised size.
+    """
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+    http = session or requests
+    validator_path = _validator_path(part_path)
+
+    existing = part_path.stat().st_size if part_path.exists() else 0
+    try:
+        validator = validator_path.read_text(encoding="utf-8").strip() if existing else ""
+    except OSError:
+        validator = ""
+    if existing and not validator:
+        # No ETag/Last-Modified from the first attempt: we can't tell if the remote file changed.
+        part_path.unlink(missing_ok=True)
+        existing = 0
+
+    headers = {"Range": f"bytes={existing}-", "If-Range": validator} if existing else {}
+    resp = http.get(url, stream=True, timeout=timeout, headers=headers)
+    if existing and (resp.status_code == 416 or (resp.status_code == 206 and _content_range_start(resp) != existing)):
+        # Range not satisfiable, or the server answered a different range: start over.
+        resp.close()
+        part_path.unlink(missing_ok=True)
+        existing = 0
+        resp = http.get(url, stream=True, timeout=timeout)
+    resp.raise_for_status()
+
+    h = hashlib.sha256()
+    if resp.status_code == 206 and existing:
+        mode = "ab"
+        # Hash the bytes we already have so the final digest covers the whole file.
+        with open(part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    else:
+        # Full body follows: server ignored the Range, or If-Range said the file changed.
+        mode = "wb"
+        existing = 0
+        validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified") or ""
+        if validator.startswith("W/"):
+            validator = resp.headers.get("Last-Modified") or ""  # weak ETags aren't allowed in If-Range
+        if validator:
+            validator_path.write_text(validator, encoding="utf-8")
+        else:
+            validator_path.unlink(missing_ok=True)
+
+    expected = resp.headers.get("Content-Length")
+    expected = existing + int(expected) if expected else None
+
+    resumed = existing > 0
+    total = existing
+    with open(part_path, mode) as f:
         for chunk in resp.iter_content(chunk_size=1024 * 1024):
             if chunk:
                 f.write(chunk)
+                h.update(chunk)
                 total += len(chunk)
 
     if expected and total < expected:
         raise RuntimeError(f"Downloaded incomplete file: got {total}, expected {expected}")
 
-    return total
+    validator_path.unlink(missing_ok=True)
+    return total, h.hexdigest(), resumed
@@ -2,8 +2,12 @@
 from pathlib import Path
 import random
 import cv2
+import json
 import os
 
+import frame_reader
+import probe_cache
+
 def run(cmd):
     # capture_output=True  Error
     process = subprocess.run(cmd, capture_output=True, text=True)
@@ -78,16 +82,29 @@ def low_resource_mode():
 
     return False
 
+# Per-process thread budget for ffmpeg children (set by shot_executor workers).
+_FFMPEG_THREADS = None
+
+def set_ffmpeg_threads(n):
+    global _FFMPEG_THREADS
+    _FFMPEG_THREADS = max(1, int(n)) if n else None
+
 def ffmpeg_resource_args():
     # Limit threads to reduce RAM spikes / CPU contention in small containers.
-    if not low_resource_mode():
-        return []
-    return ["-threads", "1", "-filter_threads", "1"]
+    if low_resource_mode():
+        return ["-threads", "1", "-filter_threads", "1"]
+    if _FFMPEG_THREADS:
+        return ["-threads", str(_FFMPEG_THREADS), "-filter_threads", str(_FFMPEG_THREADS)]
+    return []
 
 # ---------------------------
 # 1) Read video duration
 # ---------------------------
 def get_duration(video_path: Path):
+    info = probe_cache.get_info(video_path)
+    if info and info["duration"] > 0:
+        return info["duration"]
+    # ffprobe missing / unreadable container: fall back to OpenCV's frame count.
     cap = cv2.VideoCapture(str(video_path))
     if not cap.isOpened():
         return 0.0
@@ -97,6 +114,10 @@ def get_duration(video_path: Path):
     return frames / fps if frames > 0 else 0.0
 
 def get_resolution(video_path: Path):
+    # Display size: a phone clip stored 1920x1080 with rotate=90 is portrait.
+    info = probe_cache.get_info(video_path)
+    if info and info["width"] > 0:
+        return info["width"], info["height"]
     cap = cv2.VideoCapture(str(video_path))
     if not cap.isOpened():
         return 0, 0
@@ -105,6 +126,32 @@ def get_resolution(video_path: Path):
     cap.release()
     return w, h
 
+def _analysis_threads():
+    if low_resource_mode():
+        return 1
+    return _FFMPEG_THREADS
+
+def scan_motion_profile(video_path: Path, sample_fps: float = 6.0, stop_seconds=None):
+    """
+    One forward decode (no seeks): diffs[i] = mean |gray(i+1) - gray(i)| of 128x72
+    thumbnails taken every 1/sample_fps seconds (sampled/scaled inside ffmpeg).
+    """
+    import numpy as np
+
+    prev = None
+    diffs = []
+    for small in frame_reader.gray_frames(
+        video_path, 128, 72, fps=sample_fps, duration=stop_seconds, threads=_analysis_threads()
+    ):
+        cur = small.astype(np.int16)
+        if prev is not None:
+            diffs.append(float(np.abs(cur - prev).mean()))
+        prev = cur
+
+    if len(diffs) < 3:
+        return None
+    return np.asarray(diffs, dtype=np.float32)
+
 def find_smooth_start(
     video_path: Path,
     seg_len: float,
@@ -113,73 +160,31 @@ def find_smooth_start(
     min_motion: float = 0.8,
     target_quantile: float = 0.35,
     candidates: int = 18,
+    profile=None,
+    rng=None,
     max_samples_per_candidate: int = 18,
 ):
-    cap = cv2.VideoCapture(str(video_path))
-    if not cap.isOpened():
-        return None
-
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
-    if fps <= 0 or total_frames <= 0:
-        cap.release()
-        return None
-
-    window_frames = max(1, int(round(seg_len * fps)))
-    max_start_frame = total_frames - window_frames
-    if max_start_frame <= 1:
-        cap.release()
-        return 0.0
-
-    edge_frames = int(round(edge_seconds * fps))
-    lo = max(0, edge_frames)
-    hi = max(lo, max_start_frame - edge_frames)
-    if hi <= lo:
-        lo = 0
-        hi = max_start_frame
-
-    stride = max(1, int(round(fps / max(1.0, sample_rate_fps))))
-    samples = max(6, int(round(seg_len * max(1.0, sample_rate_fps))))
-    samples = min(samples, int(max_samples_per_candidate))
-
-    def motion_stats(start_frame: int):
-        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-        prev_small = None
-        diffs = []
-
-        for _ in range(samples):
-            ok, frame = cap.read()
-            if not ok:
-                break
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            small = cv2.resize(gray, (128, 72), interpolation=cv2.INTER_AREA)
-            if prev_small is not None:
-                diff = cv2.absdiff(small, prev_small)
-                diffs.append(float(cv2.mean(diff)[0]))
-            prev_small = small
-
-            for _ in range(stride - 1):
-                cap.grab()
-
-        if len(diffs) < 3:
+    # Precomputed motion profile (motion_index.py) -> no decoding at all.
+    # Otherwise one sequential pass; the trailing edge is never a window start, so stop before it.
+    # rng: random.Random for the candidate starts (default: the module RNG).
+    # max_samples_per_candidate: each candidate window is scored on at most this many samples.
+    if profile is None:
+        dur = get_duration(video_path)
+        stop = dur - max(0.0, edge_seconds) if dur > seg_len + 2 * edge_seconds else None
+        profile = scan_motion_profile(video_path, sample_rate_fps, stop_seconds=stop)
+        if profile is None:
             return None
-        avg = sum(diffs) / len(diffs)
-        var = sum((d - avg) ** 2 for d in diffs) / len(diffs)
-        return avg, var
-
-    results = []
-    for _ in range(max(1, int(candidates))):
-        start_frame = random.randint(lo, hi)
-        st = motion_stats(start_frame)
-        if st is None:
-            continue
-        avg, var = st
-        results.append((start_frame, avg, var))
+        edge_tail = 0.0 if stop else edge_seconds
+    else:
+        edge_tail = edge_seconds
 
-    cap.release()
-    if not results:
-        return None
+    return _smooth_start_from_profile(
+        profile, seg_len, sample_rate_fps, edge_seconds, edge_tail, min_motion, target_quantile, candidates,
+        rng=rng, max_samples=max_samples_per_candidate,
+    )
 
+def _pick_smooth(results, min_motion, target_quantile):
+    # results: [(start, avg, var)] -> start whose motion is closest to the target quantile, steadiest first
     avgs = [avg for _, avg, _ in results]
     eligible = [a for a in avgs if a >= float(min_motion)]
     if eligible:
@@ -196,30 +201,69 @@ def find_smooth_start(
         if best_key is None or key < best_key:
             best_key = key
             best_frame = start_frame
+    return best_frame
 
-    start_time = best_frame / float(fps)
-    return max(0.0, min(start_time, max_start_frame / float(fps)))
+def _smooth_start_from_profile(
+    profile, seg_len, sample_fps, edge_head, edge_tail, min_motion, target_quantile, candidates, rng=None, max_samples=18
+):
+    from motion_index import window_stats
+
+    rng = rng or random
+    # Same window as the per-candidate probes had: max(6, seg_len * fps) samples, capped
+    # at max_samples; n samples give n - 1 diffs.
+    samples = min(max(6, int(round(seg_len * max(1.0, sample_fps)))), int(max_samples))
+    n_diffs = max(2, samples - 1)
+    means, variances = window_stats(profile, n_diffs)
+    if len(means) == 0:
+        return 0.0
+
+    # the cut itself still spans the whole seg_len, even when the scored window is shorter
+    max_start = len(means) - 1 - max(0, int(round(seg_len * sample_fps)) - n_diffs)
+    if max_start < 0:
+        return 0.0
+    lo = max(0, int(round(edge_head * sample_fps)))
+    hi = max(lo, max_start - int(round(edge_tail * sample_fps)))
+    if hi <= lo:
+        lo, hi = 0, max_start
+
+    picks = [rng.randint(lo, hi) for _ in range(max(1, int(candidates)))]
+    results = [(i, float(means[i]), float(variances[i])) for i in picks]
+    best = _pick_smooth(results, min_motion, target_quantile)
+    return max(0.0, best / float(sample_fps))
 
 # ---------------------------
 # 2) Cut & Normalize (Strict Mode)
 # ---------------------------
-def cut_random_segment(input_path: Path, out_path: Path, seg_len=2.0, target_w: int = 1920, target_h: int = 1080):
+def pick_segment_start(input_path: Path, seg_len=2.0, profile=None, rng=None):
+    # rng: per-shot random.Random, so concurrent callers don't interleave draws on the module RNG
+    rng = rng or random
     dur = get_duration(input_path)
     if dur <= seg_len + 0.1:
         start = 0.0
     else:
-        smooth = find_smooth_start(input_path, seg_len)
+        smooth = find_smooth_start(input_path, seg_len, profile=profile, rng=rng)
         if smooth is None:
-            start = random.uniform(0, dur - seg_len)
+            start = rng.uniform(0, dur - seg_len)
         else:
-            jitter = random.uniform(-0.15, 0.15)
+            jitter = rng.uniform(-0.15, 0.15)
             start = max(0.0, min(smooth + jitter, dur - seg_len))
+    return start, dur
 
+def cut_encode_args(target_w: int = 1920, target_h: int = 1080):
     #  FIX:   Concat 
     # - scale=1920:1080 (HD)
     # - setsar=1 (Pixel Aspect Ratio )
     # - fps=30 ( Frame rate)
     vf = f"scale={int(target_w)}:{int(target_h)}:force_original_aspect_ratio=increase,crop={int(target_w)}:{int(target_h)},fps=30,format=yuv420p,setsar=1"
+    return [
+        "-vf", vf,
+        *h264_video_args(quality="cut"),
+        "-pix_fmt", "yuv420p",
+        "-an",               # 
+        "-movflags", "+faststart",
+    ]
+
+def cut_segment(input_path: Path, out_path: Path, start: float, seg_len=2.0, target_w: int = 1920, target_h: int = 1080):
     cmd = [
         "ffmpeg", "-y",
         *ffmpeg_resource_args(),
@@ -227,15 +271,44 @@ def cut_random_segment(input_path: Path, out_path: Path, seg_len=2.0, target_w:
         "-ss", f"{start:.3f}",
         "-i", safe(input_path),
         "-t", f"{seg_len:.3f}",
+        *cut_encode_args(target_w, target_h),
+        safe(out_path)
+    ]
+    run(cmd)
+    return out_path
+
+def cut_random_segment(input_path: Path, out_path: Path, seg_len=2.0, target_w: int = 1920, target_h: int = 1080):
+    start, dur = pick_segment_start(input_path, seg_len)
+    cut_segment(input_path, out_path, start, seg_len=seg_len, target_w=target_w, target_h=target_h)
+    return start, dur
+
+def proxy_encode_args(max_side: int = 1920, gop: int = 8):
+    # Mezzanine proxy: <=1080p, short GOP (gop=1 -> all-intra), no B-frames, cheap to decode and seek.
+    # Timestamps are kept as-is so a start time picked on the proxy is valid on the original.
+    vf = (
+        f"scale='if(gte(iw,ih),min({int(max_side)},iw),-2)':'if(gte(iw,ih),-2,min({int(max_side)},ih))',"
+        "format=yuv420p,setsar=1"
+    )
+    return [
         "-vf", vf,
-        *h264_video_args(quality="cut"),
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "16", "-tune", "fastdecode",
+        "-g", str(max(1, int(gop))), "-keyint_min", str(max(1, int(gop))), "-sc_threshold", "0", "-bf", "0",
         "-pix_fmt", "yuv420p",
-        "-an",               # 
+        "-an",
         "-movflags", "+faststart",
+    ]
+
+def make_proxy(input_path: Path, out_path: Path, max_side: int = 1920, gop: int = 8):
+    cmd = [
+        "ffmpeg", "-y",
+        *ffmpeg_resource_args(),
+        "-ignore_editlist", "1",
+        "-i", safe(input_path),
+        *proxy_encode_args(max_side, gop),
         safe(out_path)
     ]
     run(cmd)
-    return start, dur
+    return out_path
 
 # ---------------------------
 # 3) Concatenate (Demuxer Method - Stable)
@@ -359,47 +432,29 @@ def mix_video_music(video_in, audio_in, video_out):
     run(cmd)
 
 def estimate_luma_clipping(video_path: Path, samples: int = 6):
-    cap = cv2.VideoCapture(str(video_path))
-    if not cap.isOpened():
-        return 0.0, 0.0
+    # Up to `samples` evenly spaced distinct keyframes; the decoder skips every non-keyframe.
+    # (No fps filter: resampling sparse keyframes would just repeat the same frame.)
+    import numpy as np
 
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
-    if total_frames <= 0:
-        cap.release()
+    dur = get_duration(video_path)
+    if dur <= 0:
         return 0.0, 0.0
 
-    step = max(1, total_frames // max(1, samples))
-    hi = 0.0
-    lo = 0.0
-    got = 0
-
-    for i in range(samples):
-        cap.set(cv2.CAP_PROP_POS_FRAMES, i * step)
-        ok, frame = cap.read()
-        if not ok:
-            continue
-        y = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)[:, :, 0]
-        px = float(y.size)
-        hi += float(cv2.countNonZero((y >= 250).astype("uint8"))) / px
-        lo += float(cv2.countNonZero((y <= 5).astype("uint8"))) / px
-        got += 1
-
-    cap.release()
-    if got == 0:
+    frames = frame_reader.read_gray(
+        video_path, width=480, height=270, keyframes_only=True, threads=_analysis_threads(),
+    )
+    if len(frames) == 0:
         return 0.0, 0.0
-    return hi / got, lo / got
+    if len(frames) > samples:
+        frames = frames[np.linspace(0, len(frames) - 1, max(1, samples)).round().astype(int)]
+    hi = float((frames >= 250).mean())
+    lo = float((frames <= 5).mean())
+    return hi, lo
 
 # ---------------------------
 # 6) Apply LUT
 # ---------------------------
-def apply_lut(video_in, video_out, lut_file="lut/aquaverse_fun.cube"):
-    if not Path(lut_file).exists():
-        print(f"Warning: LUT file not found at {lut_file}, skipping grading.")
-        import shutil
-        shutil.copy(video_in, video_out)
-        return
-
-    hi_clip, lo_clip = estimate_luma_clipping(Path(video_in))
+def grade_filter(lut_file, hi_clip: float, lo_clip: float):
     # Default: vivid
     contrast = 1.06
     saturation = 1.18
@@ -414,7 +469,17 @@ def apply_lut(video_in, video_out, lut_file="lut/aquaverse_fun.cube"):
         saturation = 1.08
         gamma = 1.00
 
-    vf = f"lut3d={safe(lut_file)},eq=contrast={contrast}:saturation={saturation}:gamma={gamma}"
+    return f"lut3d={safe(lut_file)},eq=contrast={contrast}:saturation={saturation}:gamma={gamma}"
+
+def apply_lut(video_in, video_out, lut_file="lut/aquaverse_fun.cube"):
+    if not Path(lut_file).exists():
+        print(f"Warning: LUT file not found at {lut_file}, skipping grading.")
+        import shutil
+        shutil.copy(video_in, video_out)
+        return
+
+    hi_clip, lo_clip = estimate_luma_clipping(Path(video_in))
+    vf = grade_filter(lut_file, hi_clip, lo_clip)
 
     cmd = [
         "ffmpeg",
@@ -463,17 +528,153 @@ def overlay_logo(bg_video, logo_path, out_path):
     run(cmd)
     return out_path
 
+def probe_streams(video_path):
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_streams",
+        "-of", "json",
+        safe(video_path),
+    ]
+    try:
+        p = subprocess.run(cmd, capture_output=True, text=True)
+        if p.returncode != 0:
+            return []
+        return json.loads(p.stdout or "{}").get("streams", [])
+    except (OSError, ValueError):
+        return []
+
+def stream_signature(video_path):
+    """
+    Codec parameters that must match for a lossless concat-demuxer join.
+    Returns None if the file can't be probed or has no video stream.
+    """
+    streams = probe_streams(video_path)
+    v = next((st for st in streams if st.get("codec_type") == "video"), None)
+    a = next((st for st in streams if st.get("codec_type") == "audio"), None)
+    if v is None:
+        return None
+
+    sar = v.get("sample_aspect_ratio") or "1:1"
+    if sar in ("0:1", "N/A"):
+        sar = "1:1"
+
+    return {
+        "video": {
+            "codec": v.get("codec_name"),
+            "profile": v.get("profile"),
+            "width": int(v.get("width") or 0),
+            "height": int(v.get("height") or 0),
+            "pix_fmt": v.get("pix_fmt"),
+            "fps": v.get("r_frame_rate"),
+            "sar": sar,
+            "time_base": v.get("time_base"),
+        },
+        "audio": None if a is None else {
+            "codec": a.get("codec_name"),
+            "sample_rate": str(a.get("sample_rate")),
+            "channels": int(a.get("channels") or 0),
+            "channel_layout": a.get("channel_layout"),
+        },
+    }
+
+def streams_compatible(sig_a, sig_b):
+    return sig_a is not None and sig_b is not None and sig_a == sig_b
+
+def conform_outro(outro, master_sig, out_path):
+    """Re-encode only the (2s) outro so its codec parameters match the master."""
+    v = master_sig["video"]
+    a = master_sig["audio"]
+
+    vf = f"scale={v['width']}:{v['height']},fps={v['fps']},format={v['pix_fmt']},setsar=1"
+    video_args = h264_video_args(quality="final") if v["codec"] == "h264" else ["-c:v", v["codec"]]
+    if v["codec"] == "h264" and v.get("profile"):
+        # ffprobe reports "High"/"Main"/"Constrained Baseline"; encoders want "high"/"main"/"baseline".
+        video_args += ["-profile:v", v["profile"].lower().replace("constrained ", "")]
+
+    # All inputs first: ffmpeg >= 7 refuses output options (-map/-vf/-c:v) placed before a later -i.
+    cmd = ["ffmpeg", "-y", *ffmpeg_resource_args(), "-i", safe(outro)]
+    if a is not None:
+        # Outros are silent anyway; synthesize silence in the master's layout if the outro has none.
+        cmd += [
+            "-f", "lavfi",
+            "-i", f"anullsrc=channel_layout={a['channel_layout'] or 'stereo'}:sample_rate={a['sample_rate']}",
+        ]
+
+    cmd += [
+        "-map", "0:v:0",
+        "-vf", vf,
+        *video_args,
+        "-pix_fmt", v["pix_fmt"],
+    ]
+    if v.get("time_base", "").startswith("1/"):
+        cmd += ["-video_track_timescale", v["time_base"].split("/", 1)[1]]
+
+    if a is None:
+        cmd += ["-an"]
+    else:
+        cmd += [
+            "-map", "1:a:0",
+            "-shortest",
+            "-c:a", a["codec"],
+            "-ar", a["sample_rate"],
+            "-ac", str(a["channels"]),
+        ]
+
+    cmd += ["-movflags", "+faststart", safe(out_path)]
+    run(cmd)
+    return out_path
+
+def _concat_copy(files, list_path, out_final):
+    with open(list_path, "w") as f:
+        for fp in files:
+            f.write(f"file '{safe(Path(fp).resolve())}'\n")
+
+    cmd = [
+        "ffmpeg", "-y",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", safe(list_path),
+        "-map", "0:v",
+        "-map", "0:a?",
+        "-c", "copy",
+        "-movflags", "+faststart",
+        safe(out_final)
+    ]
+    run(cmd)
+    return out_final
+
 def concat_with_outro(video, outro, out_final):
-    with open("concat_outro.txt", "w") as f:
-        f.write(f"file '{safe(video)}'\n")
-        f.write(f"file '{safe(outro)}'\n")
+    # One list file per output so concurrent branches don't overwrite each other's list.
+    list_path = Path(out_final).with_suffix(".concat.txt")
+
+    # Lossless path: join with -c copy when resolution/fps/pix_fmt/profile/audio layout all match.
+    # Otherwise re-encode just the outro to the master's parameters and copy-join that.
+    master_sig = stream_signature(video)
+    if master_sig is not None:
+        try:
+            if streams_compatible(master_sig, stream_signature(outro)):
+                return _concat_copy([video, outro], list_path, out_final)
+
+            print("Outro parameters differ from master, re-encoding outro only.")
+            conformed = Path(out_final).with_name(f"{Path(out_final).stem}.outro.mp4")
+            conform_outro(outro, master_sig, conformed)
+            try:
+                return _concat_copy([video, conformed], list_path, out_final)
+            finally:
+                conformed.unlink(missing_ok=True)
+        except subprocess.CalledProcessError:
+            print("Stream-copy outro append failed, re-encoding instead.")
+
+    with open(list_path, "w") as f:
+        f.write(f"file '{safe(Path(video).resolve())}'\n")
+        f.write(f"file '{safe(Path(outro).resolve())}'\n")
 
     cmd = [
         "ffmpeg", "-y",
         *ffmpeg_resource_args(),
         "-f", "concat",
         "-safe", "0",
-        "-i", "concat_outro.txt",
+        "-i", safe(list_path),
         "-vf", "setsar=1",
         "-c:v", "libx264",
         "-pix_fmt", "yuv420p",
@@ -485,6 +686,42 @@ def concat_with_outro(video, outro, out_final):
     run(cmd)
     return out_final
 
+def check_outro_conform(work_dir=None):
+    """
+    Smoke check of the outro-only path with the local ffmpeg: a 1s master with
+    mono 44.1k audio vs. a stereo 48k outro must go through conform_outro and a
+    stream-copy join (not the full re-encode fallback). Raises on failure.
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        tmp = Path(tmp)
+        master, outro = tmp / "master.mp4", tmp / "outro.mp4"
+        run([
+            "ffmpeg", "-y",
+            "-f", "lavfi", "-i", "color=c=black:s=320x180:r=25",
+            "-f", "lavfi", "-i", "anullsrc=channel_layout=mono:sample_rate=44100",
+            "-t", "1", "-shortest",
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac",
+            safe(master),
+        ])
+        create_outro_sized(duration=1, out_path=str(outro), size="320x180", fps=25)
+
+        master_sig = stream_signature(master)
+        if master_sig is None or master_sig["audio"] is None:
+            raise RuntimeError("check master has no audio stream")
+        if streams_compatible(master_sig, stream_signature(outro)):
+            raise RuntimeError("check outro already matches the master, conform path not exercised")
+
+        conformed = conform_outro(outro, master_sig, tmp / "outro.conformed.mp4")
+        if not streams_compatible(master_sig, stream_signature(conformed)):
+            raise RuntimeError(f"conformed outro doesn't match the master: {stream_signature(conformed)}")
+        out = _concat_copy([master, conformed], tmp / "joined.concat.txt", tmp / "joined.mp4")
+        if get_duration(out) < 1.5:
+            raise RuntimeError("stream-copy join lost the outro")
+    print("✓ conform_outro + stream-copy join OK")
+    return True
+
 def create_outro_sized(bg_color="#2b497e", duration=2, out_path="outro.mp4", size="1920x1080", fps=30):
     hex_color = "0x" + bg_color.strip("#")
 
@@ -565,10 +802,15 @@ def overlay_logo_scaled(bg_video, logo_path, out_path, logo_scale=0.6):
 # ---------------------------
 # 7) Export Ratios
 # ---------------------------
-def export_ratios(input_video, out_dir: Path):
-    outputs = {}
-    
-    base_args = [
+def export_ratio(input_video, out_path, target_w: int, target_h: int):
+    w, h = int(target_w), int(target_h)
+    cmd = [
+        "ffmpeg", "-y",
+        *ffmpeg_resource_args(),
+        "-i", safe(input_video),
+        "-vf", f"scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h},setsar=1",
+        "-map", "0:v",
+        "-map", "0:a?",
         *h264_video_args(quality="final"),
         "-pix_fmt",
         "yuv420p",
@@ -580,36 +822,140 @@ def export_ratios(input_video, out_dir: Path):
         "2",
         "-ar",
         "48000",
+        safe(out_path),
     ]
+    run(cmd)
+    return out_path
+
+def export_ratios(input_video, out_dir: Path):
+    outputs = {}
 
     # 9:16
     o916 = out_dir / "final_9x16.mp4"
-    cmd916 = [
-        "ffmpeg", "-y",
-        *ffmpeg_resource_args(),
-        "-i", safe(input_video),
-        "-vf", "scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920,setsar=1",
-        "-map", "0:v",
-        "-map", "0:a?",
-    ] + base_args + [safe(o916)]
-    run(cmd916)
+    export_ratio(input_video, o916, 1080, 1920)
     outputs["9:16"] = safe(o916)
 
     # 16:9
     o169 = out_dir / "final_16x9.mp4"
-    cmd169 = [
-        "ffmpeg", "-y",
-        *ffmpeg_resource_args(),
-        "-i", safe(input_video),
-        "-vf", "scale=1920:1080:force_original_aspect_ratio=increase,crop=1920:1080,setsar=1",
-        "-map", "0:v",
-        "-map", "0:a?",
-    ] + base_args + [safe(o169)]
-    run(cmd169)
+    export_ratio(input_video, o169, 1920, 1080)
     outputs["16:9"] = safe(o169)
 
     return outputs
 
+# ---------------------------
+# 8) Single-pass render (cut + concat + grade + outro + music, one encode)
+# ---------------------------
+def render_single_pass(
+    shots,
+    out_path,
+    target_w: int = 1920,
+    target_h: int = 1080,
+    audio_in=None,
+    outro=None,
+    lut_file="lut/aquaverse_fun.cube",
+    max_duration=None,
+    fps=30,
+):
+    """
+    shots: list of (source_path, start, seg_len)
+    Builds one filter_complex that trims every source, scales/crops to the
+    target size, applies the concat eq + LUT grade, appends the outro and
+    muxes the BGM, so each aspect ratio is encoded exactly once.
+    """
+    if len(shots) == 0:
+        raise ValueError("No shots to render")
+
+    w, h = int(target_w), int(target_h)
+    inputs = []
+    filter_parts = []
+
+    for i, (src, start, seg_len) in enumerate(shots):
+        inputs.extend([
+            "-ignore_editlist", "1",
+            "-ss", f"{float(start):.3f}",
+            "-t", f"{float(seg_len):.3f}",
+            "-i", safe(src),
+        ])
+        filter_parts.append(
+            f"[{i}:v]scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h},"
+            f"fps={fps},format=yuv420p,setsar=1,"
+            f"eq=contrast=1.02:brightness=0.01:saturation=1.05[v{i}]"
+        )
+
+    concat_inputs = "".join(f"[v{i}]" for i in range(len(shots)))
+    filter_parts.append(f"{concat_inputs}concat=n={len(shots)}:v=1:a=0[cat]")
+
+    main_len = sum(float(seg_len) for _, _, seg_len in shots)
+    if max_duration is not None and audio_in:
+        # Same result as mix_video_music(-shortest) against a BGM trimmed to max_duration.
+        main_len = min(main_len, float(max_duration))
+
+    main_chain = f"trim=duration={main_len:.3f},setpts=PTS-STARTPTS"
+    if Path(lut_file).exists():
+        # Estimate clipping on the sources (the concat master no longer exists on disk).
+        stats = [estimate_luma_clipping(Path(src)) for src, _, _ in shots]
+        hi_clip = sum(hi for hi, _ in stats) / len(stats)
+        lo_clip = sum(lo for _, lo in stats) / len(stats)
+        main_chain += "," + grade_filter(lut_file, hi_clip, lo_clip)
+    else:
+        print(f"Warning: LUT file not found at {lut_file}, skipping grading.")
+    filter_parts.append(f"[cat]{main_chain}[main]")
+
+    silence = "anullsrc=channel_layout=stereo:sample_rate=48000"
+    if audio_in:
+        a_idx = len(shots)
+        inputs.extend(["-i", safe(audio_in)])
+        filter_parts.append(
+            f"[{a_idx}:a]aformat=sample_rates=48000:channel_layouts=stereo,"
+            f"apad,atrim=duration={main_len:.3f}[main_a]"
+        )
+    else:
+        filter_parts.append(f"{silence},atrim=duration={main_len:.3f}[main_a]")
+
+    if outro:
+        o_idx = len(shots) + (1 if audio_in else 0)
+        outro_len = get_duration(Path(outro)) or 2.0
+        inputs.extend(["-i", safe(outro)])
+        filter_parts.append(
+            f"[{o_idx}:v]scale={w}:{h},fps={fps},format=yuv420p,setsar=1[outro_v]"
+        )
+        filter_parts.append(f"{silence},atrim=duration={outro_len:.3f}[outro_a]")
+        filter_parts.append("[main][main_a][outro_v][outro_a]concat=n=2:v=1:a=1[vout][aout]")
+        v_out, a_out = "[vout]", "[aout]"
+    else:
+        v_out, a_out = "[main]", "[main_a]"
+
+    cmd = [
+        "ffmpeg",
+        "-y",
+        *ffmpeg_resource_args(),
+        *inputs,
+        "-filter_complex",
+        ";".join(filter_parts),
+        "-map",
+        v_out,
+        "-map",
+        a_out,
+        "-r",
+        str(fps),
+        *h264_video_args(quality="final"),
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "192k",
+        "-ac",
+        "2",
+        "-ar",
+        "48000",
+        "-movflags",
+        "+faststart",
+        safe(out_path),
+    ]
+    run(cmd)
+    return out_path
+
 
 # ---------------------------
 # Encoder selection (NVENC)
@@ -694,3 +1040,14 @@ def h264_video_args(*, quality: str = "normal"):
         crf = {"cut": "20", "concat": "20", "grade": "18", "final": "20"}.get(quality, "20")
     return ["-c:v", "libx264", "-preset", preset, "-crf", crf]
 
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ffmpeg helper checks")
+    parser.add_argument("--check-outro", action="store_true", help="run conform_outro on a master with audio")
+    args = parser.parse_args()
+    if args.check_outro:
+        check_outro_conform()
+    else:
+        parser.print_help()
@@ -0,0 +1,153 @@
+# frame_reader.py
+# Low-res analysis frames straight from ffmpeg.
+#
+# ffmpeg does the decode + fps/scale/gray conversion inside its own filter graph
+# and pipes raw 8-bit gray frames to us. Python never sees a full-resolution
+# BGR frame, so analysis moves ~1/600 of the bytes cv2.VideoCapture would.
+# Frames come out display-oriented (ffmpeg autorotates), which matches probe().
+
+import json
+import subprocess
+
+import numpy as np
+
+
+def _ratio(v):
+    try:
+        num, den = str(v).split("/")
+        return float(num) / float(den) if float(den) else 0.0
+    except (ValueError, ZeroDivisionError):
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return 0.0
+
+
+def _rotation(stream):
+    for sd in stream.get("side_data_list") or []:
+        if "rotation" in sd:
+            try:
+                return int(round(float(sd["rotation"]))) % 360
+            except (TypeError, ValueError):
+                pass
+    try:
+        return int((stream.get("tags") or {}).get("rotate", 0)) % 360
+    except (TypeError, ValueError):
+        return 0
+
+
+def probe(video_path):
+    """
+    Metadata of the first video stream (plus audio presence) via ffprobe.
+    width/height are display dimensions (swapped for 90/270 rotation), coded_* are as stored.
+    Returns None if the file can't be probed or has no video stream.
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries",
+        "stream=codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,duration:"
+        "stream_tags=rotate:stream_side_data=rotation:format=duration",
+        "-of", "json",
+        str(video_path).replace("\\", "/"),
+    ]
+    try:
+        p = subprocess.run(cmd, capture_output=True, text=True)
+        if p.returncode != 0:
+            return None
+        data = json.loads(p.stdout or "{}")
+    except (OSError, ValueError):
+        return None
+
+    streams = data.get("streams") or []
+    st = next((x for x in streams if x.get("codec_type") == "video"), None)
+    if st is None:
+        return None
+
+    w, h = int(st.get("width") or 0), int(st.get("height") or 0)
+    rotation = _rotation(st)
+    dw, dh = (h, w) if rotation in (90, 270) else (w, h)
+
+    fps = _ratio(st.get("avg_frame_rate")) or _ratio(st.get("r_frame_rate"))
+    duration = _ratio((data.get("format") or {}).get("duration")) or _ratio(st.get("duration"))
+    try:
+        frames = int(st.get("nb_frames") or 0)
+    except (TypeError, ValueError):
+        frames = 0
+    if frames <= 0 and fps > 0 and duration > 0:
+        frames = int(round(duration * fps))
+
+    return {
+        "width": dw,
+        "height": dh,
+        "coded_width": w,
+        "coded_height": h,
+        "rotation": rotation,
+        "duration": duration,
+        "fps": fps,
+        "frames": frames,
+        "codec": st.get("codec_name"),
+        "has_audio": any(x.get("codec_type") == "audio" for x in streams),
+    }
+
+
+def gray_frames(
+    video_path,
+    width=128,
+    height=72,
+    fps=None,
+    start=None,
+    duration=None,
+    keyframes_only=False,
+    full_range=True,
+    threads=None,
+):
+    """
+    Yield uint8 (height, width) gray frames.
+      fps:            resample to this rate inside ffmpeg (None = every decoded frame)
+      keyframes_only: -skip_frame nokey, the decoder skips everything but keyframes
+                      (each keyframe once: without fps no frames are duplicated to fill the gaps)
+      full_range:     0-255 luma like cv2's BGR->gray (tv-range Y otherwise)
+    """
+    vf = []
+    if fps:
+        vf.append(f"fps={float(fps):.6f}")
+    vf.append(f"scale={int(width)}:{int(height)}:flags=area" + (":out_range=full" if full_range else ""))
+    vf.append("format=gray")
+
+    cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+    if threads:
+        cmd += ["-threads", str(int(threads))]
+    if keyframes_only:
+        cmd += ["-skip_frame", "nokey"]
+    if start:
+        cmd += ["-ss", f"{float(start):.3f}"]
+    cmd += ["-i", str(video_path).replace("\\", "/")]
+    if duration:
+        cmd += ["-t", f"{float(duration):.3f}"]
+    if keyframes_only and not fps:
+        cmd += ["-vsync", "0"]  # passthrough; rawvideo is cfr by default and would repeat each keyframe
+    cmd += ["-an", "-vf", ",".join(vf), "-f", "rawvideo", "-pix_fmt", "gray", "pipe:1"]
+
+    frame_bytes = int(width) * int(height)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            buf = proc.stdout.read(frame_bytes)
+            if len(buf) < frame_bytes:
+                break
+            yield np.frombuffer(buf, dtype=np.uint8).reshape(int(height), int(width))
+    finally:
+        # Also runs when the caller stops early: don't leave ffmpeg blocked on a full pipe.
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+
+def read_gray(video_path, **kwargs):
+    """All frames from gray_frames() as one (n, height, width) uint8 array."""
+    frames = list(gray_frames(video_path, **kwargs))
+    if not frames:
+        h, w = int(kwargs.get("height", 72)), int(kwargs.get("width", 128))
+        return np.empty((0, h, w), dtype=np.uint8)
+    return np.stack(frames)
@@ -1,24 +1,30 @@
 # generate_edit.py - Fix Repetitive Scenes
 import pandas as pd
 from pathlib import Path
-from tqdm import tqdm
 import random
 import json
+import os
 import shutil
 
+from concurrent.futures import ThreadPoolExecutor
+
 from ffmpeg_utils import (
-    cut_random_segment,
+    render_single_pass,
     concat_videos_smooth,
-    get_resolution,
     trim_music,
     apply_lut,
-    export_ratios,
-    mix_video_music
+    export_ratio,
+    mix_video_music,
+    concat_with_outro,
+    low_resource_mode,
 )
+from outro_cache import DEFAULT_OUTROS, get_outro, warm_outro_cache
 
 from prompt_rules import parse_prompt
 from clip_selector import select_clips
-from downloader import download_file
+import asset_store
+import clip_library
+from shot_executor import make_shot_job, prepare_shots, shot_pool
 
 # ======================
 # PATH SETTINGS
@@ -31,6 +37,12 @@ BGM_DIR = Path("bgm")
 OUTPUT_DIR.mkdir(exist_ok=True)
 TEMP_DIR.mkdir(exist_ok=True)
 
+LOGO_PATH = "assets/brand_logo.png"
+OUTRO_COLOR = "#2b497e"
+
+# One filter_complex + one encode per aspect ratio instead of cut/concat/grade/export passes.
+SINGLE_PASS = os.environ.get("VIDEOSCORE_SINGLE_PASS", "").strip().lower() in {"1", "true", "yes", "on"}
+
 # ======================
 # HELPER: Pick Random BGM (Download from GitHub for HuggingFace)
 # ======================
@@ -71,27 +83,196 @@ def pick_bgm(vibe="upbeat"):
         print(f"⚠️ Failed to download BGM: {e}")
         return None
 
+# ======================
+# HELPER: Brand logo (create if missing, for HuggingFace deployment)
+# ======================
+def ensure_logo(logo_path=LOGO_PATH):
+    if Path(logo_path).exists():
+        return logo_path
+
+    from PIL import Image, ImageDraw, ImageFont
+    Path(logo_path).parent.mkdir(parents=True, exist_ok=True)
+    img = Image.new('RGBA', (800, 300), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.truetype('arial.ttf', 80)
+    except:
+        font = ImageFont.load_default()
+    draw.text((50, 100), 'AQUAVERSE', fill=(43, 73, 126, 255), font=font)
+    img.save(logo_path)
+    print(f"✓ Created {logo_path}")
+    return logo_path
+
+# ======================
+# PIPELINE NODES
+# ======================
+def prepare_bgm(vibe, duration):
+    print("\n--- Processing Music ---")
+    bgm = pick_bgm(vibe)
+    if not bgm:
+        print("⚠️ No BGM available. Video without background music.")
+        return None
+
+    print(f"BGM Selected: {bgm.name}")
+    temp_bgm_path = OUTPUT_DIR / "bgm_temp"
+    return trim_music(bgm, temp_bgm_path, duration, fade=1.0)
+
+def warm_outros():
+    """Make sure the logo exists and both outro sizes are in the outro cache."""
+    ensure_logo()
+    return warm_outro_cache(logo_path=LOGO_PATH, bg_color=OUTRO_COLOR, duration=2)
+
+def append_outro(video_path: Path, outro_path: Path) -> Path:
+    # Write to a new file to avoid Windows file-lock issues when the target is open in a player.
+    out_final = OUTPUT_DIR / f"{video_path.stem}_with_outro.mp4"
+    concat_with_outro(video_path, outro_path, out_final)
+    return out_final
+
+def build_master(cut_files, bgm_future, suffix=""):
+    # Concat (Modern hard cuts - no transitions) -> Color Grade -> Music
+    concat_out = OUTPUT_DIR / f"concat_raw{suffix}.mp4"
+    graded = OUTPUT_DIR / f"graded{suffix}.mp4"
+    master = OUTPUT_DIR / f"master_with_music{suffix}.mp4"
+
+    concat_videos_smooth(cut_files, concat_out)
+    apply_lut(concat_out, graded)
+
+    trimmed_bgm_wav = bgm_future.result()
+    if trimmed_bgm_wav:
+        mix_video_music(graded, trimmed_bgm_wav, master)
+    else:
+        shutil.copy(graded, master)
+    return master
+
+def branch_16x9(chosen, prompt_info, seed, pool, bgm_future, outro_future, single_pass):
+    rng = random.Random(seed)
+    shot_min = prompt_info["shot_len_min"]
+    shot_max = prompt_info["shot_len_max"]
+
+    # Download & Cut (fanned out over the shot pool, results stay in order)
+    print("\n--- [16:9] Downloading & Cutting ---")
+    jobs = []
+    for i, r in chosen.iterrows():
+        seg_len = rng.uniform(shot_min, shot_max)
+        # single-pass: only pick the start, the cut happens inside the final filter graph
+        cut_video = None if single_pass else TEMP_DIR / f"cut_{i:03d}.mp4"
+        jobs.append(make_shot_job(
+            r.get("asset_id"), r.get("download_url"), seg_len,
+            cut_path=cut_video, rng=rng,
+        ))
+    prepared = prepare_shots(jobs, pool=pool, desc="16:9 shots")
+    shots = [(p["source"], p["start"], p["seg_len"]) for p in prepared]
+
+    final = OUTPUT_DIR / "final_16x9_with_outro.mp4"
+    master = None
+    if single_pass:
+        print("\n--- [16:9] Rendering (single pass) ---")
+        render_single_pass(
+            shots, final, target_w=1920, target_h=1080,
+            audio_in=bgm_future.result(), outro=outro_future.result(),
+            max_duration=prompt_info["duration"],
+        )
+    else:
+        print("\n--- [16:9] Concat / Grade / Music ---")
+        master = build_master([p["cut"] for p in prepared], bgm_future)
+        final_16x9 = export_ratio(master, OUTPUT_DIR / "final_16x9.mp4", 1920, 1080)
+        final = append_outro(final_16x9, outro_future.result())
+
+    return {"final": final, "master": master, "shots": shots, "prepared": prepared}
+
+def branch_9x16(df, prompt_info, n_shots, seed, pool, bgm_future, outro_future, fallback_future, single_pass):
+    rng = random.Random(seed)
+    shot_min = prompt_info["shot_len_min"]
+    shot_max = prompt_info["shot_len_max"]
+
+    # 9:16: rebuild from vertical-only sources
+    print("\n--- [9:16] Selecting vertical sources ---")
+    candidates_9x16 = select_clips(df, prompt_info, n_shots=n_shots * 10, orientation="portrait")
+    if "asset_id" in candidates_9x16.columns:
+        candidates_9x16 = candidates_9x16.drop_duplicates(subset=["asset_id"])
+
+    cut_files_9x16 = []
+    shots_9x16 = []
+    chosen_9x16 = 0
+    rows_9x16 = list(candidates_9x16.iterrows())
+    pos = 0
+    # Submit only as many candidates as are still missing, so no extra portrait clip gets cut.
+    while chosen_9x16 < n_shots and pos < len(rows_9x16):
+        batch = rows_9x16[pos:pos + (n_shots - chosen_9x16)]
+        pos += len(batch)
+
+        jobs = []
+        for k, (_, r) in enumerate(batch):
+            seg_len = rng.uniform(shot_min, shot_max)
+            cut_video = None if single_pass else TEMP_DIR / f"9x16_cut_{chosen_9x16 + k:03d}.mp4"
+            jobs.append(make_shot_job(
+                r.get("asset_id"), r.get("download_url"), seg_len, cut_path=cut_video,
+                target_w=1080, target_h=1920, require_portrait=True, rng=rng,
+            ))
+
+        for p in prepare_shots(jobs, pool=pool, desc="9:16 shots"):
+            if p is None:
+                continue
+            if single_pass:
+                shots_9x16.append((p["source"], p["start"], p["seg_len"]))
+            else:
+                # Renumber so the concat list stays contiguous regardless of rejected clips.
+                cut_video = TEMP_DIR / f"9x16_cut_{chosen_9x16:03d}.mp4"
+                if p["cut"] != cut_video:
+                    os.replace(p["cut"], cut_video)
+                cut_files_9x16.append(cut_video)
+            chosen_9x16 += 1
+
+    if chosen_9x16 < n_shots:
+        print(f"Warning: only found {chosen_9x16}/{n_shots} vertical clips for 9:16.")
+
+    if single_pass:
+        # Fall back to the 16:9 shots (center-cropped) if no vertical sources exist.
+        print("\n--- [9:16] Rendering (single pass) ---")
+        final = OUTPUT_DIR / "final_9x16_with_outro.mp4"
+        render_single_pass(
+            shots_9x16 or fallback_future.result()["shots"], final, target_w=1080, target_h=1920,
+            audio_in=bgm_future.result(), outro=outro_future.result(),
+            max_duration=prompt_info["duration"],
+        )
+        return {"final": final}
+
+    final_9x16 = OUTPUT_DIR / "final_9x16.mp4"
+    if cut_files_9x16:
+        print("\n--- [9:16] Concat / Grade / Music ---")
+        master_9x16 = build_master(cut_files_9x16, bgm_future, suffix="_9x16_vertical")
+        shutil.copy(master_9x16, final_9x16)
+    else:
+        # No vertical sources: center-crop the 16:9 master instead.
+        export_ratio(fallback_future.result()["master"], final_9x16, 1080, 1920)
+
+    return {"final": append_outro(final_9x16, outro_future.result())}
+
 # ======================
 # MAIN WORKFLOW
 # ======================
-def main(prompt: str):
+def main(prompt: str, single_pass=None):
+    if single_pass is None:
+        single_pass = SINGLE_PASS
+
     print("\n=== Aquaverse Auto Editing Engine (Anti-Stutter & Diverse) ===\n")
     print("Prompt:", prompt)
+    if single_pass:
+        print("Render mode: single-pass filter graph")
 
     prompt_info = parse_prompt(prompt)
     duration = prompt_info["duration"]
     shot_min = prompt_info["shot_len_min"]
     shot_max = prompt_info["shot_len_max"]
 
-    # 1. Load Data
-    df = pd.read_csv(TAGS_CSV)
-    df = df[df["status"] == "ok"].copy()
+    # 1. Load Data (shared, parsed once per process; don't mutate in place)
+    df = clip_library.load(TAGS_CSV)
     
     # Patch for missing columns
     if "download_url" not in df.columns:
         raise RuntimeError("Missing 'download_url' column.")
     if "mood_motion" not in df.columns:
-        df["mood_motion"] = 0.5 
+        df = df.assign(mood_motion=0.5)
 
     # 2. Select Clips (เพิ่มความหลากหลาย)
     # คำนวณจำนวนช็อตที่ต้องใช้ (no transitions - modern hard cuts)
@@ -119,161 +300,39 @@ def main(prompt: str):
 
     print(f"Selected {len(chosen)} unique clips from pool.")
 
-    log = {"prompt": prompt, "selected": []}
-    cut_files = []
-
-    # 3. Download & Cut
-    print("\n--- Downloading & Cutting ---")
-    for i, r in tqdm(chosen.iterrows(), total=len(chosen)):
-        asset_id = str(r.get("asset_id"))
-        url = r.get("download_url")
+    # Start pulling every selected clip now; shot prep picks up each one as it lands.
+    asset_store.prefetch(zip(chosen["download_url"], chosen.get("asset_id", pd.Series(index=chosen.index))))
 
-        local_video = TEMP_DIR / f"{asset_id}.mp4"
-        cut_video = TEMP_DIR / f"cut_{i:03d}.mp4"
+    # Created once up front so the outro cache hashes the final logo.
+    ensure_logo()
 
-        if not local_video.exists():
-            download_file(url, local_video)
+    # Each branch gets its own RNG so shot choices don't depend on thread timing.
+    seed_16x9 = random.getrandbits(32)
+    seed_9x16 = random.getrandbits(32)
 
-        seg_len = random.uniform(shot_min, shot_max)
-        
-        # เรียกใช้ฟังก์ชันตัดแบบใหม่ (FPS=30)
-        start, full_dur = cut_random_segment(local_video, cut_video, seg_len=seg_len)
-
-        cut_files.append(cut_video)
-        log["selected"].append({"asset_id": asset_id, "seg_len": seg_len})
+    # 3. Render DAG:
+    #   bgm ─┬─> branch 16:9 (shots -> master/render -> outro) ─┬─> join
+    #        └─> branch 9:16 (shots -> master/render -> outro) ─┘
+    #   outro 16:9 / outro 9:16 feed their branch; 9:16 only waits on 16:9 when it has no vertical sources.
+    with shot_pool() as pool, ThreadPoolExecutor(max_workers=5) as dag:
+        bgm_f = dag.submit(prepare_bgm, prompt_info["vibe"], duration)
+        # Outros come from the outro cache (encoded once per node, reused by every job).
+        outro_16x9_f = dag.submit(get_outro, "1920x1080", DEFAULT_OUTROS["1920x1080"], OUTRO_COLOR, 2, LOGO_PATH)
+        outro_9x16_f = dag.submit(get_outro, "1080x1920", DEFAULT_OUTROS["1080x1920"], OUTRO_COLOR, 2, LOGO_PATH)
+        b16_f = dag.submit(branch_16x9, chosen, prompt_info, seed_16x9, pool, bgm_f, outro_16x9_f, single_pass)
+        if pool is None or low_resource_mode():
+            # Serial / low-resource: shots run in this process, so one branch (one ffmpeg pipeline) at a time.
+            b16_f.result()
+        b9_f = dag.submit(branch_9x16, df, prompt_info, n_shots, seed_9x16, pool, bgm_f, outro_9x16_f, b16_f, single_pass)
 
-    # 4. Concat (Modern hard cuts - no transitions)
-    print("\n--- Concatenating (Modern Hard Cuts) ---")
-    concat_out = OUTPUT_DIR / "concat_raw.mp4"
-    concat_videos_smooth(cut_files, concat_out)
+        b16 = b16_f.result()
+        b9 = b9_f.result()
 
-    # 5. Color Grade
-    print("\n--- Applying Color Grade ---")
-    graded = OUTPUT_DIR / "graded.mp4"
-    apply_lut(concat_out, graded)
+    outputs = {"16:9": str(b16["final"]), "9:16": str(b9["final"])}
 
-    # 6. Music Processing
-    print("\n--- Processing Music ---")
-    bgm = pick_bgm(prompt_info["vibe"])
-    final_master = OUTPUT_DIR / "master_with_music.mp4"
-    trimmed_bgm_wav = None
-
-    if bgm:
-        print(f"BGM Selected: {bgm.name}")
-        temp_bgm_path = OUTPUT_DIR / "bgm_temp" 
-        trimmed_bgm_wav = trim_music(bgm, temp_bgm_path, duration, fade=1.0)
-        
-        print("Mixing Video + Music...")
-        mix_video_music(graded, trimmed_bgm_wav, final_master)
-    else:
-        print("⚠️ No BGM available. Video without background music.")
-        shutil.copy(graded, final_master)
-
-    # 7. Export Ratios
-    print("\n--- Exporting Formats (9:16 & 16:9) ---")
-
-    # =============================
-    #   OUTRO (Logo + BG color)
-    # =============================
-    print("\n--- Adding Outro (Logo + Background) ---")
-
-    from ffmpeg_utils import create_outro_sized, overlay_logo_scaled, concat_with_outro
-
-    logo_path = "assets/brand_logo.png"
-
-    # Create logo if not exists (for HuggingFace deployment)
-    if not Path(logo_path).exists():
-        from PIL import Image, ImageDraw, ImageFont
-        Path("assets").mkdir(exist_ok=True)
-        img = Image.new('RGBA', (800, 300), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        try:
-            font = ImageFont.truetype('arial.ttf', 80)
-        except:
-            font = ImageFont.load_default()
-        draw.text((50, 100), 'AQUAVERSE', fill=(43, 73, 126, 255), font=font)
-        img.save(logo_path)
-        print(f"✓ Created {logo_path}")
-    outro_bg = OUTPUT_DIR / "outro_bg.mp4"
-    outro_logo = OUTPUT_DIR / "outro_logo.mp4"
-    final_with_outro = OUTPUT_DIR / "final_with_outro.mp4"
-
-    # 1) สร้างพื้นหลังสี #2b497e ความยาว 2 วินาที
-    create_outro_sized("#2b497e", duration=2, out_path=outro_bg, size="1920x1080")
-
-    # 2) ใส่โลโก้ลงตรงกลางพื้นหลัง
-    overlay_logo_scaled(outro_bg, logo_path, outro_logo, logo_scale=0.35)
-
-    # 3) เอา outro ต่อท้ายคลิปสุดท้ายที่ใส่เพลงแล้ว
-    # NOTE: outro concat is handled per-aspect-ratio below (prevents 9:16 outro scaling/cropping)
-
-    # 4) ตั้งให้ final_master เป็นไฟล์ใหม่เพื่อนำไป export 16:9 / 9:16 ต่อ
-    outputs = export_ratios(final_master, OUTPUT_DIR)
-
-    # 9:16: rebuild from vertical-only sources (overwrite cropped 9:16 export)
-    print("\n--- Rebuilding 9:16 (vertical sources only) ---")
-    candidates_9x16 = select_clips(df, prompt_info, n_shots=n_shots * 10)
-    if "asset_id" in candidates_9x16.columns:
-        candidates_9x16 = candidates_9x16.drop_duplicates(subset=["asset_id"])
-
-    cut_files_9x16 = []
-    chosen_9x16 = 0
-    for _, r in tqdm(candidates_9x16.iterrows(), total=len(candidates_9x16)):
-        if chosen_9x16 >= n_shots:
-            break
-
-        asset_id = str(r.get("asset_id"))
-        url = r.get("download_url")
-        local_video = TEMP_DIR / f"{asset_id}.mp4"
-        if not local_video.exists():
-            download_file(url, local_video)
-
-        w, h = get_resolution(local_video)
-        if w <= 0 or h <= 0 or h <= w:
-            continue
-
-        seg_len = random.uniform(shot_min, shot_max)
-        cut_video = TEMP_DIR / f"9x16_cut_{chosen_9x16:03d}.mp4"
-        cut_random_segment(local_video, cut_video, seg_len=seg_len, target_w=1080, target_h=1920)
-        cut_files_9x16.append(cut_video)
-        chosen_9x16 += 1
-
-    if chosen_9x16 < n_shots:
-        print(f"Warning: only found {chosen_9x16}/{n_shots} vertical clips for 9:16.")
-
-    if cut_files_9x16:
-        concat_9x16 = OUTPUT_DIR / "concat_raw_9x16_vertical.mp4"
-        graded_9x16 = OUTPUT_DIR / "graded_9x16_vertical.mp4"
-        master_9x16 = OUTPUT_DIR / "master_with_music_9x16_vertical.mp4"
-        final_9x16 = OUTPUT_DIR / "final_9x16.mp4"
-
-        concat_videos_smooth(cut_files_9x16, concat_9x16)
-        apply_lut(concat_9x16, graded_9x16)
-
-        if trimmed_bgm_wav:
-            mix_video_music(graded_9x16, trimmed_bgm_wav, master_9x16)
-            shutil.copy(master_9x16, final_9x16)
-        else:
-            shutil.copy(graded_9x16, final_9x16)
-
-        outputs["9:16"] = str(final_9x16)
-
-    def append_outro(video_path: Path, outro_path: Path) -> Path:
-        # Write to a new file to avoid Windows file-lock issues when the target is open in a player.
-        out_final = OUTPUT_DIR / f"{video_path.stem}_with_outro.mp4"
-        concat_with_outro(video_path, outro_path, out_final)
-        return out_final
-
-    outro_bg_9x16 = OUTPUT_DIR / "outro_bg_9x16.mp4"
-    outro_logo_9x16 = OUTPUT_DIR / "outro_logo_9x16.mp4"
-    create_outro_sized("#2b497e", duration=2, out_path=outro_bg_9x16, size="1080x1920")
-    overlay_logo_scaled(outro_bg_9x16, logo_path, outro_logo_9x16, logo_scale=0.60)
-
-    final_16x9_out = append_outro(OUTPUT_DIR / "final_16x9.mp4", outro_logo)
-    final_9x16_out = append_outro(OUTPUT_DIR / "final_9x16.mp4", outro_logo_9x16)
-    outputs["16:9"] = str(final_16x9_out)
-    outputs["9:16"] = str(final_9x16_out)
-    
+    log = {"prompt": prompt, "selected": []}
+    for p in b16["prepared"]:
+        log["selected"].append({"asset_id": p["asset_id"], "seg_len": p["seg_len"]})
 
     # Log & Done
     with open(OUTPUT_DIR / "edit_log.json", "w", encoding="utf-8") as f:
@@ -0,0 +1,113 @@
+# job_queue.py
+# Bounded FIFO scheduler for video generation jobs.
+#
+# A fixed number of worker threads (VIDEOSCORE_JOB_WORKERS, default 1) take
+# jobs in arrival order; at most VIDEOSCORE_JOB_QUEUE jobs wait behind them.
+# When the queue is full, submit() raises QueueFull with a Retry-After
+# estimate (from the recent job durations) instead of starting yet another
+# ffmpeg pipeline, so a burst of requests waits in line rather than
+# thrashing the box.
+#
+# generate_edit renders into shared paths (output/, temp_edit/): keep one
+# worker per working directory.
+
+import os
+import threading
+import time
+import traceback
+from collections import deque
+
+JOB_WORKERS = int(os.environ.get("VIDEOSCORE_JOB_WORKERS", "1") or 1)
+JOB_QUEUE_SIZE = int(os.environ.get("VIDEOSCORE_JOB_QUEUE", "8") or 8)
+
+# Until a job has finished, assume this many seconds per job for Retry-After/ETA.
+DEFAULT_JOB_SECONDS = 120.0
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    def __init__(self, run, workers=None, max_queued=None, name="job"):
+        """run(job_id, *args) is called on a worker thread for every submitted job."""
+        self.run = run
+        self.workers = max(1, workers or JOB_WORKERS)
+        self.max_queued = max(0, JOB_QUEUE_SIZE if max_queued is None else max_queued)
+        self.name = name
+        self._waiting = deque()  # (job_id, args), FIFO
+        self._running = set()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._avg_seconds = None  # moving average of finished job durations
+
+    def _start_workers(self):
+        # lazily, so importing the web app doesn't spawn threads
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker, name=f"{self.name}-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def submit(self, job_id, *args):
+        """Queue a job. Returns its queue position (0 = a worker takes it now). Raises QueueFull."""
+        with self._cond:
+            self._start_workers()
+            # a free worker picks the job up immediately, so it never really waits
+            free = self.workers - len(self._running) - len(self._waiting)
+            if free <= 0 and len(self._waiting) >= self.max_queued:
+                raise QueueFull(self._retry_after_locked())
+            self._waiting.append((job_id, args))
+            self._cond.notify()
+            return 0 if free > 0 else len(self._waiting)
+
+    def position(self, job_id):
+        """1-based place in line while the job waits; None once it runs (or is unknown)."""
+        with self._cond:
+            for i, (queued_id, _) in enumerate(self._waiting, 1):
+                if queued_id == job_id:
+                    return i
+        return None
+
+    def eta_seconds(self, position):
+        """Rough wait before a job at this queue position starts."""
+        with self._cond:
+            per_job = self._avg_seconds or DEFAULT_JOB_SECONDS
+            return int(per_job * -(-position // self.workers))
+
+    def _retry_after_locked(self):
+        per_job = self._avg_seconds or DEFAULT_JOB_SECONDS
+        # one queue slot frees up roughly every per_job / workers seconds
+        return max(1, int(per_job / self.workers))
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": len(self._running),
+                "queued": len(self._waiting),
+                "max_queued": self.max_queued,
+                "avg_job_seconds": round(self._avg_seconds, 1) if self._avg_seconds else None,
+            }
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._waiting:
+                    self._cond.wait()
+                job_id, args = self._waiting.popleft()
+                self._running.add(job_id)
+
+            started = time.time()
+            try:
+                self.run(job_id, *args)
+            except Exception as e:
+                # run() records its own failure; never let one job kill the worker
+                print(f"⚠️ {self.name} {job_id} crashed: {e}")
+                traceback.print_exc()
+            finally:
+                elapsed = time.time() - started
+                with self._cond:
+                    self._running.discard(job_id)
+                    self._avg_seconds = elapsed if self._avg_seconds is None else 0.7 * self._avg_seconds + 0.3 * elapsed
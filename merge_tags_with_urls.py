@@ -1,29 +1,78 @@
 import pandas as pd
 
+import asset_store
+import probe_cache
+
 TAGS = "canto_clip_tags.csv"
 CAND = "canto_candidates.csv"
 OUT  = "canto_clip_tags_with_urls.csv"
 
-tags = pd.read_csv(TAGS)
-cand = pd.read_csv(CAND)
 
-tags["asset_id"] = tags["asset_id"].astype(str)
-cand["asset_id"] = cand["asset_id"].astype(str)
+# ---------- width / height / rotation ต่อคลิป ----------
+# auto_tag_videos โหลดไฟล์เข้า asset store ไว้แล้ว → probe จากไฟล์ในเครื่อง (ไม่ต้องโหลดซ้ำ)
+# ใช้ตอนเลือกคลิป 9:16 จะได้ไม่ต้องโหลดคลิปแนวนอนมาทิ้ง
+def geometry(row):
+    url = row.get("download_url")
+    if not isinstance(url, str) or not url.startswith("http"):
+        return pd.Series({"width": None, "height": None, "rotation": None})
+    local = asset_store.asset_path(url, row.get("asset_id"))
+    info = probe_cache.get_info(local) if asset_store.is_valid(local) else None
+    if not info:
+        return pd.Series({"width": None, "height": None, "rotation": None})
+    return pd.Series({"width": info["width"], "height": info["height"], "rotation": info["rotation"]})
+
+
+def add_geometry(merged, dims=None):
+    """Fill width/height/rotation from the local file, then (if still missing) from Canto metadata dims."""
+    geo = merged.apply(geometry, axis=1) if len(merged) else pd.DataFrame(columns=["width", "height", "rotation"])
+    for col in ["width", "height", "rotation"]:
+        if col in merged.columns:
+            merged[col] = merged[col].fillna(geo[col])
+        else:
+            merged[col] = geo[col]
+
+    # ไม่มีไฟล์ในเครื่อง → ใช้ width/height จาก canto metadata (ถ้ามี)
+    if dims is not None:
+        for col in ["width", "height"]:
+            merged[col] = merged[col].fillna(dims[col])
+    return merged
+
+
+def merge(tags, cand):
+    tags = tags.copy()
+    cand = cand.copy()
+    tags["asset_id"] = tags["asset_id"].astype(str)
+    cand["asset_id"] = cand["asset_id"].astype(str)
+
+    merged = tags.merge(
+        cand[["asset_id", "download_url", "filename"]],
+        on="asset_id",
+        how="left",
+        suffixes=("", "_cand")
+    )
+
+    # ถ้า filename เดิมว่าง ให้ใช้จาก candidates
+    if "filename_cand" in merged.columns:
+        merged["filename"] = merged["filename"].fillna(merged["filename_cand"])
+        merged = merged.drop(columns=["filename_cand"])
+
+    dims = None
+    if {"width", "height"} <= set(cand.columns):
+        by_id = cand.drop_duplicates(subset=["asset_id"]).set_index("asset_id")[["width", "height"]]
+        dims = {col: merged["asset_id"].map(by_id[col]) for col in ["width", "height"]}
+    return add_geometry(merged, dims)
+
+
+def main():
+    merged = merge(pd.read_csv(TAGS), pd.read_csv(CAND))
 
-merged = tags.merge(
-    cand[["asset_id", "download_url", "filename"]],
-    on="asset_id",
-    how="left",
-    suffixes=("", "_cand")
-)
+    merged.to_csv(OUT, index=False, encoding="utf-8-sig")
 
-# ถ้า filename เดิมว่าง ให้ใช้จาก candidates
-if "filename_cand" in merged.columns:
-    merged["filename"] = merged["filename"].fillna(merged["filename_cand"])
-    merged = merged.drop(columns=["filename_cand"])
+    print("✅ Done:", OUT)
+    print("Rows:", len(merged))
+    print("Missing download_url:", merged["download_url"].isna().sum())
+    print("Missing width/height:", merged["width"].isna().sum())
 
-merged.to_csv(OUT, index=False, encoding="utf-8-sig")
 
-print("✅ Done:", OUT)
-print("Rows:", len(merged))
-print("Missing download_url:", merged["download_url"].isna().sum())
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# motion_index.py
+# Offline motion profiles for find_smooth_start.
+#
+# Ingest: each clip is decoded once, sequentially, at SAMPLE_FPS. The mean abs
+# difference between consecutive 128x72 gray samples is stored per asset_id in
+# one .npz next to the tag CSV.
+# Request path: window mean/variance come from prefix sums over that array,
+# so no video is opened to choose a start.
+#
+#   python motion_index.py               # index every clip not indexed yet
+#   python motion_index.py --rebuild     # recompute everything
+
+import argparse
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from ffmpeg_utils import scan_motion_profile
+
+LIBRARY_CSV = "canto_clip_tags_with_urls.csv"
+MOTION_INDEX_PATH = Path(os.environ.get("VIDEOSCORE_MOTION_INDEX", "canto_motion_profiles.npz"))
+
+# Must match find_smooth_start's default sample_rate_fps so the motion units are the same.
+SAMPLE_FPS = 6.0
+_SAMPLE_KEY = "__sample_fps__"
+
+_cache = {"mtime": None, "profiles": {}}
+_cache_lock = threading.Lock()
+
+
+# ---------------------------
+# Build
+# ---------------------------
+def compute_profile(video_path, sample_fps=SAMPLE_FPS):
+    return scan_motion_profile(video_path, sample_fps)
+
+
+def _write_index(profiles, path=MOTION_INDEX_PATH):
+    path = Path(path)
+    buf = io.BytesIO()
+    np.savez_compressed(buf, **{_SAMPLE_KEY: np.float32(SAMPLE_FPS)}, **{str(k): v for k, v in profiles.items()})
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(buf.getvalue())
+    os.replace(tmp, path)
+
+
+def _read_index(path=MOTION_INDEX_PATH):
+    with np.load(path, allow_pickle=False) as z:
+        sample_fps = float(z[_SAMPLE_KEY]) if _SAMPLE_KEY in z.files else SAMPLE_FPS
+        if abs(sample_fps - SAMPLE_FPS) > 1e-6:
+            print(f"⚠️ Motion index sampled at {sample_fps} fps, expected {SAMPLE_FPS}; ignoring it")
+            return {}
+        return {k: z[k] for k in z.files if k != _SAMPLE_KEY}
+
+
+# ---------------------------
+# Query
+# ---------------------------
+def load_profiles():
+    """All profiles keyed by asset_id (reloaded when the .npz changes on disk)."""
+    try:
+        mtime = MOTION_INDEX_PATH.stat().st_mtime
+    except OSError:
+        return {}
+    with _cache_lock:
+        if _cache["mtime"] != mtime:
+            try:
+                _cache["profiles"] = _read_index()
+            except Exception as e:
+                print(f"⚠️ Could not read motion index: {e}")
+                _cache["profiles"] = {}
+            _cache["mtime"] = mtime
+        return _cache["profiles"]
+
+
+def get_profile(asset_id):
+    if asset_id is None:
+        return None
+    return load_profiles().get(str(asset_id))
+
+
+def window_stats(profile, n_diffs):
+    """Mean and variance of every window of n_diffs consecutive diffs (index = window start sample)."""
+    d = np.asarray(profile, dtype=np.float64)
+    n = int(n_diffs)
+    if n <= 0 or len(d) < n:
+        return np.empty(0), np.empty(0)
+    c1 = np.concatenate(([0.0], np.cumsum(d)))
+    c2 = np.concatenate(([0.0], np.cumsum(d * d)))
+    s1 = c1[n:] - c1[:-n]
+    s2 = c2[n:] - c2[:-n]
+    mean = s1 / n
+    var = np.maximum(0.0, s2 / n - mean * mean)
+    return mean, var
+
+
+# ---------------------------
+# CLI
+# ---------------------------
+def main():
+    import asset_store
+
+    parser = argparse.ArgumentParser(description="Build the offline motion-profile index")
+    parser.add_argument("--csv", default=LIBRARY_CSV)
+    parser.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    parser.add_argument("--rebuild", action="store_true", help="ignore existing profiles")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv)
+    df = df[df["download_url"].astype(str).str.startswith("http")]
+    df = df.dropna(subset=["asset_id"]).drop_duplicates(subset=["asset_id"])
+    df["asset_id"] = df["asset_id"].astype(str)
+
+    profiles = {} if args.rebuild or not MOTION_INDEX_PATH.exists() else dict(_read_index())
+    todo = df[~df["asset_id"].isin(set(profiles))]
+    print(f"Motion index: {len(profiles)} indexed, {len(todo)} to go")
+
+    def build_one(url, asset_id):
+        source = asset_store.fetch(url, asset_id, session=asset_store.http_session())
+        return compute_profile(asset_store.analysis_source(source))
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        futures = {ex.submit(build_one, r["download_url"], r["asset_id"]): r["asset_id"] for _, r in todo.iterrows()}
+        for f in tqdm(as_completed(futures), total=len(futures), desc="Motion profiles"):
+            aid = futures[f]
+            try:
+                prof = f.result()
+            except Exception as e:
+                print(f"⚠️ {aid}: {e}")
+                continue
+            if prof is None:
+                continue
+            profiles[aid] = prof
+            done += 1
+            # Checkpoint now and then so an interrupted run keeps its work.
+            if done % 100 == 0:
+                _write_index(profiles)
+
+    _write_index(profiles)
+    print(f"✓ Motion index saved: {MOTION_INDEX_PATH} ({len(profiles)} clips)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# outro_cache.py
+# Precomputed outro clips (background colour + centred logo).
+# The bytes only depend on (bg_color, size, duration, logo, logo_scale, encoder),
+# so each variant is encoded once per node and reused by every job.
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from ffmpeg_utils import create_outro_sized, h264_video_args, overlay_logo_scaled
+
+OUTRO_CACHE_DIR = Path(os.environ.get("VIDEOSCORE_OUTRO_CACHE_DIR", "cache/outros"))
+
+DEFAULT_BG_COLOR = "#2b497e"
+DEFAULT_DURATION = 2
+DEFAULT_LOGO_PATH = "assets/brand_logo.png"
+
+# size -> logo_scale used by generate_edit for each aspect ratio
+DEFAULT_OUTROS = {
+    "1920x1080": 0.35,
+    "1080x1920": 0.60,
+}
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def outro_key(bg_color, size, duration, logo_hash, logo_scale):
+    payload = json.dumps(
+        [
+            str(bg_color).lower(),
+            str(size),
+            float(duration),
+            logo_hash,
+            round(float(logo_scale), 4),
+            # Encoder is part of the key so a cached outro always matches the masters it gets appended to.
+            h264_video_args(quality="final"),
+        ],
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _lock_for(key):
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def get_outro(size="1920x1080", logo_scale=0.35, bg_color=DEFAULT_BG_COLOR, duration=DEFAULT_DURATION, logo_path=DEFAULT_LOGO_PATH):
+    """Return the cached outro for these parameters, building it on first use."""
+    key = outro_key(bg_color, size, duration, _file_hash(logo_path), logo_scale)
+    out_path = OUTRO_CACHE_DIR / f"outro_{size}_{key[:16]}.mp4"
+
+    with _lock_for(key):
+        if out_path.exists():
+            return out_path
+
+        OUTRO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tag = f"{os.getpid()}-{threading.get_ident()}"
+        tmp_bg = out_path.with_name(f"{out_path.stem}.{tag}.bg.mp4")
+        tmp_logo = out_path.with_name(f"{out_path.stem}.{tag}.logo.mp4")
+        try:
+            create_outro_sized(bg_color, duration=duration, out_path=tmp_bg, size=size)
+            overlay_logo_scaled(tmp_bg, logo_path, tmp_logo, logo_scale=logo_scale)
+            # Atomic publish: other processes either see the full file or nothing.
+            os.replace(tmp_logo, out_path)
+        finally:
+            tmp_bg.unlink(missing_ok=True)
+            tmp_logo.unlink(missing_ok=True)
+
+    print(f"✓ Outro cached: {out_path}")
+    return out_path
+
+
+def warm_outro_cache(logo_path=DEFAULT_LOGO_PATH, bg_color=DEFAULT_BG_COLOR, duration=DEFAULT_DURATION, outros=None):
+    outros = outros or DEFAULT_OUTROS
+    paths = {}
+    for size, logo_scale in outros.items():
+        try:
+            paths[size] = get_outro(size, logo_scale, bg_color=bg_color, duration=duration, logo_path=logo_path)
+        except Exception as e:
+            print(f"⚠️ Could not warm outro {size}: {e}")
+    return paths
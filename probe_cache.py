@@ -0,0 +1,102 @@
+# probe_cache.py
+# One ffprobe per file version.
+#
+# Metadata (duration, fps, frames, width, height, rotation, codec, has_audio) is
+# keyed by (resolved path, mtime_ns, size): a file that gets replaced is probed
+# again, everything else is answered from memory or from the SQLite backing,
+# which survives restarts and is shared by worker processes. If the SQLite file
+# can't be opened (read-only checkout, bad path), the process keeps going on the
+# in-memory map alone.
+
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import frame_reader
+
+PROBE_CACHE_PATH = Path(os.environ.get("VIDEOSCORE_PROBE_CACHE", "cache/probe_cache.sqlite"))
+
+# Temp cuts get rewritten every job; cap the in-memory map so a long-lived web worker doesn't grow forever.
+MEM_MAX_ENTRIES = 4096
+
+_mem = {}
+_mem_lock = threading.Lock()
+_local = threading.local()
+_db_disabled = False  # set once the SQLite tier failed to open: memory only from then on
+
+
+def _db():
+    """This thread's connection to the persistent tier, or None if it's unavailable."""
+    global _db_disabled
+    if _db_disabled:
+        return None
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "pid", None) == os.getpid():
+        return conn
+    try:
+        PROBE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(PROBE_CACHE_PATH), timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            " path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, info TEXT NOT NULL)"
+        )
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ Probe cache disabled ({PROBE_CACHE_PATH}): {e} — using the in-memory cache only")
+        _db_disabled = True
+        return None
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _file_key(video_path):
+    p = Path(video_path)
+    st = p.stat()
+    return str(p.resolve()), st.st_mtime_ns, st.st_size
+
+
+def get_info(video_path):
+    """Probe metadata for video_path (see frame_reader.probe), or None if missing/unreadable."""
+    try:
+        key = _file_key(video_path)
+    except OSError:
+        return None
+
+    with _mem_lock:
+        info = _mem.get(key)
+    if info is not None:
+        return info
+
+    path, mtime_ns, size = key
+    db = _db()
+    row = None
+    if db is not None:
+        try:
+            row = db.execute("SELECT mtime_ns, size, info FROM probes WHERE path = ?", (path,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ Probe cache unavailable: {e}")
+    if row and row[0] == mtime_ns and row[1] == size:
+        info = json.loads(row[2])
+    else:
+        info = frame_reader.probe(path)
+        if info is None:
+            # Don't cache failures: the file may still be being written.
+            return None
+        if db is not None:
+            try:
+                with db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO probes (path, mtime_ns, size, info) VALUES (?, ?, ?, ?)",
+                        (path, mtime_ns, size, json.dumps(info)),
+                    )
+            except sqlite3.Error as e:
+                print(f"⚠️ Probe cache write failed: {e}")
+
+    with _mem_lock:
+        if len(_mem) >= MEM_MAX_ENTRIES:
+            _mem.clear()
+        _mem[key] = info
+    return info
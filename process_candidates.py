@@ -1,135 +1,302 @@
 # process_candidates.py
+# Quality-score every candidate clip (sharpness / brightness / motion → usable|reject).
+#
+# Downloads run on asset_store's pool; each clip is handed to a process pool
+# the moment its own file lands, and the main process is the only writer:
+# results are buffered and appended to the CSV in batches. Finished asset_ids
+# live in a SQLite checkpoint (not re-read from the CSV), and every batch is
+# appended + checkpointed inside one SQLite write transaction, so two copies
+# of this script can run side by side without writing a clip twice.
+# Clips clip_analyzer already scored (quality plugin, same download URL) are
+# taken from its store instead of being downloaded and decoded again.
+#
+#   python process_candidates.py                 # all cores
+#   python process_candidates.py --workers 4
+
+import argparse
+import os
+import queue
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
-import requests
 import pandas as pd
 from tqdm import tqdm
-from pathlib import Path
 
+import asset_store
+import canto_sync
+import clip_analyzer
 from video_quality import analyze_video_file, decide_usable
-from smart_analyze import motion_score, brightness_score, face_score
 
 
 OUTPUT_RESULTS_CSV = "canto_clip_scores.csv"
 INPUT_CANDIDATES_CSV = "canto_candidates.csv"
-TEMP_VIDEO_PATH = "temp_video.mp4"  # ไฟล์ชั่วคราว ใช้ทับไปเรื่อย ๆ
+CHECKPOINT_PATH = Path(os.environ.get("VIDEOSCORE_SCORES_CHECKPOINT", "cache/process_candidates.sqlite"))
 
+FLUSH_EVERY = 100
 
-def download_file(url, out_path):
-    resp = requests.get(url, stream=True)
-    resp.raise_for_status()
-    with open(out_path, "wb") as f:
-        for chunk in resp.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
+# Ids per IN (...) lookup: stays under SQLite's host-parameter limit (999 on older builds).
+SQL_CHUNK = 900
 
+RESULT_COLUMNS = [
+    "asset_id", "filename", "status", "error",
+    "sharp_mean", "sharp_median", "brightness_mean", "motion_mean", "decision",
+]
 
-def main():
-    df = pd.read_csv(INPUT_CANDIDATES_CSV)
 
-    # ---------- 1) เช็คว่ามีไฟล์ผลลัพธ์เดิมมั้ย (ไว้ resume) ----------
-    output_path = Path(OUTPUT_RESULTS_CSV)
-    processed_ids = set()
+# ---------------------------
+# Checkpoint
+# ---------------------------
+def open_checkpoint(path=None):
+    path = Path(path or CHECKPOINT_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS scored ("
+        " asset_id TEXT PRIMARY KEY, status TEXT NOT NULL, decision TEXT, finished_at REAL NOT NULL)"
+    )
+    return conn
 
-    if output_path.exists():
-        old = pd.read_csv(OUTPUT_RESULTS_CSV)
-        if "asset_id" in old.columns:
-            processed_ids = set(old["asset_id"].dropna().astype(str))
-        print(f"พบผลลัพธ์เก่า {len(processed_ids)} รายการ จะข้าม asset_id ที่ทำไปแล้ว")
 
-    # แปลง asset_id เป็น string เพื่อเทียบ set ได้เป๊ะ
-    df["asset_id"] = df["asset_id"].astype(str)
+def finished_ids(conn):
+    return {r[0] for r in conn.execute("SELECT asset_id FROM scored")}
 
-    # เลือกเฉพาะแถวที่ยังไม่เคยทำ
-    mask = ~df["asset_id"].isin(processed_ids)
-    df_todo = df[mask].copy()
 
-    print(f"มีคลิปที่ต้องประมวลผลรอบนี้ {len(df_todo)} รายการ จากทั้งหมด {len(df)}")
+def seed_checkpoint(conn, csv_path):
+    """One-time import of asset_ids already in an existing results CSV (runs from before the checkpoint)."""
+    if conn.execute("SELECT 1 FROM scored LIMIT 1").fetchone() or not Path(csv_path).exists():
+        return 0
+    old = pd.read_csv(csv_path)
+    if "asset_id" not in old.columns:
+        return 0
+    old = old.dropna(subset=["asset_id"]).drop_duplicates(subset=["asset_id"], keep="last")
+    now = time.time()
+    rows = [
+        (str(r["asset_id"]), str(r.get("status", "")), r.get("decision"), now)
+        for r in old.to_dict("records")
+    ]
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany("INSERT OR IGNORE INTO scored VALUES (?, ?, ?, ?)", rows)
+    conn.execute("COMMIT")
+    return len(rows)
 
-    # ---------- 2) loop ทีละไฟล์ + เขียน CSV ทันที ----------
-    first_write = not output_path.exists() or output_path.stat().st_size == 0
 
-    for _, row in tqdm(df_todo.iterrows(), total=len(df_todo), desc="Processing candidates"):
-        asset_id = row.get("asset_id")
-        filename = row.get("filename")
-        download_url = row.get("download_url")
+def forget(conn, asset_ids, csv_path):
+    """
+    Drop results of these asset_ids (changed/deleted in Canto) from the checkpoint
+    and the CSV, so the next run scores them again. Returns how many rows went.
+    """
+    asset_ids = {str(a) for a in asset_ids}
+    if not asset_ids:
+        return 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany("DELETE FROM scored WHERE asset_id = ?", [(a,) for a in asset_ids])
+        removed = 0
+        csv_path = Path(csv_path)
+        if csv_path.exists():
+            old = pd.read_csv(csv_path)
+            stale = old["asset_id"].map(str).isin(asset_ids)  # missing ids read back as "nan", like the checkpoint keys
+            removed = int(stale.sum())
+            if removed:
+                tmp = csv_path.with_name(f"{csv_path.name}.{os.getpid()}.tmp")
+                old[~stale].to_csv(tmp, index=False, encoding="utf-8-sig")
+                os.replace(tmp, csv_path)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return removed
 
-        def write_result(result_row: dict):
-            # เขียนเพิ่มทีละ 1 แถวลง CSV (append mode)
-            nonlocal first_write
-            out_df = pd.DataFrame([result_row])
-            out_df.to_csv(
-                OUTPUT_RESULTS_CSV,
+
+def write_batch(conn, rows, csv_path):
+    """
+    Append rows to the CSV and record them as finished, atomically w.r.t. other
+    copies: the SQLite write lock is held across the append. Rows another copy
+    already wrote are dropped. Returns how many rows were written.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        ids = [r["asset_id"] for r in rows]
+        done = set()
+        for i in range(0, len(ids), SQL_CHUNK):
+            chunk = ids[i:i + SQL_CHUNK]
+            done.update(
+                r[0] for r in conn.execute(
+                    f"SELECT asset_id FROM scored WHERE asset_id IN ({','.join('?' * len(chunk))})", chunk
+                )
+            )
+        rows = [r for r in rows if r["asset_id"] not in done]
+        if rows:
+            csv_path = Path(csv_path)
+            first_write = not csv_path.exists() or csv_path.stat().st_size == 0
+            pd.DataFrame(rows, columns=RESULT_COLUMNS).to_csv(
+                csv_path,
                 mode="a",
                 header=first_write,     # เขียน header แค่ครั้งแรก
                 index=False,
                 encoding="utf-8-sig",
             )
-            first_write = False  # ครั้งต่อ ๆ ไปไม่ต้องเขียน header แล้ว
-
-        # ไม่มี download_url → ไม่ต้องทำต่อ
-        if not isinstance(download_url, str) or not download_url.startswith("http"):
-            write_result({
-                "asset_id": asset_id,
-                "filename": filename,
-                "status": "no_download_url",
-                "error": "",
-                "sharp_mean": None,
-                "sharp_median": None,
-                "brightness_mean": None,
-                "motion_mean": None,
-                "decision": "reject",
-            })
-            continue
-
-        # 1) ดาวน์โหลดไฟล์
-        try:
-            download_file(download_url, TEMP_VIDEO_PATH)
-        except Exception as e:
-            write_result({
-                "asset_id": asset_id,
-                "filename": filename,
-                "status": "error_download",
-                "error": str(e),
-                "sharp_mean": None,
-                "sharp_median": None,
-                "brightness_mean": None,
-                "motion_mean": None,
-                "decision": "reject",
-            })
-            continue
-
-        # 2) วิเคราะห์วิดีโอ
-        metrics = analyze_video_file(TEMP_VIDEO_PATH)
-        if metrics is None:
-            write_result({
-                "asset_id": asset_id,
-                "filename": filename,
-                "status": "error_analyze",
-                "error": "cannot_read_video",
-                "sharp_mean": None,
-                "sharp_median": None,
-                "brightness_mean": None,
-                "motion_mean": None,
-                "decision": "reject",
-            })
-        else:
-            decision = decide_usable(metrics)
-            write_result({
-                "asset_id": asset_id,
-                "filename": filename,
-                "status": "ok",
-                "error": "",
-                **metrics,
-                "decision": decision,
-            })
-
-        # 3) ลบไฟล์ชั่วคราว
-        try:
-            Path(TEMP_VIDEO_PATH).unlink(missing_ok=True)
-        except Exception:
-            pass
-
-    print(f"เสร็จแล้วนะ ผลลัพธ์อยู่ในไฟล์: {OUTPUT_RESULTS_CSV}")
+            now = time.time()
+            conn.executemany(
+                "INSERT OR REPLACE INTO scored VALUES (?, ?, ?, ?)",
+                [(r["asset_id"], r["status"], r["decision"], now) for r in rows],
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return len(rows)
+
+
+# ---------------------------
+# Workers
+# ---------------------------
+def result_row(asset_id, filename, status, error="", metrics=None, decision="reject"):
+    row = {
+        "asset_id": asset_id,
+        "filename": filename,
+        "status": status,
+        "error": error,
+        "sharp_mean": None,
+        "sharp_median": None,
+        "brightness_mean": None,
+        "motion_mean": None,
+        "decision": decision,
+    }
+    row.update(metrics or {})
+    return row
+
+
+def score_clip(asset_id, filename, local_video):
+    """Process-pool task: quality metrics of one downloaded clip → result row."""
+    metrics = analyze_video_file(str(local_video))
+    if metrics is None:
+        return result_row(asset_id, filename, "error_analyze", "cannot_read_video")
+    return result_row(asset_id, filename, "ok", metrics=metrics, decision=decide_usable(metrics))
+
+
+def _init_worker():
+    # One process per core already; keep OpenCV from spawning its own thread pool in each.
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except Exception:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quality-score Canto candidates")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--flush-every", type=int, default=FLUSH_EVERY, help="results buffered per CSV write")
+    parser.add_argument("--window", type=int, default=0, help="clips downloading/scoring at once (default 4 x workers)")
+    parser.add_argument(
+        "--changeset", nargs="?", const=canto_sync.CHANGESET_CSV, default=None,
+        help="re-score assets changed/deleted in Canto syncs not yet applied by this stage",
+    )
+    args = parser.parse_args()
+
+    df = pd.read_csv(INPUT_CANDIDATES_CSV)
+
+    # ---------- 1) resume จาก checkpoint (SQLite) ----------
+    conn = open_checkpoint()
+    seeded = seed_checkpoint(conn, OUTPUT_RESULTS_CSV)
+    if seeded:
+        print(f"นำเข้า checkpoint จากผลลัพธ์เก่า {seeded} รายการ")
+    mark = canto_sync.changeset_mark(args.changeset) if args.changeset else 0.0
+    stale = canto_sync.resolve_stale(canto_sync.stale_ids(args.changeset, "process_candidates"), df) if args.changeset else set()
+    if args.changeset:
+        removed = forget(conn, stale, OUTPUT_RESULTS_CSV)
+        print(f"ลบผลเก่าของ asset ที่เปลี่ยน/ถูกลบใน Canto {removed} รายการ")
+    processed_ids = finished_ids(conn)
+    if processed_ids:
+        print(f"พบผลลัพธ์เก่า {len(processed_ids)} รายการ จะข้าม asset_id ที่ทำไปแล้ว")
+
+    # แปลง asset_id เป็น string เพื่อเทียบ set ได้เป๊ะ
+    df["asset_id"] = df["asset_id"].astype(str)
+
+    # เลือกเฉพาะแถวที่ยังไม่เคยทำ (asset_id ซ้ำใน candidates ทำครั้งเดียว)
+    df_todo = df[~df["asset_id"].isin(processed_ids)].drop_duplicates(subset=["asset_id"])
+    rows = df_todo.to_dict("records")
+
+    print(f"มีคลิปที่ต้องประมวลผลรอบนี้ {len(rows)} รายการ จากทั้งหมด {len(df)}")
+
+    # คลิปที่ clip_analyzer วิเคราะห์ quality ไว้แล้ว → ใช้ผลเดิม ไม่ต้องโหลด/decode ซ้ำ
+    analyzed = {a: r for a, r in clip_analyzer.stored_records("quality").items() if a not in stale}
+
+    # ---------- 2) download → process pool → writer เดียว (เขียนเป็น batch) ----------
+    workers = max(1, args.workers)
+    window = args.window or workers * 4
+    results = queue.Queue()
+    buffer = []
+    written = 0
+
+    def flush():
+        nonlocal written
+        if buffer:
+            written += write_batch(conn, buffer, OUTPUT_RESULTS_CSV)
+            buffer.clear()
+
+    with tqdm(total=len(rows), desc="Processing candidates") as bar, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+
+        def on_scored(fut, row):
+            try:
+                results.put(fut.result())
+            except Exception as e:
+                results.put(result_row(row["asset_id"], row.get("filename"), "error_analyze", str(e)))
+
+        def on_downloaded(fut, row):
+            # 1) ดาวน์โหลดไฟล์ (ผ่าน asset store → โหลดครั้งเดียวต่อเครื่อง)
+            try:
+                local_video = fut.result()
+            except Exception as e:
+                results.put(result_row(row["asset_id"], row.get("filename"), "error_download", str(e)))
+                return
+            # 2) วิเคราะห์วิดีโอ (process pool)
+            try:
+                scored = pool.submit(score_clip, row["asset_id"], row.get("filename"), str(local_video))
+            except Exception as e:
+                results.put(result_row(row["asset_id"], row.get("filename"), "error_analyze", str(e)))
+                return
+            scored.add_done_callback(lambda f: on_scored(f, row))
+
+        next_row = 0
+        in_flight = 0
+        while next_row < len(rows) or in_flight:
+            while next_row < len(rows) and in_flight < window:
+                row = rows[next_row]
+                next_row += 1
+                download_url = row.get("download_url")
+                # ไม่มี download_url → ไม่ต้องทำต่อ
+                if not isinstance(download_url, str) or not download_url.startswith("http"):
+                    buffer.append(result_row(row["asset_id"], row.get("filename"), "no_download_url"))
+                    bar.update(1)
+                    continue
+                rec = clip_analyzer.reusable(analyzed, row)
+                if rec is not None:
+                    metrics = {k: rec.get(k) for k in ("sharp_mean", "sharp_median", "brightness_mean", "motion_mean")}
+                    buffer.append(result_row(row["asset_id"], row.get("filename"), "ok", metrics=metrics, decision=rec["decision"]))
+                    bar.update(1)
+                    continue
+                download = asset_store.prefetch([(download_url, row["asset_id"])])[0]
+                download.add_done_callback(lambda f, row=row: on_downloaded(f, row))
+                in_flight += 1
+
+            if in_flight:
+                buffer.append(results.get())
+                in_flight -= 1
+                bar.update(1)
+            if len(buffer) >= args.flush_every:
+                flush()
+
+        flush()
+
+    conn.close()
+    canto_sync.acknowledge("process_candidates", mark)
+    print(f"เสร็จแล้วนะ ผลลัพธ์อยู่ในไฟล์: {OUTPUT_RESULTS_CSV} (+{written} แถว)")
 
 
 if __name__ == "__main__":
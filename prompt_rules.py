@@ -52,6 +52,7 @@ def parse_prompt(prompt: str):
             break
 
     return {
+        "text": prompt,
         "duration": duration,
         "themes": themes if themes else ["water"],
         "vibe": vibe or "upbeat",
@@ -1,28 +1,25 @@
-import pandas as pd
 import sys
 
-DATA = "canto_clip_tags.csv"
+import numpy as np
 
-def search(prompt: str, top_k=20):
-    df = pd.read_csv(DATA)
-    df = df[df["status"] == "ok"].copy()
-    df["top_tags"] = df["top_tags"].fillna("").astype(str)
+import clip_library
+import tag_index
 
-    prompt_l = prompt.lower()
+DATA = "canto_clip_tags.csv"
 
-    # match แบบ phrase-level (ไม่ split เป็นคำ)
-    def score_row(tags):
-        tags_l = tags.lower()
-        score = 0
-        for token in prompt_l.split():
-            if token in tags_l:
-                score += 1
-        return score
+def search(prompt: str, top_k=20):
+    # clip_library: parsed once per process; tag_index: postings built once per library version
+    df = clip_library.load(DATA)
+    idx = tag_index.index_for(df["top_tags"])
 
-    df["match_score"] = df["top_tags"].apply(score_row)
-    df = df.sort_values("match_score", ascending=False)
+    # match แบบ phrase-level (ไม่ split เป็นคำ) → นับว่ามีกี่ token ของ prompt อยู่ใน tags
+    hits = [idx.rows_with(token) for token in prompt.lower().split()]
+    if not hits:
+        return df.iloc[0:0][["asset_id", "filename", "top_tags"]].assign(match_score=0)
+    rows, counts = np.unique(np.concatenate(hits), return_counts=True)
 
-    return df[df["match_score"] > 0].head(top_k)[["asset_id", "filename", "top_tags", "match_score"]]
+    out = df.iloc[rows][["asset_id", "filename", "top_tags"]].assign(match_score=counts)
+    return out.sort_values("match_score", ascending=False, kind="stable").head(top_k)
 
 if __name__ == "__main__":
     prompt = " ".join(sys.argv[1:]) if len(sys.argv) > 1 else "family jumanji waterslide fun"
@@ -0,0 +1,133 @@
+# segment_cache.py
+# Persistent, content-addressed cache for cut segments.
+# Key = (asset_id, source size, start, seg_len, target_w, target_h, encoder args),
+# bounded by a size cap with LRU eviction (mtime is bumped on every hit).
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+SEGMENT_CACHE_DIR = Path(os.environ.get("VIDEOSCORE_SEGMENT_CACHE_DIR", "cache/segments"))
+
+
+def cache_limit_bytes():
+    # VIDEOSCORE_SEGMENT_CACHE_MB=0 disables the cache.
+    v = os.environ.get("VIDEOSCORE_SEGMENT_CACHE_MB", "").strip()
+    try:
+        mb = float(v) if v else 2048.0
+    except ValueError:
+        mb = 2048.0
+    return int(max(0.0, mb) * 1024 * 1024)
+
+
+def cache_enabled():
+    return cache_limit_bytes() > 0
+
+
+def snap_grid():
+    """
+    VIDEOSCORE_SEGMENT_GRID=<seconds> snaps start and seg_len to a grid so
+    repeated jobs on the same asset land on the same cache key. 0/unset = off.
+    """
+    v = os.environ.get("VIDEOSCORE_SEGMENT_GRID", "").strip()
+    try:
+        return max(0.0, float(v)) if v else 0.0
+    except ValueError:
+        return 0.0
+
+
+def snap(value: float, grid: float, lo: float = 0.0, hi: float = None):
+    if grid <= 0:
+        return value
+    v = round(round(float(value) / grid) * grid, 3)
+    if hi is not None and v > hi:
+        # Stay on the grid while respecting the upper bound.
+        v = round((int(hi / grid)) * grid, 3)
+    return max(lo, v)
+
+
+def segment_key(asset_id, source_size, start, seg_len, target_w, target_h, encoder_args):
+    payload = json.dumps(
+        [
+            str(asset_id),
+            int(source_size),
+            f"{float(start):.3f}",
+            f"{float(seg_len):.3f}",
+            int(target_w),
+            int(target_h),
+            [str(a) for a in encoder_args],
+        ],
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key: str) -> Path:
+    return SEGMENT_CACHE_DIR / key[:2] / f"{key}.mp4"
+
+
+def fetch(key: str, out_path: Path) -> bool:
+    """Copy a cached segment to out_path. Returns False on a miss."""
+    if not cache_enabled():
+        return False
+    entry = _entry_path(key)
+    try:
+        os.utime(entry, None)  # LRU touch
+        shutil.copyfile(entry, out_path)
+        return True
+    except OSError:
+        return False
+
+
+_evict_lock = threading.Lock()
+
+
+def store(key: str, segment_path: Path):
+    if not cache_enabled():
+        return None
+    entry = _entry_path(key)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp = entry.with_name(f"{entry.name}.{os.getpid()}-{threading.get_ident()}.part")
+    try:
+        shutil.copyfile(segment_path, tmp)
+        os.replace(tmp, entry)
+    except OSError as e:
+        print(f"⚠️ Segment cache store failed: {e}")
+        return None
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    evict()
+    return entry
+
+
+def evict(limit_bytes: int = None):
+    limit_bytes = cache_limit_bytes() if limit_bytes is None else int(limit_bytes)
+    if not SEGMENT_CACHE_DIR.exists():
+        return 0
+
+    with _evict_lock:
+        entries = []
+        total = 0
+        for p in SEGMENT_CACHE_DIR.glob("*/*.mp4"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+            total += st.st_size
+
+        removed = 0
+        for _, size, p in sorted(entries):
+            if total <= limit_bytes:
+                break
+            try:
+                p.unlink()
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
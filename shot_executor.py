@@ -0,0 +1,185 @@
+# shot_executor.py
+# Fans per-shot work (download -> find_smooth_start -> cut) out over a bounded
+# process pool. Results come back in submission order so the shot list and
+# edit_log.json stay deterministic for a given random seed.
+
+import os
+import random
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+
+from tqdm import tqdm
+
+import asset_store
+import motion_index
+import segment_cache
+from ffmpeg_utils import (
+    cut_encode_args,
+    cut_segment,
+    get_resolution,
+    low_resource_mode,
+    pick_segment_start,
+    set_ffmpeg_threads,
+)
+
+
+def shot_workers():
+    v = os.environ.get("VIDEOSCORE_SHOT_WORKERS", "").strip()
+    if v.isdigit() and int(v) > 0:
+        return int(v)
+    if low_resource_mode():
+        return 1
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+def threads_per_worker(workers):
+    # Keep workers * threads ~= core count so parallel ffmpeg children don't oversubscribe.
+    return max(1, (os.cpu_count() or 1) // max(1, int(workers)))
+
+
+def make_shot_job(asset_id, url, seg_len, cut_path=None, target_w=1920, target_h=1080, require_portrait=False, rng=None):
+    rng = rng or random
+    return {
+        "asset_id": str(asset_id),
+        "url": url,
+        "cut_video": Path(cut_path) if cut_path else None,
+        "seg_len": float(seg_len),
+        "target_w": int(target_w),
+        "target_h": int(target_h),
+        "require_portrait": bool(require_portrait),
+        # Drawn in the parent, in order, so each shot's random choices are reproducible.
+        "seed": rng.getrandbits(32),
+    }
+
+
+def prepare_shot(job):
+    """
+    Runs in a worker process. Returns None when the clip is rejected
+    (e.g. landscape source for a portrait-only job).
+    """
+    # Own RNG, not random.seed(): two render branches may prepare shots in this process at once.
+    rng = random.Random(job["seed"])
+
+    local_video = asset_store.fetch(job["url"], job["asset_id"])
+
+    if job["require_portrait"]:
+        w, h = get_resolution(local_video)
+        if w <= 0 or h <= 0 or h <= w:
+            return None
+
+    # Proxies share the original's timeline, so a start found on one is valid on the other.
+    seg_len = job["seg_len"]
+    start, dur = pick_segment_start(
+        asset_store.analysis_source(local_video),
+        seg_len=seg_len,
+        profile=motion_index.get_profile(job["asset_id"]),
+        rng=rng,
+    )
+    source = asset_store.cut_source(local_video, job["target_w"], job["target_h"])
+
+    if job["cut_video"] is not None:
+        grid = segment_cache.snap_grid()
+        if grid > 0:
+            seg_len = segment_cache.snap(seg_len, grid, lo=grid)
+            start = segment_cache.snap(start, grid, hi=max(0.0, dur - seg_len))
+
+        key = segment_cache.segment_key(
+            job["asset_id"],
+            source.stat().st_size,
+            start,
+            seg_len,
+            job["target_w"],
+            job["target_h"],
+            cut_encode_args(job["target_w"], job["target_h"]),
+        )
+        if not segment_cache.fetch(key, job["cut_video"]):
+            cut_segment(
+                source,
+                job["cut_video"],
+                start,
+                seg_len=seg_len,
+                target_w=job["target_w"],
+                target_h=job["target_h"],
+            )
+            segment_cache.store(key, job["cut_video"])
+
+    return {
+        "asset_id": job["asset_id"],
+        "source": source,
+        "cut": job["cut_video"],
+        "start": start,
+        "duration": dur,
+        "seg_len": seg_len,
+    }
+
+
+def _init_worker(threads):
+    set_ffmpeg_threads(threads)
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except Exception:
+        pass
+
+
+@contextmanager
+def shot_pool(workers=None):
+    """
+    One shared pool per job, so concurrent render branches draw from the
+    same worker/thread budget instead of each spawning their own.
+    Yields None when running serially.
+    """
+    workers = workers or shot_workers()
+    if workers <= 1:
+        yield None
+        return
+
+    threads = threads_per_worker(workers)
+    ex = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,))
+    try:
+        yield ex
+    finally:
+        ex.shutdown()
+
+
+def prepare_shots(jobs, workers=None, desc=None, pool=None):
+    """
+    Run prepare_shot over jobs; output order always matches input order.
+    All downloads start at once (asset_store.prefetch); each shot is handed to
+    the pool as soon as its own asset lands, so network and CPU work overlap.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return []
+
+    if pool is None:
+        workers = min(workers or shot_workers(), len(jobs))
+        if workers > 1:
+            with shot_pool(workers) as ex:
+                return prepare_shots(jobs, desc=desc, pool=ex)
+
+    downloads = asset_store.prefetch([(j["url"], j["asset_id"]) for j in jobs])
+    # prefetch hands back one shared future per asset, so a clip used by several shots maps to all of them
+    index = defaultdict(list)
+    for i, f in enumerate(downloads):
+        index[f].append(i)
+    results = [None] * len(jobs)
+    pending = [None] * len(jobs)
+
+    with tqdm(total=len(jobs), desc=desc) as bar:
+        for f in as_completed(index):
+            f.result()  # surface download errors like the serial path did
+            for i in index[f]:
+                if pool is None:
+                    results[i] = prepare_shot(jobs[i])
+                    bar.update(1)
+                else:
+                    pending[i] = pool.submit(prepare_shot, jobs[i])
+                    pending[i].add_done_callback(lambda _: bar.update(1))
+
+        if pool is not None:
+            results = [p.result() for p in pending]
+
+    return results
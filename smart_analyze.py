@@ -1,8 +1,15 @@
 import cv2
 import numpy as np
-import mediapipe as mp
 
-mp_face = mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.5)
+_face_detector = None
+
+def face_detector():
+    # mediapipe is heavy and optional: load it on first use
+    global _face_detector
+    if _face_detector is None:
+        import mediapipe as mp
+        _face_detector = mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.5)
+    return _face_detector
 
 # --------------------------------------------------
 # 1) Motion Score (Optical Flow)
@@ -20,13 +27,7 @@ def motion_score(video_path):
         if not ret:
             break
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        flow = cv2.calcOpticalFlowFarneback(
-            prev, gray, None,
-            0.5, 3, 15, 3, 5, 1.2, 0
-        )
-        mag = np.sqrt(flow[...,0]**2 + flow[...,1]**2)
-        scores.append(np.mean(mag))
+        scores.append(flow_magnitude(prev, gray))
 
         prev = gray
 
@@ -34,6 +35,16 @@ def motion_score(video_path):
     return float(np.mean(scores)) if scores else 0
 
 
+def flow_magnitude(prev_gray, gray):
+    """Mean Farneback optical-flow magnitude between two gray frames."""
+    flow = cv2.calcOpticalFlowFarneback(
+        prev_gray, gray, None,
+        0.5, 3, 15, 3, 5, 1.2, 0
+    )
+    mag = np.sqrt(flow[...,0]**2 + flow[...,1]**2)
+    return float(np.mean(mag))
+
+
 # --------------------------------------------------
 # 2) Brightness Score (mean V channel)
 # --------------------------------------------------
@@ -57,8 +68,11 @@ def face_score(video_path):
     if not ret:
         return 0
     cap.release()
+    return count_faces(frame)
+
 
-    res = mp_face.process(frame[:,:,::-1])
+def count_faces(frame_bgr):
+    res = face_detector().process(frame_bgr[:,:,::-1])
     if not res.detections:
         return 0
     return float(len(res.detections))
@@ -0,0 +1,145 @@
+# tag_index.py
+# Inverted index over a text column of the clip library.
+#
+# top_tags ("waterslide, people playing in water, fun") is split into phrases;
+# each distinct phrase keeps a posting array of row positions. folder_path is
+# indexed as whole values (zone postings).
+#
+# rows_with(term) keeps the selectors' `term in text.lower()` semantics: it
+# scans the distinct phrases (a few thousand at most), not the rows, and
+# unions their postings. Terms that could straddle a ", " boundary fall back
+# to a row scan, so results are always identical to the substring test.
+
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+_INDEX_CACHE = OrderedDict()
+_INDEX_CACHE_SIZE = 16
+_index_lock = threading.Lock()
+
+
+class TagIndex:
+    def __init__(self, texts: pd.Series, split_phrases=True):
+        values = texts.fillna("").astype(str)
+        self.size = len(values)
+        self.split_phrases = split_phrases
+        self._lower = [v.lower() for v in values]
+
+        phrase_rows = {}
+        for row, text in enumerate(self._lower):
+            parts = [p.strip() for p in text.split(",")] if split_phrases else [text]
+            for phrase in parts:
+                if phrase:
+                    phrase_rows.setdefault(phrase, []).append(row)
+
+        self.phrases = {p: np.unique(np.asarray(r, dtype=np.int64)) for p, r in phrase_rows.items()}
+        self._term_rows = {}
+        self._term_masks = {}
+        self._lock = threading.Lock()
+
+    def _scan(self, term):
+        return np.fromiter((i for i, v in enumerate(self._lower) if term in v), dtype=np.int64)
+
+    def rows_with(self, term: str) -> np.ndarray:
+        """Sorted row positions whose text contains term (case-insensitive substring)."""
+        term = str(term).lower()
+        rows = self._term_rows.get(term)
+        if rows is not None:
+            return rows
+
+        if not term:
+            rows = np.arange(self.size, dtype=np.int64)
+        elif self.split_phrases and ("," in term or term != term.strip()):
+            # Could match across a phrase separator: answer from the raw strings.
+            rows = self._scan(term)
+        else:
+            hits = [r for phrase, r in self.phrases.items() if term in phrase]
+            rows = np.unique(np.concatenate(hits)) if hits else np.empty(0, dtype=np.int64)
+
+        with self._lock:
+            self._term_rows[term] = rows
+        return rows
+
+    def mask(self, term: str) -> np.ndarray:
+        """Dense bool row of rows_with(term), cached so candidate lookups are O(candidates)."""
+        term = str(term).lower()
+        m = self._term_masks.get(term)
+        if m is None:
+            m = np.zeros(self.size, dtype=bool)
+            m[self.rows_with(term)] = True
+            with self._lock:
+                self._term_masks[term] = m
+        return m
+
+    def rows_with_any(self, terms) -> np.ndarray:
+        hits = [self.rows_with(t) for t in terms]
+        return np.unique(np.concatenate(hits)) if hits else np.empty(0, dtype=np.int64)
+
+
+# Same column storage again (the shared clip_library frame): skip hashing entirely.
+# Keyed on the storage, not the Series/.array: df[col] and, for object columns,
+# Series.array are new wrapper objects on every access.
+# id(root) -> (weakref to root, {(view, split_phrases): TagIndex}); arrays aren't hashable.
+_BY_IDENTITY = {}
+
+
+def _storage(texts: pd.Series):
+    """(root object owning the column's values, where the column sits in it)."""
+    values = texts._values
+    if not isinstance(values, np.ndarray):
+        return values, None  # extension arrays (string dtype) are the storage themselves
+    root = values
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    return root, (values.__array_interface__["data"][0], values.strides, values.shape)
+
+
+def _identity_entry(root):
+    entry = _BY_IDENTITY.get(id(root))
+    if entry is not None and entry[0]() is root:
+        return entry[1]
+    return None
+
+
+def index_for(texts: pd.Series, split_phrases=True) -> TagIndex:
+    """TagIndex for this column content (cached: copies/reloads of an unchanged library reuse it)."""
+    root, view = _storage(texts)
+    key = (view, bool(split_phrases))
+    hits = _identity_entry(root)
+    if hits is not None and key in hits:
+        return hits[key]
+
+    idx = _index_by_content(texts, split_phrases)
+    try:
+        ref = weakref.ref(root, lambda _, k=id(root): _BY_IDENTITY.pop(k, None))
+    except TypeError:
+        return idx
+    with _index_lock:
+        hits = _identity_entry(root)
+        if hits is None:
+            hits = {}
+            _BY_IDENTITY[id(root)] = (ref, hits)
+        hits[key] = idx
+    return idx
+
+
+def _index_by_content(texts: pd.Series, split_phrases) -> TagIndex:
+    values = texts.fillna("").astype(str)
+    digest = hashlib.sha1(pd.util.hash_pandas_object(values, index=False).to_numpy().tobytes()).hexdigest()
+    key = (len(values), digest, bool(split_phrases))
+    with _index_lock:
+        idx = _INDEX_CACHE.get(key)
+        if idx is not None:
+            _INDEX_CACHE.move_to_end(key)
+            return idx
+    idx = TagIndex(values, split_phrases=split_phrases)
+    with _index_lock:
+        _INDEX_CACHE[key] = idx
+        while len(_INDEX_CACHE) > _INDEX_CACHE_SIZE:
+            _INDEX_CACHE.popitem(last=False)
+    return idx
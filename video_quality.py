@@ -24,20 +24,27 @@ def analyze_video_file(path, num_samples=NUM_FRAMES_SAMPLE):
 
     idxs = np.linspace(0, frame_count - 1, num=min(num_samples, frame_count), dtype=int)
 
-    sharpness_list = []
-    brightness_list = []
-    motion_list = []
-
-    prev_gray = None
-
+    grays = []
     for idx in idxs:
         cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
         ret, frame = cap.read()
         if not ret or frame is None:
             continue
+        grays.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+
+    cap.release()
+    return quality_metrics(grays)
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
+def quality_metrics(grays):
+    """Sharpness/brightness/motion of evenly spaced gray frames (None if there are none)."""
+    sharpness_list = []
+    brightness_list = []
+    motion_list = []
+
+    prev_gray = None
+
+    for gray in grays:
         s = calc_sharpness(gray)
         b = calc_brightness(gray)
         sharpness_list.append(s)
@@ -50,8 +57,6 @@ def analyze_video_file(path, num_samples=NUM_FRAMES_SAMPLE):
 
         prev_gray = gray
 
-    cap.release()
-
     if not sharpness_list:
         return None
 
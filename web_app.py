@@ -13,7 +13,8 @@ import shutil
 import logging
 
 # Import the main function directly
-from generate_edit import main as generate_video
+from generate_edit import main as generate_video, warm_outros
+from job_queue import JobQueue, QueueFull
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'aquaverse-video-generator-2026'
@@ -100,6 +101,16 @@ def process_video_generation(job_id, prompt):
         import traceback
         traceback.print_exc()
 
+# Fixed worker count + bounded FIFO (VIDEOSCORE_JOB_WORKERS / VIDEOSCORE_JOB_QUEUE)
+job_queue = JobQueue(process_video_generation, name="video")
+
+def queue_info(job_id):
+    """Queue position + rough wait for a job that hasn't started yet (None otherwise)"""
+    position = job_queue.position(job_id)
+    if position is None:
+        return None
+    return {'queue_position': position, 'eta_seconds': job_queue.eta_seconds(position)}
+
 @app.route('/')
 def index():
     """Main page"""
@@ -130,34 +141,41 @@ def api_generate():
             'created_at': datetime.now().isoformat()
         }
     
-    # Start background thread
-    thread = threading.Thread(
-        target=process_video_generation,
-        args=(job_id, prompt),
-        daemon=True
-    )
-    thread.start()
+    # Hand it to the bounded worker pool (FIFO); a full queue means come back later
+    try:
+        position = job_queue.submit(job_id, prompt)
+    except QueueFull as e:
+        with jobs_lock:
+            del jobs_db[job_id]
+        response = jsonify({
+            'error': f'The server is busy, please try again in about {e.retry_after} seconds',
+            'retry_after': e.retry_after
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
     
-    return jsonify({'job_id': job_id})
+    return jsonify({'job_id': job_id, 'queue_position': position})
 
 @app.route('/api/jobs')
 def get_jobs():
     """Get all active jobs"""
     cleanup_old_jobs()
     with jobs_lock:
-        return jsonify({
-            'jobs': [
-                {
-                    'id': job_id,
-                    'status': job.get('status', 'unknown'),
-                    'message': job.get('message', ''),
-                    'progress': job.get('progress', 0),
-                    'created_at': job.get('created_at', ''),
-                    'completed_at': job.get('completed_at'),
-                }
-                for job_id, job in jobs_db.items()
-            ]
-        })
+        jobs = [
+            {
+                'id': job_id,
+                'status': job.get('status', 'unknown'),
+                'message': job.get('message', ''),
+                'progress': job.get('progress', 0),
+                'created_at': job.get('created_at', ''),
+                'completed_at': job.get('completed_at'),
+            }
+            for job_id, job in jobs_db.items()
+        ]
+    for job in jobs:
+        if job['status'] == 'queued':
+            job['queue_position'] = job_queue.position(job['id'])
+    return jsonify({'jobs': jobs, 'queue': job_queue.stats()})
 
 @app.route('/api/status/<job_id>')
 def api_status(job_id):
@@ -177,6 +195,14 @@ def api_status(job_id):
         'created_at': job['created_at']
     }
     
+    if job['status'] == 'queued':
+        info = queue_info(job_id)
+        if info:
+            response.update(info)
+            response['message'] = (
+                f"Waiting in queue (position {info['queue_position']}, about {info['eta_seconds']}s)..."
+            )
+    
     if job['status'] == 'completed':
         response['download_urls'] = {
             '169': f'/api/download/{job_id}/169',
@@ -226,6 +252,10 @@ def periodic_cleanup():
 cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
 cleanup_thread.start()
 
+# Pre-encode the outro variants so the first job doesn't pay for them
+outro_warm_thread = threading.Thread(target=warm_outros, daemon=True)
+outro_warm_thread.start()
+
 if __name__ == '__main__':
     # Get port from environment (for Railway/Render) or default to 5000
     port = int(os.environ.get('PORT', 5000))